@@ -0,0 +1,95 @@
+"""Benchmark rxtb startup time for commands that don't talk to AWS
+
+Run from a directory with rxtb-config.yaml and rxtb-profile.yaml:
+
+    python benchmarks/bench_startup.py [--runs 10] [--max-ms 200]
+
+Exits with 1 if the median startup time of any command exceeds --max-ms, and
+fails if a command imports one of the heavy modules listed in HEAVY_MODULES.
+"""
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+COMMANDS = [
+    ["--help"],
+    ["run", "list-commands"],
+]
+
+# Modules that must not be imported by the commands above
+HEAVY_MODULES = ["boto3", "botocore", "pandas", "docker"]
+
+CHECK_IMPORTS = (
+    "import sys\n"
+    "from rixtribute.cli import main\n"
+    "try:\n"
+    "    main(sys.argv[1:])\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "print(','.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)\n"
+)
+
+def time_command(args :list, runs :int) -> float:
+    """Median wall time in ms of `python -m rixtribute <args>`"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "rixtribute"] + args,
+                       stdout=subprocess.DEVNULL,
+                       stdin=subprocess.DEVNULL,
+                       check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def heavy_imports(args :list) -> list:
+    """Heavy modules imported when running rxtb <args>"""
+    res = subprocess.run([sys.executable, "-c", CHECK_IMPORTS.format(heavy=HEAVY_MODULES)] + args,
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE,
+                         stdin=subprocess.DEVNULL,
+                         universal_newlines=True,
+                         check=True)
+    last_line = res.stderr.strip().splitlines()[-1] if res.stderr.strip() else ''
+    return [x for x in last_line.split(",") if x]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    # Interpreter startup alone, to put the numbers in perspective
+    baseline_ms = statistics.median(
+        _time_python(args.runs)
+    )
+    print(f"{'python -c pass':30s} {baseline_ms:8.1f} ms")
+
+    failed = False
+    for command in COMMANDS:
+        median_ms = time_command(command, args.runs)
+        imported = heavy_imports(command)
+
+        status = "ok"
+        if median_ms > args.max_ms:
+            status = f"SLOW (> {args.max_ms:.0f} ms)"
+            failed = True
+        if imported:
+            status = f"IMPORTS {', '.join(imported)}"
+            failed = True
+
+        print(f"{'rxtb ' + ' '.join(command):30s} {median_ms:8.1f} ms  {status}")
+
+    sys.exit(1 if failed else 0)
+
+def _time_python(runs :int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+if __name__ == "__main__":
+    main()
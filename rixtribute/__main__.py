@@ -2,6 +2,6 @@
 
 __version__ = "0.0.1"
 
-from .main import main
+from .cli import main
 
 main()
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import contextlib
+from typing import Any, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, writes are then only serialized within the process
+    fcntl = None
+
+def get_cache_dir() -> str:
+    """Directory for rixtribute's local caches, shared across invocations
+    Uses RIXTRIBUTE_CACHE_DIR if set, else $XDG_CACHE_HOME/rixtribute or ~/.cache/rixtribute
+    """
+    cache_dir = os.environ.get("RIXTRIBUTE_CACHE_DIR", None)
+    if cache_dir is None:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        cache_dir = os.path.join(xdg_cache, "rixtribute")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+class FileCache(object):
+    """Small persistent key/value cache stored as a json file in the cache dir
+
+    Entries are stored with the time they were written, and are treated as
+    missing when they are older than the ttl (seconds, None = never expire).
+    """
+
+    def __init__(self, name :str, ttl :Optional[float]=None):
+        self.name = name
+        self.ttl = ttl
+        self.file_path = os.path.join(get_cache_dir(), f"{name}.json")
+        self._lock = threading.RLock()
+        self._entries :Optional[dict] = None
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return "|".join(str(x) for x in parts)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.file_path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            # Missing or corrupt cache file is the same as an empty cache
+            return {}
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Exclusive lock on the cache file across processes, held while the
+        entries on disk are read, changed and written back"""
+        if fcntl is None:
+            yield
+            return
+
+        with open(self.file_path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _save(self):
+        # Write to a tempfile and rename it, so concurrent invocations never
+        # read a half written cache file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.file_path), prefix=f".{self.name}-")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.file_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise e
+
+    def has(self, key :str, ttl :Optional[float]=None) -> bool:
+        """True if key is cached and has not expired"""
+        with self._lock:
+            entry = self._load().get(key, None)
+            if entry is None:
+                return False
+
+            ttl = self.ttl if ttl is None else ttl
+            if ttl is not None and time.time() - entry["ts"] > ttl:
+                return False
+            return True
+
+    def get(self, key :str, default :Any=None, ttl :Optional[float]=None) -> Any:
+        """Get value for key, default if missing or expired"""
+        with self._lock:
+            if not self.has(key, ttl=ttl):
+                return default
+            return self._entries[key]["value"]
+
+    def items(self, ttl :Optional[float]=None) -> List[Tuple[str, Any]]:
+        """(key, value) of all entries that have not expired, oldest first"""
+        with self._lock:
+            entries = sorted(self._load().items(), key=lambda x: x[1]["ts"])
+            return [(key, entry["value"]) for key, entry in entries if self.has(key, ttl=ttl)]
+
+    def set(self, key :str, value :Any):
+        self.update({key: value})
+
+    def update(self, values :dict):
+        """Set several keys with a single write to disk, merged with the
+        entries other FileCache objects and processes have written meanwhile"""
+        with self._lock, self._file_lock():
+            entries = self._read()
+            now = time.time()
+            for key, value in values.items():
+                entries[key] = {"ts": now, "value": value}
+            self._entries = entries
+            self._save()
+
+    def delete(self, key :str):
+        with self._lock, self._file_lock():
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._entries = entries
+                self._save()
+            else:
+                self._load().pop(key, None)
+
+    def clear(self):
+        with self._lock, self._file_lock():
+            self._entries = {}
+            self._save()
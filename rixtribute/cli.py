@@ -1,14 +1,55 @@
 import sys
+import importlib
 import click
-from rixtribute.commands.ec2 import ec2 as ec2_commands
-from rixtribute.commands.ecr import ecr as ecr_commands
-from rixtribute.commands.container import container as container_commands
-from rixtribute.commands.init import init as init_commands
-from rixtribute.commands.run import run as run_commands
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
-@click.group(invoke_without_command=True, context_settings=CONTEXT_SETTINGS)
+class LazyGroup(click.Group):
+    """click Group that imports its command groups on first use
+
+    The command modules pull in heavy dependencies, so only the module of the
+    invoked command is imported, e.g. `rxtb run list-commands` never imports
+    the ec2 commands.
+    """
+
+    def __init__(self, *args, lazy_subcommands :dict=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # command name -> "module.path:attribute"
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(list(super().list_commands(ctx)) + list(self.lazy_subcommands.keys()))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands:
+            return self._lazy_load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _lazy_load(self, cmd_name):
+        import_path = self.lazy_subcommands[cmd_name]
+        module_name, attr_name = import_path.split(":")
+        module = importlib.import_module(module_name)
+        cmd_object = getattr(module, attr_name)
+        if not isinstance(cmd_object, click.BaseCommand):
+            raise ValueError(f"Lazy loading of {import_path} failed, it is not a click command")
+
+        # Cache it, so it is only loaded once
+        self.add_command(cmd_object, cmd_name)
+        del self.lazy_subcommands[cmd_name]
+        return cmd_object
+
+
+## Add command groups
+@click.group(cls=LazyGroup,
+             invoke_without_command=True,
+             context_settings=CONTEXT_SETTINGS,
+             lazy_subcommands={
+                 "ec2": "rixtribute.commands.ec2:ec2",
+                 "ecr": "rixtribute.commands.ecr:ecr",
+                 "container": "rixtribute.commands.container:container",
+                 "init": "rixtribute.commands.init:init",
+                 "run": "rixtribute.commands.run:run",
+             })
 @click.pass_context
 @click.option('--verbose', '-v', is_flag=True, help="Increase output verbosity")
 def main(ctx, verbose):
@@ -25,12 +66,3 @@ def main(ctx, verbose):
     ctx.obj = {
         'VERBOSE': verbose
     }
-
-
-
-## Add command groups
-main.add_command(ec2_commands)
-main.add_command(ecr_commands)
-main.add_command(container_commands)
-main.add_command(init_commands)
-main.add_command(run_commands)
@@ -1,10 +1,9 @@
 import sys
 import click
-import pandas as pd
-from tabulate import tabulate
 from rixtribute import container_utils
 from typing import Optional, List
 from rixtribute.helper import filter_list_of_dicts
+from rixtribute.output import print_rows, OUTPUT_FORMATS
 
 # import rixtribute.container
 from rixtribute.configuration import config, profile
@@ -29,13 +28,16 @@ def container(ctx):
 
 @container.command(help="List configured containers")
 # @click.option('--all', '-a', is_flag=True, help="list all repositiories")
+@click.option('--output', '-o', 'output_format', type=click.Choice(OUTPUT_FORMATS), default="table",
+              help="output format")
 @click.pass_context
-def list(ctx):
+def list(ctx, output_format):
     cfg_containers = config.get_containers()
     containers = filter_list_of_dicts(cfg_containers, ["name", "file"])
 
-    print("Containers from configuration file:")
-    print(tabulate(pd.DataFrame(containers), headers='keys'))
+    if output_format == "table":
+        print("Containers from configuration file:")
+    print_rows(containers, output_format)
 
 
 @container.command(help="Build docker container")
@@ -47,7 +49,7 @@ def build(ctx):
     containers = filter_list_of_dicts(cfg_containers, ["name", "file"])
 
     print("Containers from configuration file:")
-    print(tabulate(pd.DataFrame(containers), headers='keys'))
+    print_rows(containers)
     n = int(click.prompt("Choose container to build"))
 
     container_cfg = cfg_containers[n]
@@ -65,7 +67,7 @@ def push(ctx):
 
     # Select image to push
     print("Image from configuration file:")
-    print(tabulate(pd.DataFrame(containers), headers='keys'))
+    print_rows(containers)
     n = int(click.prompt("Choose container to push"))
 
     push_tag = [x["tag"] for x in containers][n] + ":latest"
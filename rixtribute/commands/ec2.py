@@ -1,10 +1,12 @@
 import sys
 import os
 import click
-import pandas as pd
-from tabulate import tabulate
 import glob
 
+from rixtribute.output import print_rows, OUTPUT_FORMATS
+from rixtribute.transfer import DEFAULT_STREAMS, TRANSFER_MODES
+from rixtribute.commands.selection import selector_options, run_on_instances
+
 from rixtribute import container_utils
 from rixtribute.configuration import config, profile
 from rixtribute.ec2 import EC2, EC2Instance
@@ -27,30 +29,33 @@ def ec2(ctx):
 @ec2.command(short_help="List instances")
 @click.pass_context
 @click.option('--all', '-a', is_flag=True, help="list all instances")
-def list_instances(ctx, all):
+@click.option('--output', '-o', 'output_format', type=click.Choice(OUTPUT_FORMATS), default="table",
+              help="output format")
+@click.option('--refresh', is_flag=True, help="read instances from AWS, not the local cache")
+@click.option('--all-regions', is_flag=True, help="list instances in all regions, not only the configured ones")
+def list_instances(ctx, all, output_format, refresh, all_regions):
     """ List instances """
-    ec2_instances = EC2.list_instances(profile, all)
+    ec2_instances = EC2.list_instances(profile, all, refresh=refresh, all_regions=all_regions)
 
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
+    print_rows([instance.get_printable_dict() for instance in ec2_instances], output_format)
 
-@ec2.command(short_help="Start an instance")
-@click.pass_context
-def start(ctx):
-    """ Start an instance from rxtb-config.yaml instance section"""
+def _choose_instance_cfg(action :str) -> dict:
+    """Prompt for an instance from rxtb-config.yaml"""
     cfg_instances = config.get_instances().copy()
     # Drop config from instanes
     [x.pop("config", None) for x in cfg_instances]
 
     print("Instances from configuration file:")
-    print(tabulate(pd.DataFrame(cfg_instances), headers='keys'))
+    print_rows(cfg_instances)
 
     # n = int(input("Choose instance to start: "))
-    n = int(click.prompt("Choose instance to start"))
+    n = int(click.prompt(f"Choose instance to {action}"))
 
-    print(f"starting instance {n}...")
-    instance_cfg = config.get_instance(cfg_instances[n]["name"])
+    print(f"{action} instance {n}...")
+    return config.get_instance(cfg_instances[n]["name"])
 
-    # Docker container
+def _push_container(instance_cfg :dict):
+    """Build the instance's docker container, if any, and push it to ECR"""
     docker_container_name = instance_cfg.get('container', None)
     if docker_container_name is not None:
         container_cfg = config.get_container(docker_container_name)
@@ -75,57 +80,145 @@ def start(ctx):
         docker_image.tag(repo.repository_uri, 'latest')
         container_utils.docker_push(repo.repository_uri, 'latest', auth_config)
 
+@ec2.command(short_help="Start an instance")
+@click.option('--count', '-n', default=1, show_default=True, help="number of instances to start")
+@click.option('--quorum', '-q', default=None, type=int,
+              help="return when this many instances are ready, default all")
+@click.option('--no-baked', is_flag=True, help="start from the configured AMI, not a baked one")
+@click.pass_context
+def start(ctx, count, quorum, no_baked):
+    """ Start an instance from rxtb-config.yaml instance section"""
+    instance_cfg = _choose_instance_cfg("start")
+
+    _push_container(instance_cfg)
+
     if instance_cfg['provider'] == "aws":
         if instance_cfg['config']["spot"] is True:
-            EC2.create_spot_instance(instance_cfg)
+            # Resume parked instances from the warm pool before requesting new ones
+            resumed = EC2.resume_parked_instances(instance_cfg, count=count)
+            if len(resumed) >= count:
+                return
+            quorum = None if quorum is None else max(quorum - len(resumed), 1)
+            EC2.create_spot_instances(instance_cfg,
+                                      count=count - len(resumed),
+                                      quorum=quorum,
+                                      use_baked_image=not no_baked)
         else:
             # TODO START NON-SPOT INSTANCE
             pass
 
+@ec2.command(short_help="Bake an AMI with the container pulled")
+@click.pass_context
+def bake(ctx):
+    """ Bake an AMI from an rxtb-config.yaml instance with its container
+    already pulled. Later starts of the instance use the baked AMI while the
+    container image is unchanged. """
+    instance_cfg = _choose_instance_cfg("bake")
+
+    if instance_cfg.get('container', None) is None:
+        print("Instance has no container, nothing to bake")
+        sys.exit(1)
+
+    _push_container(instance_cfg)
+
+    if instance_cfg['provider'] == "aws":
+        image_id = EC2.bake_image(instance_cfg)
+        print(f"Baked image: {image_id}")
+
 @ec2.command(short_help="Stop a running instance")
+@click.option('--terminate', is_flag=True, help="terminate, even if the warm pool has room")
+@selector_options
 @click.pass_context
-def stop(ctx):
-    """Stop a running instance"""
-    ec2_instances = EC2.list_instances(profile, all)
+def stop(ctx, terminate, selector):
+    """Stop running instances
 
-    if len(ec2_instances) <= 0:
-        print("You have no instances running")
-        sys.exit(0)
+    Instances whose config has a warm_pool are parked (stopped) while the
+    pool has room, and resumed by the next start of that instance config.
+    Other instances are terminated.
 
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
+    Examples:
 
-    n = int(click.prompt("Choose instance to stop"))
+      rxtb ec2 stop --name gpu-iptc-1a2b3c
 
-    print(f"stopping instance {n}...")
-    ec2_instances[n].terminate()
+      rxtb ec2 stop --glob "train-*" --terminate
+    """
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "stop")
+
+    park = EC2.plan_release(selected, terminate=terminate)
+
+    print(f"stopping {len(selected)} instance(s)...")
+    success = run_on_instances(selected, lambda x: EC2.release_instance(x, park=x.instance_id in park))
+    EC2.list_instances(profile, refresh=True)
+    if not success:
+        sys.exit(1)
 
 
 @ec2.command(short_help="SSH into an instance")
+@selector_options
 @click.pass_context
-def ssh(ctx):
+def ssh(ctx, selector):
     """SSH into an instance"""
-    ec2_instances = EC2.list_instances(profile, all)
-
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    ec2_instance = selector.choose(ec2_instances, "ssh into", single=True)[0]
 
-    n = int(click.prompt("Choose instance to ssh into"))
-
-    ec2_instances[n].ssh()
+    ec2_instance.ssh()
 
 
 
 @ec2.command(short_help="List available regions")
+@click.option('--output', '-o', 'output_format', type=click.Choice(OUTPUT_FORMATS), default="table",
+              help="output format")
 @click.pass_context
-def list_regions(ctx):
+def list_regions(ctx, output_format):
     """ List available regions """
     regions = EC2.list_regions()
-    print(tabulate(pd.DataFrame(regions, columns=["region"]), headers='keys'))
+    print_rows([{"region": region} for region in regions], output_format)
+
+@ec2.command(short_help="List launch timings")
+@click.option('--output', '-o', 'output_format', type=click.Choice(OUTPUT_FORMATS), default="table",
+              help="output format")
+@click.pass_context
+def list_launch_timings(ctx, output_format):
+    """ List the per-phase timings of earlier launches, in seconds since the
+    spot request was sent """
+    rows = []
+    for report in EC2.list_launch_reports():
+        launch = {k: report[k] for k in ["name", "started", "instance-type", "zone", "ami", "container"]}
+        rows += [dict(launch, **row) for row in EC2.launch_timing_rows(report["instances"])]
+    print_rows(rows, output_format)
+
+@ec2.command(short_help="Watch instances for spot interruptions")
+@click.option('--directory', '-d', 'dest', default='.', show_default=True, type=click.Path(exists=True),
+              help="directory for checkpoints pulled from interrupted instances")
+@click.option('--interval', default=30, show_default=True, help="seconds between polls")
+@click.option('--refresh', is_flag=True, help="read instances from AWS, not the local cache")
+@click.pass_context
+def watch(ctx, dest, interval, refresh):
+    """ Watch running instances for spot interruption notices and record them.
+    Instances with a checkpoint dir that is not synced to S3 get it pulled to
+    DIRECTORY/<instance id> on notice. Stop with ctrl-c. """
+    ec2_instances = EC2.list_instances(profile, refresh=refresh)
+    print(f"Watching {len([x for x in ec2_instances if x.status == 'running'])} running instance(s)...")
+    try:
+        EC2.watch_interruptions(ec2_instances, dest=dest, interval=interval)
+    except KeyboardInterrupt:
+        pass
+
+@ec2.command(short_help="List spot interruptions")
+@click.option('--output', '-o', 'output_format', type=click.Choice(OUTPUT_FORMATS), default="table",
+              help="output format")
+@click.pass_context
+def list_interruptions(ctx, output_format):
+    """ List spot interruption events recorded by rxtb ec2 watch """
+    print_rows(EC2.list_interruptions(), output_format)
 
 @ec2.command(short_help="List spot prices")
 @click.option('--region', '-r', 'regions_', multiple=True, type=str)
 @click.option('--instance-type', '-i', 'instance_types_', multiple=True, type=str)
+@click.option('--refresh', is_flag=True, help="refetch cached on-demand prices")
 @click.pass_context
-def list_spot_pricing(ctx, regions_, instance_types_):
+def list_spot_pricing(ctx, regions_, instance_types_, refresh):
     """List pricing on spot instances
 
     Examples:
@@ -134,6 +227,9 @@ def list_spot_pricing(ctx, regions_, instance_types_):
 
       rxtb ec2 list-spot-pricing --region eu-west-1 --region eu-west-2 --instance-type m5.xlarge
     """
+    import pandas as pd
+    from tabulate import tabulate
+
     # get all regions
     regions = regions_
     instance_types = instance_types_
@@ -153,8 +249,8 @@ def list_spot_pricing(ctx, regions_, instance_types_):
 
     click.echo(f'Getting spot instance prices for: {instance_types}\n')
 
-    spot_prices = EC2.list_spot_prices(instance_types, regions)
-    ondemand_prices = EC2.list_prices(instance_types=instance_types, region_names=regions)
+    spot_prices = EC2.list_spot_prices(instance_types, regions, aggregate=True)
+    ondemand_prices = EC2.list_prices(instance_types=instance_types, region_names=regions, refresh=refresh)
     # __import__('pdb').set_trace()
 
     ## Merge spot and ondemand prices for displaying
@@ -170,9 +266,8 @@ def list_spot_pricing(ctx, regions_, instance_types_):
     df_spot_prices["price-reduction"] = df_spot_prices["price-ondemand"] - df_spot_prices["price-spot"]
     df_spot_prices["price-reduction-percent"] = (1 - (df_spot_prices["price-spot"] / df_spot_prices["price-ondemand"])) *100
     df_spot_prices["price-reduction-percent"].apply(lambda x: f"{x:.2f}")
-    df_spot_prices = df_spot_prices.drop(columns=["region-name"])
-    df_spot_prices.columns = ["zone","price-spot","instance-type","price-ondemand","price-reduction","price-reduction-percent"]
-    df_spot_prices = df_spot_prices[["zone","instance-type","price-spot","price-ondemand","price-reduction","price-reduction-percent"]]
+    df_spot_prices = df_spot_prices[["zone","instance-type","price-spot","price-min","price-mean","price-p95",
+                                     "price-ondemand","price-reduction","price-reduction-percent"]]
 
     df_spot_prices = df_spot_prices.sort_values(["instance-type","price-spot"], ascending=True).reset_index(drop=True)
     group = df_spot_prices.groupby('instance-type')
@@ -183,13 +278,18 @@ def list_spot_pricing(ctx, regions_, instance_types_):
 
 @ec2.command(short_help="SCP files to/from instance")
 @click.option('--recursive', '-r', is_flag=True)
+@click.option('--streams', '-j', default=DEFAULT_STREAMS, show_default=True, help="number of concurrent transfer streams")
+@click.option('--mode', '-m', type=click.Choice(TRANSFER_MODES), default="auto", show_default=True,
+              help="tar streams many small files over one channel, ranges uses parallel streams")
+@selector_options
 @click.argument('source', nargs=1)
 @click.argument('dest', nargs=1)
 @click.pass_context
-def scp(ctx, recursive, source, dest):
+def scp(ctx, recursive, streams, mode, source, dest, selector):
     """\b SCP files to/from instance
 
-    use server:/file/path.txt to select instance from running instances
+    use server:/file/path.txt to select instances from running instances,
+    files copied from several instances go to DEST/<instance name>
 
     In some terminals globs are expanded, therefore put them in "" like: ".dir/**/*.py"
 
@@ -199,6 +299,8 @@ def scp(ctx, recursive, source, dest):
 
       rxtb ec2 scp server:/path/to/source.txt /path/to/dest.txt
 
+      rxtb ec2 scp --glob "train-*" /path/to/source.txt server:/path/to/dest.txt
+
       rxtb ec2 scp /path/to/dest.txt ec2-user@ec2-34-255-217-225.eu-west-1.compute.amazonaws.com:~/workdir/
     """
 
@@ -215,21 +317,12 @@ def scp(ctx, recursive, source, dest):
         else:
             remote_path_index = i
 
-    ## select or find matching EC2 Instance
-
-    if 'server:' in paths[remote_path_index]:
-        ec2_instances = EC2.list_instances(profile, all)
-        print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
+    ## select or find matching EC2 Instances
 
-        n = int(click.prompt("Choose server to cp to"))
-        ec2_instance = ec2_instances[n]
-
-        tmp_remote_path = paths[remote_path_index]
-        new_remote = f"{ec2_instance.get_username()}@{ec2_instance.public_dns}"
-        paths[remote_path_index] = f"{new_remote}:{tmp_remote_path.split(':')[-1]}"
-
-        if ctx.obj["VERBOSE"]:
-            print(f'substituting remote: "server:" -> "{new_remote}"')
+    use_server = 'server:' in paths[remote_path_index]
+    if use_server:
+        ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+        selected = selector.choose(ec2_instances, "copy with")
     else:
         dns_name = paths[remote_path_index].split(':')[0].split('@')[-1]
         ec2_instance = EC2.get_instance_from_dns_name(dns_name)
@@ -237,25 +330,47 @@ def scp(ctx, recursive, source, dest):
         if ec2_instance is None:
             print("No instances with dns_name={dns_name}")
             sys.exit()
+        selected = [ec2_instance]
+
+    def _scp(ec2_instance) -> bool:
+        instance_paths = list(paths)
+        if use_server:
+            tmp_remote_path = paths[remote_path_index]
+            new_remote = f"{ec2_instance.get_username()}@{ec2_instance.public_dns}"
+            instance_paths[remote_path_index] = f"{new_remote}:{tmp_remote_path.split(':')[-1]}"
 
-    source, dest = paths
+            if ctx.obj["VERBOSE"]:
+                print(f'substituting remote: "server:" -> "{new_remote}"')
 
-    # Verbose
-    if ctx.obj["VERBOSE"]:
-        print("files:")
-        print(f" {source}")
+        # Keep files from several instances apart
+        if remote_path_index == 0 and len(selected) > 1:
+            instance_paths[1] = os.path.join(instance_paths[1], ec2_instance.instance_name or ec2_instance.instance_id)
+            os.makedirs(instance_paths[1], exist_ok=True)
 
-        print("destination:")
-        print(f" {dest}")
+        source, dest = instance_paths
 
-    if not ec2_instance.scp(source=source, dest=dest, recursive=recursive):
+        # Verbose
+        if ctx.obj["VERBOSE"]:
+            print("files:")
+            print(f" {source}")
+
+            print("destination:")
+            print(f" {dest}")
+
+        return ec2_instance.scp(source=source, dest=dest, recursive=recursive, streams=streams, mode=mode)
+
+    if not run_on_instances(selected, _scp):
         sys.exit(1)
 
 @ec2.command(short_help="Copy files to instance")
 @click.option('--recursive', '-r', is_flag=True)
+@click.option('--streams', '-j', default=DEFAULT_STREAMS, show_default=True, help="number of concurrent transfer streams")
+@click.option('--mode', '-m', type=click.Choice(TRANSFER_MODES), default="auto", show_default=True,
+              help="tar streams many small files over one channel, ranges uses parallel streams")
+@selector_options
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
 @click.pass_context
-def copy_to(ctx, recursive, files):
+def copy_to(ctx, recursive, streams, mode, files, selector):
     """\b Copy files to instance workdir
 
     In some terminals globs are expanded, therefore put them in "" like: ".dir/**/*.py"
@@ -265,17 +380,19 @@ def copy_to(ctx, recursive, files):
       rxtb ec2 copy-to file1 /path/to/file2\n
 
       rxtb ec2 copy-to -r path/to/dir
-    """
 
-    ec2_instances = EC2.list_instances(profile, all)
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
+      rxtb ec2 copy-to --all -r path/to/dir
+    """
 
-    n = int(click.prompt("Choose server to copy to"))
-    ec2_instance = ec2_instances[n]
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "copy to")
 
     files = list(files)
 
-    if not ec2_instance.copy_files_to_workdir(files, recursive=recursive):
+    if not run_on_instances(selected, lambda x: x.copy_files_to_workdir(files,
+                                                                         recursive=recursive,
+                                                                         streams=streams,
+                                                                         mode=mode)):
         sys.exit(1)
 
 @ec2.command(short_help="Copy files from instance")
@@ -283,11 +400,17 @@ def copy_to(ctx, recursive, files):
 @click.option('--directory', '-d', help="output directory",
               default='.',
               type=click.Path(exists=True, dir_okay=True, file_okay=False))
+@click.option('--streams', '-j', default=DEFAULT_STREAMS, show_default=True, help="number of concurrent transfer streams")
+@click.option('--mode', '-m', type=click.Choice(TRANSFER_MODES), default="auto", show_default=True,
+              help="tar streams many small files over one channel, ranges uses parallel streams")
+@selector_options
 @click.argument('files', nargs=-1, type=click.Path(exists=False))
 @click.pass_context
-def copy_from(ctx, recursive, directory, files):
+def copy_from(ctx, recursive, directory, streams, mode, files, selector):
     """\b Copy files from instance
 
+    Files copied from several instances go to DIRECTORY/<instance name>
+
     In some terminals globs are expanded, therefore put them in "" like: ".dir/**/*.py"
 
     Examples:
@@ -301,41 +424,94 @@ def copy_from(ctx, recursive, directory, files):
       rxtb ec2 copy-from -r -d output_dir path/to/output_dir
     """
 
-    ec2_instances = EC2.list_instances(profile, all)
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
-
-    n = int(click.prompt("Choose server to copy from"))
-    ec2_instance = ec2_instances[n]
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "copy from")
 
     files = list(files)
 
-    if not ec2_instance.copy_files_from_workdir(files,
-            recursive=recursive,
-            dest=directory):
+    def _copy_from(ec2_instance) -> bool:
+        dest = directory
+        # Keep files from several instances apart
+        if len(selected) > 1:
+            dest = os.path.join(directory, ec2_instance.instance_name or ec2_instance.instance_id)
+            os.makedirs(dest, exist_ok=True)
+
+        return ec2_instance.copy_files_from_workdir(files,
+                                                    recursive=recursive,
+                                                    dest=dest,
+                                                    streams=streams,
+                                                    mode=mode)
+
+    if not run_on_instances(selected, _copy_from):
+        sys.exit(1)
+
+
+@ec2.command(short_help="Sync project to instance")
+@click.option('--dest', '-d', help="remote directory, default the workdir", default=None)
+@click.option('--full', is_flag=True, help="send all files, not only the changed ones")
+@selector_options
+@click.pass_context
+def sync(ctx, dest, full, selector):
+    """\b Sync project to instance workdir
+
+    Files are selected by the project sync section in rxtb-config.yaml, and
+    only files changed since the last sync to the instance are sent.
+
+    Examples:
+
+      rxtb ec2 sync
+
+      rxtb ec2 sync --dest /workdir/project
+
+      rxtb ec2 sync --tag project=rxtb-test
+    """
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "sync to")
+
+    if not run_on_instances(selected, lambda x: x.sync_project(dest=dest, full=full, verbose=ctx.obj["VERBOSE"])):
         sys.exit(1)
 
 
 @ec2.command(help="List files in workdir")
+@selector_options
 @click.pass_context
-def list_files(ctx):
-    ec2_instances = EC2.list_instances(profile, all)
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
+def list_files(ctx, selector):
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "list files on")
 
-    n = int(click.prompt("Choose server to copy from"))
-    ec2_instance = ec2_instances[n]
-    ec2_instance.list_files()
+    if not run_on_instances(selected, lambda x: x.list_files()):
+        sys.exit(1)
 
     # TODO:
     # PULL docker image
     # docker pull aws_account_id.dkr.ecr.us-west-2.amazonaws.com/amazonlinux:latest
 
-@ec2.command(help="Run command")
+@ec2.command(short_help="Run a shell command on instances")
+@selector_options
+@click.argument('command', nargs=-1, required=True)
 @click.pass_context
-def cmd(ctx):
-    ec2_instances = EC2.list_instances(profile, all)
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
-
-    n = int(click.prompt("Choose server to copy from"))
-    print(n)
-    # ec2_instance = ec2_instances[n]
-    # ec2_instance.list_files()
+def cmd(ctx, command, selector):
+    """\b Run a shell command on instances, outside the container
+
+    Examples:
+
+      rxtb ec2 cmd --all -- nvidia-smi
+
+      rxtb ec2 cmd --glob "train-*" -- df -h /workdir
+    """
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "run on")
+
+    command = " ".join(command)
+    names = [x.instance_name or x.instance_id for x in selected]
+    width = max(len(name) for name in names)
+
+    def _run(ec2_instance) -> bool:
+        # Prefix the output when it comes from several instances
+        prefix = ""
+        if len(selected) > 1:
+            prefix = f"[{names[selected.index(ec2_instance)]:<{width}}] "
+        return ec2_instance.run_command(command, prefix=prefix) == 0
+
+    if not run_on_instances(selected, _run):
+        sys.exit(1)
@@ -1,12 +1,10 @@
 import sys
 import click
-import pandas as pd
-from tabulate import tabulate
-import docker
 from typing import Optional
 
 from rixtribute.configuration import config, profile
 from rixtribute.helper import filter_list_of_dicts
+from rixtribute.output import print_rows, OUTPUT_FORMATS
 from rixtribute import container_utils
 # from rixtribute.ec2 import EC2, EC2Instance
 from rixtribute.ecr import ECR
@@ -27,8 +25,10 @@ def ecr(ctx):
 
 @ecr.command(help="List ECR repositiories")
 @click.option('--all', '-a', is_flag=True, help="list all repositiories")
+@click.option('--output', '-o', 'output_format', type=click.Choice(OUTPUT_FORMATS), default="table",
+              help="output format")
 @click.pass_context
-def list(ctx, all):
+def list(ctx, all, output_format):
 
     if all is True:
         project_name = None
@@ -36,7 +36,7 @@ def list(ctx, all):
         project_name = config.get_project()["name"]
 
     repos = ECR.list_repositories(filter_project_name=project_name)
-    print(tabulate(pd.DataFrame([repo.get_printable_dict() for repo in repos]), headers='keys'))
+    print_rows([repo.get_printable_dict() for repo in repos], output_format)
 
 @ecr.command()
 @click.argument('name', type=str)
@@ -53,7 +53,7 @@ def push(ctx):
     cfg_containers = filter_list_of_dicts(cfg_containers, ['name', 'tag', 'file'])
 
     print("push image to ecr:")
-    print(tabulate(pd.DataFrame(cfg_containers), headers='keys'))
+    print_rows(cfg_containers)
     n = int(click.prompt("Choose image"))
 
     container_cfg = cfg_containers[n]
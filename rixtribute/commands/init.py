@@ -1,13 +1,11 @@
 import sys
 import click
-import pandas as pd
-from tabulate import tabulate
-import docker
 
 from rixtribute.configuration import config, profile
 from rixtribute.configuration import ProviderType
-# from rixtribute.ec2 import EC2, EC2Instance
+from rixtribute.ec2 import EC2
 from rixtribute.ecr import ECR
+from rixtribute import aws_helper
 
 @click.command(short_help="initialize project")
 @click.pass_context
@@ -42,3 +40,17 @@ def init(ctx):
                 print(f"Creating ECR repo for container [{container_name}]")
                 if repo_name not in ecr_repo_names:
                     ECR.create_repository(repo_name)
+
+    ##############################
+    #  Prefill ami -> user cache  #
+    ##############################
+
+    amis_by_region :dict = {}
+    for instance in cfg_instances:
+        if instance["provider"] == ProviderType.AWS.value:
+            region_name = aws_helper.strip_to_region(instance["config"]["region"])
+            amis_by_region.setdefault(region_name, []).append(instance["config"]["ami"])
+
+    for region_name, image_ids in amis_by_region.items():
+        print(f"Looking up amis in {region_name}")
+        EC2.prefill_image_name_cache(image_ids, region_name=region_name)
@@ -1,13 +1,15 @@
 import sys
 import os
+import re
+import time
 import click
-from rixtribute.ec2 import EC2
-import pandas as pd
-from tabulate import tabulate
+from typing import Dict, List
 # import glob
 
 # from rixtribute import container_utils
 from rixtribute.configuration import config, profile
+from rixtribute.output import print_rows
+from rixtribute.commands.selection import selector_options, map_instances
 
 @click.group(short_help="run commands", invoke_without_command=True)
 @click.pass_context
@@ -33,19 +35,116 @@ def list_commands(ctx):
         print(f"  {command}")
 
 
+def _parse_params(params :tuple) -> Dict[str, List[str]]:
+    """--param KEY=V1,V2,.. as {KEY: [V1, V2, ..]}"""
+    parsed = {}
+    for param in params:
+        if '=' not in param:
+            raise click.BadParameter(f"expected KEY=V1,V2,.., got \"{param}\"", param_hint="--param")
+        key, values = param.split('=', 1)
+        parsed[key] = values.split(',')
+    return parsed
+
+def _substitute(command :str, values :Dict[str, str]) -> str:
+    """Replace {key} placeholders of known keys, shell ${VAR} and other
+    braces are left alone"""
+    def _replace(match):
+        return values.get(match.group(1), match.group(0))
+    return re.sub(r'(?<!\$)\{(\w+)\}', _replace, command)
+
 @run.command(short_help="Run a command")
 @click.argument("command-name", type=str)
+@click.option('--param', '-p', 'params', multiple=True,
+              help="per instance value KEY=V1,V2,.. used for {KEY} in the command, "
+                   "the n'th selected instance gets the n'th value")
+@click.option('--max-parallel', '-P', default=8, show_default=True, help="max instances running the command at once")
+@click.option('--detach', is_flag=True, help="start the command in a tmux session and return at once")
+@click.option('--log-dir', type=click.Path(file_okay=False), help="also write the output to LOG_DIR/<instance name>.log")
+@selector_options
 @click.pass_context
-def cmd(ctx, command_name):
-    """ List instances """
+def cmd(ctx, command_name, params, max_parallel, detach, log_dir, selector):
+    """ Run a command from rxtb-config.yaml on instances
+
+    Output is streamed prefixed with the instance name, followed by a
+    summary of the exit codes. Exits 1 if the command failed on any instance.
+
+    \b
+    {index}, {count}, {name}, {id} and --param keys in the command are
+    substituted per instance, and set in the container as RXTB_INDEX,
+    RXTB_COUNT, RXTB_NAME, RXTB_ID and RXTB_<KEY>.
+
+    Examples:
+
+      rxtb run cmd train --all
+
+      rxtb run cmd train --glob "sweep-*" -p seed=1,2,3 -p lr=0.1,0.01,0.001
+    """
     command = config.get_command(command_name)
     if command == None:
         print(f"No command named: {command_name} - use run: rxtb run list-commands")
         sys.exit(3)
 
-    ec2_instances = EC2.list_instances(profile, all)
-    print(tabulate(pd.DataFrame([instance.get_printable_dict() for instance in ec2_instances]), headers='keys'))
-    n = int(click.prompt("Choose instance to ssh into"))
+    params = _parse_params(params)
+
+    from rixtribute.ec2 import EC2
+
+    ec2_instances = EC2.list_instances(profile, refresh=selector.refresh)
+    selected = selector.choose(ec2_instances, "run on")
+
+    for key, values in params.items():
+        if len(values) < len(selected):
+            print(f"--param {key} has {len(values)} values for {len(selected)} instances")
+            sys.exit(2)
+
+    names = [x.instance_name or x.instance_id for x in selected]
+    width = max(len(name) for name in names)
+
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _run(i, ec2_instance):
+        values = {
+            "index": str(i),
+            "count": str(len(selected)),
+            "name": names[i],
+            "id": ec2_instance.instance_id,
+        }
+        values.update({key: param_values[i] for key, param_values in params.items()})
+        env = {f"RXTB_{key.upper()}": value for key, value in values.items()}
+
+        start = time.time()
+        exit_code = ec2_instance.docker_run(_substitute(command, values),
+                                            env=env,
+                                            detach=detach,
+                                            prefix=f"[{names[i]:<{width}}] ",
+                                            tee_path=os.path.join(log_dir, f"{names[i]}.log") if log_dir else None)
+        return exit_code, time.time() - start
+
+    results = map_instances(selected, _run, max_workers=max_parallel)
+
+    rows = []
+    failed = False
+    for i, (ec2_instance, (result, error)) in enumerate(zip(selected, results)):
+        exit_code, duration = result if result is not None else (None, None)
+        if error is not None:
+            status = f"error: {error}"
+        elif detach is True:
+            status = "detached"
+        else:
+            status = "ok" if exit_code == 0 else "failed"
+        failed = failed or error is not None or (detach is False and exit_code != 0)
+
+        rows.append({
+            "index": i,
+            "name": names[i],
+            "instance_id": ec2_instance.instance_id,
+            "exit_code": "" if exit_code is None else exit_code,
+            "duration": "" if duration is None else f"{duration:.1f}s",
+            "status": status,
+        })
 
-    ec2_instances[n].docker_run(command)
+    print()
+    print_rows(rows)
 
+    if failed:
+        sys.exit(1)
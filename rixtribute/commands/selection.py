@@ -0,0 +1,140 @@
+import sys
+import fnmatch
+import functools
+import click
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional, Tuple
+
+from rixtribute.output import print_rows
+
+# Instance selection shared by the commands acting on instances, kept free of
+# boto3 imports so commands/run.py stays fast to load
+
+_SELECTOR_OPTIONS = [
+    click.option('--name', 'names', multiple=True, help="select instances by name"),
+    click.option('--glob', '-g', 'globs', multiple=True, help="select instances with a name matching a glob, e.g. \"train-*\""),
+    click.option('--tag', '-t', 'tags', multiple=True, help="select instances by tag KEY=VALUE"),
+    click.option('--id', 'ids', multiple=True, help="select instances by instance id"),
+    click.option('--index', 'indexes', multiple=True, type=int, help="select instances by index in list-instances"),
+    click.option('--all', 'select_all', is_flag=True, help="select all instances"),
+    click.option('--refresh', is_flag=True, help="read instances from AWS, not the local cache"),
+]
+
+class InstanceSelector(object):
+    """Instances chosen by name, glob, tag, id or index, an instance matching
+    any of the selectors is selected. Without selectors the user is prompted
+    for an index like before.
+    """
+
+    def __init__(self,
+                 names :tuple=(),
+                 globs :tuple=(),
+                 tags :tuple=(),
+                 ids :tuple=(),
+                 indexes :tuple=(),
+                 select_all :bool=False,
+                 refresh :bool=False):
+        self.names = list(names)
+        self.globs = list(globs)
+        self.ids = list(ids)
+        self.indexes = list(indexes)
+        self.select_all = select_all
+        self.refresh = refresh
+
+        self.tags = []
+        for tag in tags:
+            if '=' not in tag:
+                raise click.BadParameter(f"expected KEY=VALUE, got \"{tag}\"", param_hint="--tag")
+            self.tags.append(tuple(tag.split('=', 1)))
+
+    def is_empty(self) -> bool:
+        return not (self.names or self.globs or self.tags or self.ids or self.indexes or self.select_all)
+
+    def matches(self, index :int, instance) -> bool:
+        if self.select_all is True:
+            return True
+        if index in self.indexes or instance.instance_id in self.ids or instance.instance_name in self.names:
+            return True
+        if any(fnmatch.fnmatchcase(instance.instance_name or "", pattern) for pattern in self.globs):
+            return True
+        return any(instance.tags.get(key, None) == value for key, value in self.tags)
+
+    def select(self, instances :List) -> List:
+        return [instance for i, instance in enumerate(instances) if self.matches(i, instance)]
+
+    def choose(self, instances :List, action :str, single :bool=False) -> List:
+        """The selected instances, or the one the user picks when no selector is given
+        Args:
+            instances : instances to choose from, as listed by list-instances
+            action    : what the instances are chosen for, used in messages
+            single    : (optional) exactly one instance must be chosen
+        """
+        if len(instances) <= 0:
+            print("You have no instances running")
+            sys.exit(0)
+
+        if self.is_empty():
+            print_rows([instance.get_printable_dict() for instance in instances])
+            n = int(click.prompt(f"Choose instance to {action}"))
+            return [instances[n]]
+
+        selected = self.select(instances)
+        if len(selected) == 0:
+            print("No instances match the selection")
+            sys.exit(1)
+        if single is True and len(selected) > 1:
+            print(f"Select a single instance to {action}, {len(selected)} instances match")
+            sys.exit(1)
+        return selected
+
+def selector_options(f):
+    """Add the selector options and --refresh to a command, the command gets
+    them as an InstanceSelector in the selector argument"""
+    @functools.wraps(f)
+    def wrapper(*args, names, globs, tags, ids, indexes, select_all, refresh, **kwargs):
+        selector = InstanceSelector(names, globs, tags, ids, indexes, select_all, refresh)
+        return f(*args, selector=selector, **kwargs)
+
+    for option in reversed(_SELECTOR_OPTIONS):
+        wrapper = option(wrapper)
+    return wrapper
+
+def map_instances(instances :List, fn :Callable, max_workers :int=16) -> List[Tuple[Any, Optional[Exception]]]:
+    """Call fn(index, instance) for all instances with at most max_workers
+    running at once
+    Returns:
+        (result, error) for each instance in the order of instances
+    """
+    results = [(None, None)] * len(instances)
+    if len(instances) == 0:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(instances)))) as executor:
+        futures = {executor.submit(fn, i, instance): i for i, instance in enumerate(instances)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = (future.result(), None)
+            except Exception as e:
+                results[i] = (None, e)
+    return results
+
+def run_on_instances(instances :List, fn :Callable, max_workers :int=16) -> bool:
+    """Call fn(instance) for all instances concurrently, errors are reported
+    per instance
+    Returns:
+        False if fn raised or returned False for any instance
+    """
+    if len(instances) == 1:
+        return fn(instances[0]) is not False
+
+    success = True
+    results = map_instances(instances, lambda i, instance: fn(instance), max_workers=max_workers)
+    for instance, (result, error) in zip(instances, results):
+        if error is not None:
+            success = False
+            print(f"{instance.instance_name}/{instance.instance_id}: {error}", file=sys.stderr)
+        elif result is False:
+            success = False
+            print(f"{instance.instance_name}/{instance.instance_id}: failed", file=sys.stderr)
+    return success
@@ -11,6 +11,9 @@ class ProviderType(Enum):
     GCP = 'gcp'
     # AZURE = 'azure'
 
+# How an instance is placed at launch, see EC2.get_placement_zones
+PLACEMENT_POLICIES = ["fixed", "ordered", "cheapest"]
+
 def str_presenter(dumper, data):
     if len(data.splitlines()) > 1:  # check for multiline string
         return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
@@ -71,6 +74,11 @@ class ProfileParser():
         except Exception as e:
             raise e
 
+    @property
+    def ssh_agent(self) -> bool:
+        """Load the ssh key into ssh-agent instead of using a key file"""
+        return self._raw_profile.get("ssh_agent", False) is True
+
     def find_and_parse_profile(self):
         config = None
         locations = []
@@ -190,10 +198,25 @@ class ConfigParser(object):
 
     # Project section
 
-    def get_project_sync(self):
+    def get_project_sync(self) -> dict:
+        """include/exclude globs, relative to the project root, for syncing
+        Returns:
+            dict {"include": [...], "exclude": [...]}
+        """
         if 'project' not in self._raw_config:
             raise Exception("No project section in rxtb-config.yaml")
 
+        raw_sync = self._raw_config['project'].get('sync', None) or {}
+
+        sync = {}
+        for k in ["include", "exclude"]:
+            globs = raw_sync.get(k, None) or []
+            if type(globs) != list:
+                raise Exception(f"Wrong type for {k} in project sync section, expected {list}")
+            sync[k] = [str(x) for x in globs]
+
+        return sync
+
     def get_project(self):
         if 'project' not in self._raw_config:
             raise Exception("No project section in rxtb-config.yaml")
@@ -306,7 +329,10 @@ class ConfigParser(object):
                 "keyname": {"required": False, "type": str}, # Plan on deprecating
                 "volumes": {"required": False, "type": list},
                 "ports": {"required": False, "type": list},
-                "spot": {"required": False, "type": bool}
+                "spot": {"required": False, "type": bool},
+                "warm_pool": {"required": False, "type": dict},
+                "placement": {"required": False, "type": dict},
+                "checkpoint": {"required": False, "type": dict}
             }
             ## Loop over available config attributes and check if required is set.
             for attr, val in config_attrs.items():
@@ -362,6 +388,58 @@ class ConfigParser(object):
                         tmp_config["ports"].append({"port": int(port), "protocol": protocol})
                     continue
 
+                # parse warm pool
+                if k == "warm_pool":
+                    size = v.get("size", 0)
+                    idle_expiry = v.get("idle_expiry_hours", 24)
+                    if type(size) != int:
+                        raise Exception((
+                            f"Wrong type for size in warm_pool section for \"{raw_instance['name']}\", "
+                            f"expected {int}")
+                        )
+                    if type(idle_expiry) not in [int, float]:
+                        raise Exception((
+                            f"Wrong type for idle_expiry_hours in warm_pool section for \"{raw_instance['name']}\", "
+                            f"expected {int} or {float}")
+                        )
+                    tmp_config["warm_pool"] = {"size": size, "idle_expiry_hours": idle_expiry}
+                    continue
+
+                # parse placement
+                if k == "placement":
+                    policy = v.get("policy", "fixed")
+                    if policy not in PLACEMENT_POLICIES:
+                        raise Exception((
+                            f"Unknown placement policy \"{policy}\" for \"{raw_instance['name']}\", "
+                            f"expected one of: {', '.join(PLACEMENT_POLICIES)}")
+                        )
+                    for attr in ["zones", "regions"]:
+                        if type(v.get(attr, [])) != list:
+                            raise Exception((
+                                f"Wrong type for {attr} in placement section for \"{raw_instance['name']}\", "
+                                f"expected {list}")
+                            )
+                    tmp_config["placement"] = {"policy": policy,
+                                               "zones": v.get("zones", []),
+                                               "regions": v.get("regions", [])}
+                    continue
+
+                # parse checkpoint
+                if k == "checkpoint":
+                    if type(v.get("dir", None)) != str:
+                        raise Exception((
+                            f"missing dir in checkpoint section for \"{raw_instance['name']}\", "
+                            f"expected a directory relative to the workdir")
+                        )
+                    s3_url = v.get("s3", None)
+                    if s3_url is not None and (type(s3_url) != str or not s3_url.startswith("s3://")):
+                        raise Exception((
+                            f"Wrong s3 url \"{s3_url}\" in checkpoint section for \"{raw_instance['name']}\", "
+                            f"expected: s3://bucket/prefix")
+                        )
+                    tmp_config["checkpoint"] = {"dir": v["dir"].strip("/"), "s3": s3_url}
+                    continue
+
                 tmp_config[k] = v
 
             # Add 22 as default port
@@ -371,6 +449,15 @@ class ConfigParser(object):
                 tmp_config["spot"] = False
             if "volumes" not in tmp_config:
                 tmp_config['volumes'] = [{'devname': '/dev/xvda', 'size': 50},]
+            # Launch in the configured zone
+            if "placement" not in tmp_config:
+                tmp_config["placement"] = {"policy": "fixed", "zones": [], "regions": []}
+            # No checkpoint dir to flush on spot interruption
+            if "checkpoint" not in tmp_config:
+                tmp_config["checkpoint"] = None
+            # No warm pool, stopped instances are terminated
+            if "warm_pool" not in tmp_config:
+                tmp_config["warm_pool"] = {"size": 0, "idle_expiry_hours": 24}
 
             tmp_instance["config"] = tmp_config
             instances.append(tmp_instance)
@@ -1,9 +1,17 @@
 import json
 from rixtribute.configuration import config
-import docker
 from typing import Optional
 
-docker_client = docker.client.from_env()
+# docker is imported and connected to on first use, so commands that don't
+# touch docker neither pay the import cost nor fail when the daemon is down
+_docker_client = None
+
+def get_docker_client():
+    global _docker_client
+    if _docker_client is None:
+        import docker
+        _docker_client = docker.client.from_env()
+    return _docker_client
 
 def docker_build_from_cfg(container_cfg):
     """Build docker image from container config
@@ -23,7 +31,7 @@ def docker_build_from_cfg(container_cfg):
     build_params['gzip'] = True
 
     print("\nBuilding docker container:\n")
-    docker_client = docker.client.from_env()
+    docker_client = get_docker_client()
     # image = docker_client.images.build(**build_params)
     # f = BytesIO(dockerfile.encode('utf-8'))
     # docker_cli = docker.APIClient(base_url='unix://var/run/docker.sock')
@@ -58,6 +66,7 @@ def docker_push(repository :str, tag :str, auth_config :dict) -> bool:
     Raises:
         docker.errors.APIError
     """
+    import docker
 
     try:
         repo_w_tag = f"{repository}:{tag}"
@@ -92,15 +101,17 @@ def docker_push(repository :str, tag :str, auth_config :dict) -> bool:
         raise e
 
 def docker_images() -> list:
-    return docker_client.images.list()
+    return get_docker_client().images.list()
 
 def docker_login(auth_token :dict):
+    import docker
     docker_cli = docker.APIClient(base_url='unix://var/run/docker.sock')
     docker_cli.login(**auth_token)
     # docker_client.login(**auth_token)
 
-def docker_image_get(name :str) -> Optional[docker.models.images.Image]:
+def docker_image_get(name :str) -> Optional["docker.models.images.Image"]:
+    import docker
     try:
-        return docker_client.images.get(name)
+        return get_docker_client().images.get(name)
     except docker.errors.ImageNotFound:
         return None
@@ -1,22 +1,32 @@
 import datetime
+import math
+import sys
+import time
 import tempfile
 import copy
-import boto3
-import botocore
-from rixtribute.helper import get_boto_session, generate_tags, get_external_ip, get_uuid_part_str
+import subprocess
+from rixtribute.helper import get_boto_session, get_boto_client, generate_tags, get_external_ip, get_uuid_part_str
 from rixtribute import aws_helper
 import base64
 import os
-from typing import List, Optional, Tuple
+import shlex
+from typing import Iterable, Iterator, List, Optional, Tuple
 from rixtribute import ssh
-from rixtribute.configuration import config
+from rixtribute.configuration import config, profile
 from rixtribute.ecr import ECR
+from rixtribute.cache import FileCache
+from rixtribute.sync import ProjectSync
+from rixtribute.transfer import ParallelTransfer, DEFAULT_STREAMS
+from rixtribute.output import print_rows
 # from rixtribute.ssh import (
     # ssh as _ssh,
     # scp as _scp,
     # ssh_command as _ssh,
 import json
+import queue
 from enum import Enum
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # For typing and auto-completion
 try:
@@ -25,6 +35,51 @@ try:
 except NameError as e:
     pass
 
+# On-demand prices rarely change, refetch them weekly
+PRICE_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Instance listings are reused for a short while, rxtb drops them itself
+# when it launches, stops or terminates instances
+INVENTORY_CACHE_TTL = 5 * 60
+# Cached listings with instances in these states are always refetched
+TRANSITIONAL_STATES = ["pending", "stopping", "shutting-down"]
+# Fields of the describe_instances output kept in the inventory cache
+INVENTORY_FIELDS = ["InstanceId", "ImageId", "InstanceType", "State", "LaunchTime", "SpotInstanceRequestId",
+                    "InstanceLifecycle", "PublicDnsName", "Placement", "Tags"]
+
+# Written by the user-data script as its last step, an instance is ready
+# when ssh answers and this file exists
+BOOTSTRAP_SENTINEL = "/var/lib/rxtb/bootstrap-done"
+
+# Lines of "<epoch> <phase>" appended by the user-data script
+BOOTSTRAP_PHASES_LOG = "/var/lib/rxtb/phases.log"
+
+# Launch phases timed by create_spot_instances, in order
+LAUNCH_PHASES = ["request", "fulfil", "boot", "ssh-up", "docker-pulled"]
+
+# Launched instances are tagged with the name of their instance config and
+# its AMI, parked (stopped) instances also with the time they were parked
+INSTANCE_CFG_TAG = "rxtb-instance"
+BASE_AMI_TAG = "rxtb-base-ami"
+PARKED_TAG = "rxtb-parked"
+# Baked images are tagged like instances, and with the container image digest
+IMAGE_DIGEST_TAG = "rxtb-image-digest"
+
+# Lines of "<epoch> <event> <detail>" appended by the spot interruption
+# watcher installed by the user-data script
+SPOT_INTERRUPTIONS_LOG = "/var/lib/rxtb/interruptions.log"
+
+# Spot request errors and status codes meaning a zone has no capacity for
+# the request, placement falls back to the next zone on these
+SPOT_CAPACITY_ERRORS = ["InsufficientInstanceCapacity", "Unsupported", "SpotMaxPriceTooLow"]
+SPOT_UNFULFILLABLE_CODES = ["capacity-not-available", "capacity-oversubscribed", "price-too-low",
+                            "constraint-not-fulfillable", "az-group-constraint", "launch-group-constraint",
+                            "placement-group-constraint", "bad-parameters"]
+SPOT_PENDING_CODES = ["", "pending-evaluation"]
+
+# Phases marked on the instance by the user-data script, in order
+BOOTSTRAP_PHASES = ["kernel-boot", "user-data-start", "user-setup", "ecr-login", "docker-pull", "bootstrap-done"]
+
 class IpProtocol(Enum):
     TCP = 'tcp'
     UDP = 'udp'
@@ -42,6 +97,7 @@ class EC2Instance(object):
         except KeyError as e:
             pass
 
+        self.tags :dict = {tag["Key"]: tag["Value"] for tag in boto_instance_dict.get("Tags", [])}
 
         self.instance_id :str = boto_instance_dict.get("InstanceId", '')
         self.image_id :str = boto_instance_dict.get("ImageId", '')
@@ -51,9 +107,13 @@ class EC2Instance(object):
 
         self.workdir = "/workdir"
 
-        self.uptime = datetime.datetime.utcnow()-boto_instance_dict["LaunchTime"].replace(tzinfo=None)
+        self.launch_time :datetime.datetime = boto_instance_dict["LaunchTime"]
+        self.uptime = datetime.datetime.utcnow()-self.launch_time.replace(tzinfo=None)
         if self.status != "running": self.uptime = ''
 
+        self.zone :str = boto_instance_dict.get("Placement", {}).get("AvailabilityZone", '')
+        self.region :Optional[str] = aws_helper.strip_to_region(self.zone) if self.zone else None
+
         self.spot_request_id :str = boto_instance_dict.get("SpotInstanceRequestId", '')
         # Spot or not
         self.instance_lifecycle :str = boto_instance_dict.get("InstanceLifecycle", '')
@@ -67,18 +127,20 @@ class EC2Instance(object):
                 "uptime",
                 "instance_lifecycle",
                 "instance_type",
+                "zone",
                 "public_dns"
         ]
         return {k: getattr(self, k) for k in keys if k in keys}
 
     def cancel_spot_request(self):
-        EC2.cancel_spot_instance_request(self.spot_request_id)
+        EC2.cancel_spot_instance_request(self.spot_request_id, region_name=self.region)
 
     def stop(self):
-        session = get_boto_session()
-        client = session.client("ec2")
+        client = get_boto_client("ec2", region_name=self.region)
 
         print(f"Stopping name/id: {self.instance_name}/{self.instance_id}")
+        self.disconnect()
+        EC2.invalidate_inventory()
 
         # Handle spot requests seperately
         if self.spot_request_id:
@@ -96,17 +158,48 @@ class EC2Instance(object):
 
         waiter = client.get_waiter('instance_stopped')
         waiter.wait(
-            InstanceIds=instance_ids,
+            InstanceIds=[self.instance_id],
+            WaiterConfig={
+                'Delay': 5,
+                'MaxAttempts': 100}
+        )
+
+    def park(self):
+        """Stop the instance but keep it, and its spot request, for a later
+        start of the same instance config to resume"""
+        client = get_boto_client("ec2", region_name=self.region)
+
+        print(f"Parking name/id: {self.instance_name}/{self.instance_id}")
+        self.disconnect()
+        EC2.invalidate_inventory()
+
+        res = client.stop_instances(
+            InstanceIds=[self.instance_id]
+        )
+
+        if res and res["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            raise Exception(f"Error when trying to stop {self.instance_id}")
+
+        client.create_tags(
+            Resources=[self.instance_id,],
+            Tags=[{'Key': PARKED_TAG, 'Value': str(int(time.time()))}],
+        )
+
+        print("Wait for instance to stop..")
+        waiter = client.get_waiter('instance_stopped')
+        waiter.wait(
+            InstanceIds=[self.instance_id],
             WaiterConfig={
                 'Delay': 5,
                 'MaxAttempts': 100}
         )
 
     def terminate(self):
-        session = get_boto_session()
-        client = session.client("ec2")
+        client = get_boto_client("ec2", region_name=self.region)
 
         print(f"Terminating name/id: {self.instance_name}/{self.instance_id}")
+        self.disconnect()
+        EC2.invalidate_inventory()
 
         if self.spot_request_id:
             print(f"this is a spot instance, cancelling spot request: {self.spot_request_id}")
@@ -128,21 +221,93 @@ class EC2Instance(object):
                 'MaxAttempts': 100}
         )
 
+    def get_instance_cfg(self) -> Optional[dict]:
+        """Instance config from rxtb-config.yaml the instance was launched from, if any"""
+        if INSTANCE_CFG_TAG not in self.tags:
+            return None
+        try:
+            return config.get_instance(self.tags[INSTANCE_CFG_TAG])
+        except Exception:
+            # Instance config was removed from rxtb-config.yaml
+            return None
+
+    def get_interruption_events(self) -> List[dict]:
+        """Events recorded by the spot interruption watcher on the instance
+        Returns:
+            [{'time': epoch seconds, 'event': 'notice'|'flushed', 'detail': str},]
+        """
+        cmd = ssh.generate_ssh_pipe_command(self.public_dns,
+                                            self.get_username(),
+                                            f"cat {SPOT_INTERRUPTIONS_LOG} 2>/dev/null || true",
+                                            port=self.ssh_port,
+                                            key_path=self.get_key_path())
+        res = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if res.returncode != 0:
+            return []
+
+        events = []
+        for line in res.stdout.decode().splitlines():
+            parts = line.split(' ', 2)
+            if len(parts) < 2:
+                continue
+            try:
+                events.append({"time": float(parts[0]),
+                               "event": parts[1],
+                               "detail": parts[2] if len(parts) > 2 else ''})
+            except ValueError:
+                continue
+        return events
+
     def get_username(self):
-        user = EC2.determine_ec2_user_from_image_id(self.image_id)
+        user = EC2.determine_ec2_user_from_image_id(self.image_id, region_name=self.region)
         return user
 
+    def disconnect(self):
+        """Close the shared ssh connection to the instance, if any"""
+        if not self.public_dns:
+            return
+        ssh.close_control_master(host=self.public_dns, user=self.get_username(), port=self.ssh_port)
+
+    @staticmethod
+    def get_key_path() -> Optional[str]:
+        """Path of the project ssh key, written to disk once per process. None
+        if there is no key, or the key is loaded into ssh-agent because the
+        profile sets ssh_agent: true"""
+        ssh_key = config.get_ssh_key()
+        if ssh_key is None:
+            return None
+        if profile.ssh_agent is True and ssh.add_key_to_agent(ssh_key["private_key"]):
+            return None
+        return ssh.get_key_path(ssh_key["private_key"])
+
     def ssh(self):
         # key = None
         # key = "/home/jri/.ssh/jesper_ssh.pem"
-        key = config.get_ssh_key()["private_key"]
+        key_path = self.get_key_path()
         user = self.get_username()
-        ssh.ssh(host=self.public_dns, user=user, port=self.ssh_port, key_str=key)
-
-    def docker_run(self, cmd :str=None):
-        key = config.get_ssh_key()["private_key"]
+        ssh.ssh(host=self.public_dns, user=user, port=self.ssh_port, key_path=key_path)
+
+    def docker_run(self,
+                   cmd :str=None,
+                   env :dict=None,
+                   detach :bool=True,
+                   prefix :str="",
+                   tee_path :str=None) -> Optional[int]:
+        """Run cmd inside the instance container
+        Args:
+            cmd      : (optional) shell script to run, default is the image entrypoint
+            env      : (optional) environment variables set in the container
+            detach   : run in a tmux session on the instance and return at once,
+                       else wait and print the output as it arrives
+            prefix   : (optional) prefix of printed output lines
+            tee_path : (optional) file the output is also appended to
+        Returns:
+            exit code of the container or None if detached
+        """
+        key_path = self.get_key_path()
         user = self.get_username()
         docker_gpu = '$(nvidia-smi --list-gpus > /dev/null && echo "--gpus=all")'
+        docker_env = "".join(f"-e {shlex.quote(f'{k}={v}')} " for k, v in (env or {}).items())
         if cmd != None:
             f = tempfile.NamedTemporaryFile(suffix='_temp', prefix='rxtb_', delete=True)
             f.write(f"#!/bin/sh\n".encode("utf8"))
@@ -155,17 +320,28 @@ class EC2Instance(object):
             self.copy_files_to_tmp([cmd_file_abs_path])
 
             cmd_str = (
-                f'docker run --rm -v /tmp/{cmd_file_name}:/cmd.sh --entrypoint="" {docker_gpu} $DOCKER_IMAGE bash '
+                f'docker run --rm -v /tmp/{cmd_file_name}:/cmd.sh --entrypoint="" {docker_env}{docker_gpu} $DOCKER_IMAGE bash '
                 f"/cmd.sh"
             )
         else:
-            cmd_str = "docker run --rm "+docker_gpu+" $DOCKER_IMAGE"
+            cmd_str = "docker run --rm "+docker_env+docker_gpu+" $DOCKER_IMAGE"
 
-        # cmd = "docker run --gpus=all $DOCKER_IMAGE"
-        ssh.ssh_command_tmux(host=self.public_dns, command=cmd_str, user=user, port=self.ssh_port, key_str=key)
+        if detach is True:
+            # cmd = "docker run --gpus=all $DOCKER_IMAGE"
+            ssh.ssh_command_tmux(host=self.public_dns, command=cmd_str, user=user, port=self.ssh_port, key_path=key_path)
+            return None
+
+        # DOCKER_IMAGE is set in ~/.profile, which only login shells read
+        return ssh.ssh_command_prefixed(host=self.public_dns,
+                                        user=user,
+                                        command=f". ~/.profile; {cmd_str}",
+                                        port=self.ssh_port,
+                                        key_path=key_path,
+                                        prefix=prefix,
+                                        tee_path=tee_path)
 
     def copy_files_to_tmp(self, files :List[str], recursive :bool=False):
-        key = config.get_ssh_key()["private_key"]
+        key_path = self.get_key_path()
         user = self.get_username()
         dest = f"{user}@{self.public_dns}:/tmp/"
 
@@ -173,55 +349,107 @@ class EC2Instance(object):
                           dest=dest,
                           recursive=recursive,
                           port=self.ssh_port,
-                          key_str=key)
+                          key_path=key_path)
         return success
 
-    def copy_files_to_workdir(self, files :List[str], recursive :bool=False):
-        key = config.get_ssh_key()["private_key"]
-        user = self.get_username()
-        dest = f"{user}@{self.public_dns}:{self.workdir}"
-
-        success = ssh.scp(source=files,
-                          dest=dest,
-                          recursive=recursive,
-                          port=self.ssh_port,
-                          key_str=key)
+    def get_transfer(self, streams :int=DEFAULT_STREAMS, mode :str="auto") -> ParallelTransfer:
+        """Parallel file transfer to/from the instance"""
+        return ParallelTransfer(host=self.public_dns,
+                                user=self.get_username(),
+                                port=self.ssh_port,
+                                key_path=self.get_key_path(),
+                                streams=streams,
+                                mode=mode)
+
+    def copy_files_to_workdir(self,
+                              files :List[str],
+                              recursive :bool=False,
+                              streams :int=DEFAULT_STREAMS,
+                              mode :str="auto"):
+        transfer = self.get_transfer(streams=streams, mode=mode)
+        success = transfer.upload(files, self.workdir, recursive=recursive)
         return success
 
-    def copy_files_from_workdir(self, source :List[str], recursive :bool, dest :str='.'):
+    def copy_files_from_workdir(self,
+                                source :List[str],
+                                recursive :bool,
+                                dest :str='.',
+                                streams :int=DEFAULT_STREAMS,
+                                mode :str="auto"):
         """ Copy files from the instance workdir """
-        key = config.get_ssh_key()["private_key"]
-        key = None
-        user = self.get_username()
-        source_prefix = f"{user}@{self.public_dns}:"
-
-        for i, path in enumerate(source):
-            source[i] = source_prefix + os.path.join(self.workdir, path)
+        source = [os.path.join(self.workdir, path) for path in source]
 
-        success = ssh.scp(source=source,
-                          dest=dest,
-                          recursive=recursive,
-                          port=self.ssh_port,
-                          key_str=key)
+        transfer = self.get_transfer(streams=streams, mode=mode)
+        success = transfer.download(source, dest, recursive=recursive)
         return success
 
-
-    def list_files(self):
+    def scp(self,
+            source :str,
+            dest :str,
+            recursive :bool=False,
+            streams :int=DEFAULT_STREAMS,
+            mode :str="auto") -> bool:
+        """ Copy files to/from the instance, the remote side is given as user@host:path """
+        transfer = self.get_transfer(streams=streams, mode=mode)
+        if ':' in source:
+            return transfer.download([source.split(':', 1)[-1]], dest, recursive=recursive)
+        return transfer.upload([source], dest.split(':', 1)[-1], recursive=recursive)
+
+    def sync_project(self, dest :str=None, full :bool=False, verbose :bool=False) -> bool:
+        """ Sync the project root to the instance, only sending changed files
+        Args:
+            dest    : (optional) remote directory, default the instance workdir
+            full    : ignore what was synced before and send every file
+            verbose : print the files sent
+        Returns:
+            bool True on success
+        """
+        project_sync = config.get_project_sync()
+        project_sync = ProjectSync(instance_id=self.instance_id,
+                                   host=self.public_dns,
+                                   user=self.get_username(),
+                                   dest=self.workdir if dest is None else dest,
+                                   root=config.project_root,
+                                   include=project_sync["include"],
+                                   exclude=project_sync["exclude"],
+                                   port=self.ssh_port,
+                                   key_path=self.get_key_path())
+        return project_sync.sync(full=full, verbose=verbose)
+
+
+    def run_command(self, command :str, prefix :str="") -> int:
+        """Run a shell command on the instance and print its output as it arrives
+        Returns:
+            exit code of command, 255 if ssh could not connect
+        """
+        return ssh.ssh_command_prefixed(host=self.public_dns,
+                                        user=self.get_username(),
+                                        command=command,
+                                        port=self.ssh_port,
+                                        key_path=self.get_key_path(),
+                                        prefix=prefix)
+
+    def list_files(self) -> bool:
         user = self.get_username()
         host = self.public_dns
-        key = None
-        ssh.ssh_command(host=host,
-                        user=user,
-                        command=f"ls -1a {self.workdir}/",
-                        port=self.ssh_port,
-                        key=key,
-                        print_output=True)
+        key_path = self.get_key_path()
+        exit_code = ssh.ssh_command(host=host,
+                                    user=user,
+                                    command=f"ls -1a {self.workdir}/",
+                                    port=self.ssh_port,
+                                    key=key_path,
+                                    print_output=True)
+        return exit_code == 0
 
 
 
 
 class EC2(object):
 
+    _price_cache :Optional[FileCache] = None
+    _image_name_cache :Optional[FileCache] = None
+    _image_names :dict = {}
+
     def __init__(self, boto_object):
         """ STATIC class used as API """
         pass
@@ -230,21 +458,79 @@ class EC2(object):
     def encode_userdata(data :str):
         return base64.b64encode(data.encode('utf-8')).decode('utf-8')
 
-    @staticmethod
-    def determine_ec2_user_from_image_id(image_id :str):
-        session = get_boto_session()
-        client = session.client("ec2")
+    @classmethod
+    def determine_ec2_user_from_image_id(cls, image_id :str, region_name :str=None):
+        image_name = cls.lookup_image_name(image_id, region_name=region_name)
+        user = cls.determine_ec2_user_from_image_name(image_name)
+        if user is None:
+            raise Exception(f"Unknown ami, {image_id}")
+        return user
 
-        res = client.describe_images(
-            Filters = [
-                {'Name': 'image-id', 'Values': [image_id,]},
-            ])
+    @classmethod
+    def lookup_image_name(cls, image_id :str, region_name :str=None) -> str:
+        """Image name of an AMI, memoized in-process and on disk since it never changes"""
+        image_name = cls._image_names.get(image_id, None)
+        if image_name is not None:
+            return image_name
+
+        cache = cls._get_image_name_cache()
+        image_name = cache.get(image_id)
+        if image_name is None:
+            client = cls._get_ec2_boto_client(region_name=region_name)
+
+            res = client.describe_images(
+                Filters = [
+                    {'Name': 'image-id', 'Values': [image_id,]},
+                ])
 
-        if res and res["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            raise Exception(f"Error in ami lookup '{image_id}")
+            if res and res["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                raise Exception(f"Error in ami lookup '{image_id}")
+
+            if len(res['Images']) <= 0:
+                raise Exception(f"No such ami '{image_id}'")
+
+            image_name = res['Images'][0]['Name']
+            cache.set(image_id, image_name)
+
+        cls._image_names[image_id] = image_name
+        return image_name
+
+    @classmethod
+    def prefill_image_name_cache(cls, image_ids :List[str], region_name :str=None) -> dict:
+        """Lookup image names for several AMIs in one call and memoize them
+        Args:
+            image_ids   : list of ami ids e.g. ['ami-0e032abfb10b0b80a']
+            region_name : (optional) region the amis live in
+        Returns:
+            dict image id -> image name for the amis found
+        """
+        cache = cls._get_image_name_cache()
+        missing = [x for x in set(image_ids) if cache.get(x) is None]
+
+        if len(missing) > 0:
+            client = cls._get_ec2_boto_client(region_name=region_name)
+            res = client.describe_images(
+                Filters = [
+                    {'Name': 'image-id', 'Values': missing},
+                ])
+
+            if res and res["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                raise Exception(f"Error in ami lookup '{missing}")
 
-        image_name = res['Images'][0]['Name']
+            cache.update({image['ImageId']: image['Name'] for image in res['Images']})
 
+        image_names = {x: cache.get(x) for x in image_ids if cache.get(x) is not None}
+        cls._image_names.update(image_names)
+        return image_names
+
+    @classmethod
+    def _get_image_name_cache(cls) -> FileCache:
+        if cls._image_name_cache is None:
+            cls._image_name_cache = FileCache("ami-image-names")
+        return cls._image_name_cache
+
+    @staticmethod
+    def determine_ec2_user_from_image_name(image_name :str) -> Optional[str]:
         #see https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/connection-prereqs.html
         #####################################
         # Distro       # username
@@ -272,7 +558,7 @@ class EC2(object):
         elif 'ubuntu' in image_name.lower():
             return "ubuntu"
         else:
-            raise Exception(f"Unknown ami, {image_id}")
+            return None
 
     @classmethod
     def _get_session(cls, region_name :str=None):
@@ -281,37 +567,142 @@ class EC2(object):
 
     @classmethod
     def _get_ec2_boto_client(cls, region_name :str=None):
-        session = cls._get_session(region_name=region_name)
-        client = session.client("ec2")
+        client = get_boto_client("ec2", region_name=region_name)
         return client
 
     #########################
     #  BOTO3 API functions  #
     #########################
 
+    @staticmethod
+    def _get_inventory_cache() -> FileCache:
+        return FileCache("instances", ttl=INVENTORY_CACHE_TTL)
+
+    @staticmethod
+    def invalidate_inventory():
+        """Drop the cached instance listings, after an instance changed state"""
+        EC2._get_inventory_cache().clear()
+
     @classmethod
-    def list_instances(cls, profile, all=False) -> List[EC2Instance]:
-        client = cls._get_ec2_boto_client()
+    def list_instances(cls, profile, all=False, refresh=False, all_regions=False) -> List[EC2Instance]:
+        """List instances, from the inventory cache while it is fresh
+        Args:
+            profile     : profile, instances launched by it are listed
+            all         : (optional) list all instances, not only the profile's
+            refresh     : (optional) read the instances from AWS and update the cache
+            all_regions : (optional) list instances in all regions, default the
+                          regions used by rxtb-config.yaml, see get_config_regions
+        """
+        cache = cls._get_inventory_cache()
+        key = cache.make_key(profile.email, profile.name, all is True, all_regions is True)
 
-        if all is True:
-            response = client.describe_instances()
-        else:
-            response = client.describe_instances(
-                Filters = [
-                    {'Name': 'tag:origin', 'Values': ['rixtribute',]},
-                    {'Name': 'tag:origin-email', 'Values': [profile.email,]},
-                    {'Name': 'tag:origin-name', 'Values': [profile.name,]},
-                ]
-            )
+        if refresh is False:
+            cached = cache.get(key, None)
+            if cached is not None and not any(x["State"]["Name"] in TRANSITIONAL_STATES for x in cached):
+                instances = []
+                for instance in cached:
+                    instance = dict(instance, LaunchTime=datetime.datetime.fromisoformat(instance["LaunchTime"]))
+                    instances.append(EC2Instance(instance))
+                return sorted(instances, key=cls._listing_order)
 
-        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+        region_names = cls.list_regions() if all_regions is True else None
 
-        instances = []
-        for reservation in response["Reservations"]:
-            for instance in reservation["Instances"]:
-                instances.append(EC2Instance(instance))
+        listed = []
+        for instance in cls._iter_instance_dicts(profile, all=all, region_names=region_names):
+            entry = {k: instance[k] for k in INVENTORY_FIELDS if k in instance}
+            entry["LaunchTime"] = instance["LaunchTime"].isoformat()
+            listed.append((EC2Instance(instance), entry))
+
+        # Regions finish in any order, but the index of an instance in the
+        # listing is used to select it, so it must not change between runs
+        listed.sort(key=lambda x: cls._listing_order(x[0]))
+
+        cache.set(key, [entry for _, entry in listed])
+
+        return [instance for instance, _ in listed]
 
-        return instances
+    @staticmethod
+    def _listing_order(instance :EC2Instance) -> tuple:
+        return (instance.region or '', instance.launch_time, instance.instance_name or '', instance.instance_id)
+
+    @classmethod
+    def iter_instances(cls,
+                       profile,
+                       all :bool=False,
+                       region_names :List[str]=None,
+                       max_workers :int=8) -> Iterator[EC2Instance]:
+        """Yield instances as they are read, see _iter_instance_dicts"""
+        for instance in cls._iter_instance_dicts(profile, all=all, region_names=region_names, max_workers=max_workers):
+            yield EC2Instance(instance)
+
+    @classmethod
+    def _iter_instance_dicts(cls,
+                             profile,
+                             all :bool=False,
+                             region_names :List[str]=None,
+                             max_workers :int=8) -> Iterator[dict]:
+        """Yield describe_instances output per instance, all pages of all
+        regions are read concurrently and yielded as they arrive
+        Args:
+            profile      : profile, instances launched by it are listed
+            all          : (optional) list all instances, not only the profile's
+            region_names : (optional) regions to list, default get_config_regions
+            max_workers  : (optional) number of regions read concurrently
+        """
+        if region_names is None:
+            region_names = cls.get_config_regions()
+        if len(region_names) == 0:
+            return
+
+        params :dict = {}
+        if all is not True:
+            params["Filters"] = [
+                {'Name': 'tag:origin', 'Values': ['rixtribute',]},
+                {'Name': 'tag:origin-email', 'Values': [profile.email,]},
+                {'Name': 'tag:origin-name', 'Values': [profile.name,]},
+            ]
+
+        # Workers put ("instance", dict), ("error", region, message) and
+        # ("done",) on the queue, the generator yields until all are done
+        results :queue.Queue = queue.Queue()
+
+        def _list_region(region_name :str):
+            try:
+                paginator = cls._get_ec2_boto_client(region_name).get_paginator('describe_instances')
+                for response in paginator.paginate(**params):
+                    assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+                    for reservation in response["Reservations"]:
+                        for instance in reservation["Instances"]:
+                            results.put(("instance", instance))
+            except Exception as e:
+                results.put(("error", region_name, str(e)))
+            finally:
+                results.put(("done",))
+
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(region_names)))
+        try:
+            for region_name in region_names:
+                executor.submit(_list_region, region_name)
+
+            running = len(region_names)
+            while running > 0:
+                item = results.get()
+                if item[0] == "instance":
+                    yield item[1]
+                elif item[0] == "error":
+                    print(f"Warning: no instances for region={item[1]}: {item[2]}", file=sys.stderr)
+                else:
+                    running -= 1
+        finally:
+            executor.shutdown(wait=False)
+
+    @classmethod
+    def get_config_regions(cls) -> List[str]:
+        """The default region and the regions rxtb-config.yaml instances can be launched in"""
+        regions = [get_boto_session().region_name]
+        for instance_cfg in config.get_instances():
+            regions += cls.get_instance_cfg_regions(instance_cfg)
+        return sorted(set(x for x in regions if x))
 
     @classmethod
     def get_instance_from_dns_name(cls, dns_name :str) -> Optional[EC2Instance]:
@@ -337,6 +728,19 @@ class EC2(object):
 
         return instances[0]
 
+    @classmethod
+    def get_instance(cls, instance_id :str, region_name :str=None) -> Optional[EC2Instance]:
+        client = cls._get_ec2_boto_client(region_name)
+
+        response = client.describe_instances(InstanceIds=[instance_id])
+
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+
+        for reservation in response["Reservations"]:
+            for instance in reservation["Instances"]:
+                return EC2Instance(instance)
+        return None
+
     @classmethod
     def list_regions(cls) -> List[str]:
         ec2 = EC2._get_ec2_boto_client()
@@ -347,13 +751,136 @@ class EC2(object):
         return [row['RegionName'] for row in response['Regions']]
 
 
+    @staticmethod
+    def _spot_price_params(instance_types :List[str],
+                           start_dt :datetime.datetime=None,
+                           end_dt :datetime.datetime=None,
+                           range_dt :datetime.timedelta=None) -> dict:
+        """ Build describe_spot_price_history params, see list_spot_prices """
+        params :dict = {
+            "InstanceTypes": instance_types,
+            "ProductDescriptions": ['Linux/UNIX'],
+        }
+
+        if range_dt is not None:
+            now = datetime.datetime.today()
+            params["StartTime"] = now - range_dt
+            params["EndTime"] = now
+        elif start_dt is not None or end_dt is not None:
+            if start_dt is not None: params["StartTime"] = start_dt
+            if end_dt is not None: params["EndTime"] = end_dt
+        else:
+            # 3 hours window
+            params["StartTime"] = datetime.datetime.today() - datetime.timedelta(hours=3)
+
+        return params
+
+    @classmethod
+    def iter_spot_prices(cls,
+                         instance_types: List[str],
+                         region_name :str,
+                         start_dt :datetime.datetime=None,
+                         end_dt :datetime.datetime=None,
+                         range_dt :datetime.timedelta=None
+                         ) -> Iterator[dict]:
+        """ Stream spot price points for instance_types in a single region
+        Pages are fetched as the generator is consumed, so wide windows are never
+        held in memory at once. See list_spot_prices for the window arguments.
+        Args:
+            instance_types  list of instance type e.g. m5.xlarge
+            region_name     region e.g. eu-west-1
+        Yields:
+            dict {"zone", "price", "instance-type", "timestamp"}
+        """
+        params = cls._spot_price_params(instance_types, start_dt, end_dt, range_dt)
+        return cls._iter_spot_prices_in_region(region_name, params)
+
+    @classmethod
+    def _iter_spot_prices_in_region(cls, region_name :str, params :dict) -> Iterator[dict]:
+        ec2 = cls._get_ec2_boto_client(region_name=region_name)
+        paginator = ec2.get_paginator('describe_spot_price_history')
+
+        for response in paginator.paginate(**params):
+            assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+
+            for item in response['SpotPriceHistory']:
+                yield {
+                    "zone":  item['AvailabilityZone'],
+                    "price": float(item['SpotPrice']),
+                    "instance-type": item['InstanceType'],
+                    "timestamp": item['Timestamp'],
+                }
+
+    @staticmethod
+    def aggregate_spot_prices(prices :Iterable[dict]) -> List[dict]:
+        """ Summarise price points per zone and instance type
+        Only a count per distinct price is kept per zone, so the iterable is
+        consumed in bounded memory.
+        Args:
+            prices  iterable of price points as yielded by iter_spot_prices
+        Returns:
+            list of dicts:
+                [{'zone': 'eu-west-1a',
+                  'instance-type': 'm5.large',
+                  'price': 0.0368,         # latest price in the window
+                  'price-min': 0.0361,
+                  'price-mean': 0.0366,
+                  'price-p95': 0.0368,
+                  'samples': 18},]
+        """
+        groups :dict = {}
+        for item in prices:
+            key = (item["zone"], item["instance-type"])
+            group = groups.get(key, None)
+            if group is None:
+                group = {"latest": None, "latest-ts": None, "counts": Counter(), "sum": 0.0, "n": 0}
+                groups[key] = group
+
+            price = item["price"]
+            timestamp = item.get("timestamp", None)
+            if group["latest-ts"] is None or (timestamp is not None and timestamp >= group["latest-ts"]):
+                group["latest"] = price
+                group["latest-ts"] = timestamp
+            group["counts"][price] += 1
+            group["sum"] += price
+            group["n"] += 1
+
+        aggregated_l :List[dict] = list()
+        for (zone, instance_type), group in groups.items():
+            n = group["n"]
+            sorted_prices = sorted(group["counts"].items())
+
+            # Nearest-rank 95th percentile
+            rank = math.ceil(0.95 * n)
+            seen = 0
+            p95 = sorted_prices[-1][0]
+            for price, count in sorted_prices:
+                seen += count
+                if seen >= rank:
+                    p95 = price
+                    break
+
+            aggregated_l.append({
+                "zone": zone,
+                "instance-type": instance_type,
+                "price": group["latest"],
+                "price-min": sorted_prices[0][0],
+                "price-mean": group["sum"] / n,
+                "price-p95": p95,
+                "samples": n,
+            })
+
+        return aggregated_l
+
     @classmethod
     def list_spot_prices(cls,
                          instance_types: List[str],
                          region_names :List[str],
                          start_dt :datetime.datetime=None,
                          end_dt :datetime.datetime=None,
-                         range_dt :datetime.timedelta=None
+                         range_dt :datetime.timedelta=None,
+                         max_workers :int=8,
+                         aggregate :bool=False
                          ) -> List[dict]:
         """ Get spot pricing for instance_types in regions
         valid usage:
@@ -368,121 +895,175 @@ class EC2(object):
             start_dt        (optional) start datetime for spot pricing window
             end_dt          (optional) end datetime for spot pricing window
             range_dt        (optional) range timedelta from now for spot pricing window
+            max_workers     (optional) number of regions queried concurrently, regions
+                            failing or timing out (see helper.BOTO_READ_TIMEOUT)
+                            are reported and left out
+            aggregate       (optional) return one row per zone, see aggregate_spot_prices
         Returns:
             dict with pricing info
         """
-        params :dict = {
-            "InstanceTypes": instance_types,
-            "ProductDescriptions": ['Linux/UNIX'],
-        }
-
-        if range_dt is not None:
-            now = datetime.datetime.today()
-            params["StartTime"] = now - range_dt
-            params["EndTime"] = now
-        elif start_dt is not None or end_dt is not None:
-            if start_dt is not None: params["StartTime"] = start_dt
-            if end_dt is not None: params["EndTime"] = end_dt
-        else:
-            # 3 hours window
-            params["StartTime"] = datetime.datetime.today() - datetime.timedelta(hours=3)
+        params = cls._spot_price_params(instance_types, start_dt, end_dt, range_dt)
 
         # if VERBOSE:
             # print(params)
 
         prices_l :List[dict] = list()
-        for region_name in region_names:
-            ec2 = cls._get_ec2_boto_client(region_name=region_name)
-
-            response = ec2.describe_spot_price_history(**params)
-
-            assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
-
-            for item in response['SpotPriceHistory']:
-                prices_l.append({
-                    "zone":  item['AvailabilityZone'],
-                    "price": float(item['SpotPrice']),
-                    "instance-type": item['InstanceType'],
-                })
+        if len(region_names) <= 0:
+            return prices_l
+
+        # Fan out across regions, wall time is bounded by the slowest region,
+        # whose calls are bounded by the client timeouts and retries
+        failed_regions :dict = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(region_names))) as executor:
+            futures = {executor.submit(cls._list_spot_prices_in_region, region_name, params, aggregate): region_name
+                       for region_name in region_names}
+            for future in as_completed(futures):
+                region_name = futures[future]
+                try:
+                    prices_l.extend(future.result())
+                except Exception as e:
+                    failed_regions[region_name] = str(e)
+
+        # Report partial results
+        for region_name, error in sorted(failed_regions.items()):
+            print(f"Warning: no spot prices for region={region_name}: {error}", file=sys.stderr)
 
         return prices_l
 
     @classmethod
-    def list_prices(cls, instance_types :List[str], region_names :List[str]) -> List[dict]:
+    def _list_spot_prices_in_region(cls, region_name :str, params :dict, aggregate :bool=False) -> List[dict]:
+        """ Get spot pricing for a single region, see list_spot_prices """
+        prices = cls._iter_spot_prices_in_region(region_name, params)
+        if aggregate is True:
+            return cls.aggregate_spot_prices(prices)
+        return list(prices)
+
+    @classmethod
+    def list_prices(cls,
+                    instance_types :List[str],
+                    region_names :List[str],
+                    operating_system :str='Linux',
+                    tenancy :str='Shared',
+                    refresh :bool=False) -> List[dict]:
         """Return list of prices for instance_type
+        On-demand prices are cached on disk for PRICE_CACHE_TTL seconds, so the
+        pricing API is only called for instance types not seen recently.
         Args:
-            instance_types  : types of ec2 instances e.g. ['p3.8xlarge']
-            region_names    : list of region codes e.g ['us-east-1', 'eu-west-1']
+            instance_types   : types of ec2 instances e.g. ['p3.8xlarge']
+            region_names     : list of region codes e.g ['us-east-1', 'eu-west-1']
+            operating_system : (optional) pricing operatingSystem e.g. Linux
+            tenancy          : (optional) pricing tenancy e.g. Shared
+            refresh          : (optional) ignore cached prices and refetch them
         Returns:
             list of dicts:
                 [{'region_name': 'eu-west-1',
                   'instance_type': 'p3.8xlarge',
                   'price': 13.22},]
         """
-        # pricing = cls._get_session(region_name="us-east-1").client("pricing")
-        pricing = EC2._get_session(region_name="us-east-1").client("pricing")
+        cache = cls._get_price_cache()
+
+        prices_l :list = []
 
-        region_names = [aws_helper.region_name_to_region_code(x) for x in region_names]
+        for instance_type in instance_types:
+            keys = {region_name: FileCache.make_key(instance_type, region_name, operating_system, tenancy)
+                    for region_name in region_names}
+
+            if refresh is True or not all(cache.has(key) for key in keys.values()):
+                # A single product query returns the price for every location,
+                # so cache all of them, None marks locations without a price
+                fetched = {FileCache.make_key(instance_type, region_name, operating_system, tenancy): price
+                           for region_name, price in cls._fetch_prices(instance_type,
+                                                                       operating_system,
+                                                                       tenancy).items()}
+                for key in keys.values():
+                    fetched.setdefault(key, None)
+                cache.update(fetched)
+
+            for region_name, key in keys.items():
+                price = cache.get(key)
+                if price is None:
+                    continue
+                prices_l.append({"region-name": region_name,
+                                 "instance-type": instance_type,
+                                 "price": price})
+
+        return prices_l
+
+    @classmethod
+    def _get_price_cache(cls) -> FileCache:
+        if cls._price_cache is None:
+            cls._price_cache = FileCache("ondemand-prices", ttl=PRICE_CACHE_TTL)
+        return cls._price_cache
+
+    @classmethod
+    def _fetch_prices(cls, instance_type :str, operating_system :str, tenancy :str) -> dict:
+        """Fetch on-demand prices for instance_type in all regions from the pricing API
+        Returns:
+            dict region name -> price e.g. {'eu-west-1': 13.22}
+        """
+        # pricing = cls._get_session(region_name="us-east-1").client("pricing")
+        pricing = get_boto_client("pricing", region_name="us-east-1")
+        paginator = pricing.get_paginator('get_products')
 
         # region = aws_helper.region_code_to_region_name(region_name)
         # region1 = aws_helper.region_code_to_region_name("eu-west-2")
         # locations
         # locations = pricing.get_attribute_values(ServiceCode="AmazonEC2",AttributeName="location")
         # locations["AttributeValues"]
-        prices_l :list = []
+        location_to_region = {v:k for k,v in aws_helper.region_name_to_code_dict.items()}
+        prices :dict = {}
 
-        for instance_type in instance_types:
-            response = pricing.get_products(
-                ServiceCode='AmazonEC2',
-                Filters=[
-                    {'Type': 'TERM_MATCH', 'Field': 'operatingSystem', 'Value': 'Linux'},
-                    # {'Type': 'TERM_MATCH', 'Field': 'location', 'Value': region},
-                    {'Type': 'TERM_MATCH', 'Field': 'capacitystatus', 'Value': 'UnusedCapacityReservation'},
-                    {'Type': 'TERM_MATCH', 'Field': 'instanceType', 'Value': instance_type},
-                    {'Type': 'TERM_MATCH', 'Field': 'tenancy', 'Value': 'Shared'},
-                    {'Type': 'TERM_MATCH', 'Field': 'preInstalledSw', 'Value': 'NA'}
-                ],
-            )
+        for response in paginator.paginate(
+            ServiceCode='AmazonEC2',
+            Filters=[
+                {'Type': 'TERM_MATCH', 'Field': 'operatingSystem', 'Value': operating_system},
+                # {'Type': 'TERM_MATCH', 'Field': 'location', 'Value': region},
+                {'Type': 'TERM_MATCH', 'Field': 'capacitystatus', 'Value': 'UnusedCapacityReservation'},
+                {'Type': 'TERM_MATCH', 'Field': 'instanceType', 'Value': instance_type},
+                {'Type': 'TERM_MATCH', 'Field': 'tenancy', 'Value': tenancy},
+                {'Type': 'TERM_MATCH', 'Field': 'preInstalledSw', 'Value': 'NA'}
+            ],
+        ):
 
             assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
 
-            # Run through price list and return filter locations
+            # Run through price list, each element is only parsed once
             for price_elm in response['PriceList']:
                 elm = json.loads(price_elm)
                 location = elm['product']['attributes']['location']
-                instance_type = elm['product']['attributes']['instanceType']
-                if location in region_names:
-                    on_demand = json.loads(price_elm)['terms']['OnDemand']
-
-                    # Example of price element:
-                    # {'F78KERDK968ABWNU.JRTCKXETXF': {
-                        # 'priceDimensions': {
-                            # 'F78KERDK968ABWNU.JRTCKXETXF.6YS6EN2CT7': {
-                                # 'unit': 'Hrs',
-                                # 'endRange': 'Inf',
-                                # 'description': '$13.22 per Unused Reservation Linux p3.8xlarge Instance Hour',
-                                # 'appliesTo': [],
-                                # 'rateCode': 'F78KERDK968ABWNU.JRTCKXETXF.6YS6EN2CT7',
-                                # 'beginRange': '0',
-                                # 'pricePerUnit': {'USD': '13.2200000000'}
-                            # }
-                        # },
-                        # 'sku': 'F78KERDK968ABWNU',
-                        # 'effectiveDate': '2020-10-01T00:00:00Z',
-                        # 'offerTermCode': 'JRTCKXETXF',
-                        # 'termAttributes': {}
-                    # }}
-
-                    # NOTE: hack to get into pricePerUnit since keys are obscure
-                    key1 = list(on_demand.keys())[0]
-                    key2 = list(on_demand[key1]['priceDimensions'].keys())[0]
-                    price = on_demand[key1]['priceDimensions'][key2]['pricePerUnit']['USD']
-
-                    prices_l.append({"region-name": aws_helper.region_code_to_region_name(location),
-                                   "instance-type": instance_type,
-                                   "price": float(price)})
-
-        return prices_l
+                region_name = location_to_region.get(location, None)
+                if region_name is None:
+                    continue
+
+                on_demand = elm['terms']['OnDemand']
+
+                # Example of price element:
+                # {'F78KERDK968ABWNU.JRTCKXETXF': {
+                    # 'priceDimensions': {
+                        # 'F78KERDK968ABWNU.JRTCKXETXF.6YS6EN2CT7': {
+                            # 'unit': 'Hrs',
+                            # 'endRange': 'Inf',
+                            # 'description': '$13.22 per Unused Reservation Linux p3.8xlarge Instance Hour',
+                            # 'appliesTo': [],
+                            # 'rateCode': 'F78KERDK968ABWNU.JRTCKXETXF.6YS6EN2CT7',
+                            # 'beginRange': '0',
+                            # 'pricePerUnit': {'USD': '13.2200000000'}
+                        # }
+                    # },
+                    # 'sku': 'F78KERDK968ABWNU',
+                    # 'effectiveDate': '2020-10-01T00:00:00Z',
+                    # 'offerTermCode': 'JRTCKXETXF',
+                    # 'termAttributes': {}
+                # }}
+
+                # NOTE: hack to get into pricePerUnit since keys are obscure
+                key1 = list(on_demand.keys())[0]
+                key2 = list(on_demand[key1]['priceDimensions'].keys())[0]
+                price = on_demand[key1]['priceDimensions'][key2]['pricePerUnit']['USD']
+
+                prices[region_name] = float(price)
+
+        return prices
 
     # @staticmethod
     # def lookup_ami(image_id :str):
@@ -499,13 +1080,42 @@ class EC2(object):
             # ])
 
     @staticmethod
-    def create_spot_instance(instance_cfg :dict):
+    def create_spot_instance(instance_cfg :dict) -> Optional[str]:
+        """Launch a single spot instance, see create_spot_instances
+        Returns:
+            instance id or None
+        """
+        instance_ids = EC2.create_spot_instances(instance_cfg, count=1)
+        return instance_ids[0] if len(instance_ids) > 0 else None
+
+    @staticmethod
+    def create_spot_instances(instance_cfg :dict,
+                              count :int=1,
+                              quorum :int=None,
+                              timeout :float=900,
+                              use_baked_image :bool=True,
+                              use_placement :bool=True) -> List[str]:
+        """Launch count spot instances from an instance config in one request
+        All requests are tracked together, each instance is tagged as soon as
+        its request is fulfilled, and this returns when quorum instances are ready.
+        Instances that are not ready by then keep starting in the background.
+        Args:
+            instance_cfg : instance config, see config.get_instance
+            count        : (optional) number of instances
+            quorum       : (optional) number of ready instances to wait for, default count
+            timeout      : (optional) seconds to wait for the quorum
+            use_baked_image : (optional) launch from a matching image made by bake_image, if any
+            use_placement   : (optional) choose the zone by the placement policy, see get_placement_zones,
+                              else launch in the configured zone
+        Returns:
+            list of ids of the ready instances
+        """
         session = get_boto_session()
-        client = session.client("ec2")
 
         cfg = instance_cfg["config"]
+        # The instance config's own region, ECR repositories are looked up here
         region_name = aws_helper.strip_to_region(cfg['region'])
-        instance_username = EC2.determine_ec2_user_from_image_id(cfg["ami"])
+        instance_username = EC2.determine_ec2_user_from_image_id(cfg["ami"], region_name=region_name)
 
         # TODO: if no key then create a key and use it
 
@@ -514,8 +1124,16 @@ class EC2(object):
         aws_secret_key = session.get_credentials().secret_key
         aws_default_region = session.region_name
 
+        phases_dir = os.path.dirname(BOOTSTRAP_PHASES_LOG)
         user_data = (
             f"#!/usr/bin/env bash\n"
+            f'mkdir -p {phases_dir}\n'
+            f'rxtb_phase() {{ echo "$(date +%s.%N) $1" >> {BOOTSTRAP_PHASES_LOG}; }}\n'
+            f"echo \"$(awk -v now=$(date +%s.%N) '{{printf \"%.3f\", now - $1}}' /proc/uptime) kernel-boot\" >> {BOOTSTRAP_PHASES_LOG}\n"
+            f'rxtb_phase user-data-start\n'
+        )
+        user_data += EC2._spot_watcher_user_data(instance_cfg, instance_username)
+        user_data += (
             f'su - {instance_username} <<AAA\n'
             f'echo "export TERM=xterm-256color" >> ~/.bashrc\n'
             f'echo "source /home/{instance_username}/.profile" >> ~/.bashrc\n'
@@ -527,6 +1145,7 @@ class EC2(object):
             f'AAA\n'
             f'source /home/{instance_username}/.profile\n'
             f'ln -s /home/{instance_username}/workdir /workdir\n'
+            f'rxtb_phase user-setup\n'
         )
 
         # IF container then add it to userdata
@@ -539,87 +1158,922 @@ class EC2(object):
                     f'su - {instance_username} <<AAA\n'
                     f'echo "DOCKER_IMAGE=\"{repo.repository_uri}:latest\"" >> ~/.profile\n'
                     f'$(aws ecr get-login --no-include-email --region {region_name})\n'
+                    f'AAA\n'
+                    f'rxtb_phase ecr-login\n'
+                    f'su - {instance_username} <<AAA\n'
                     f'docker pull {repo.repository_uri}:latest\n'
                     f'source /home/{instance_username}/.profile\n'
                     f'AAA\n'
+                    f'rxtb_phase docker-pull\n'
                 )
 
-        encoded_user_data = EC2.encode_userdata(user_data)
-        security_group_id = EC2.get_or_create_security_group(instance_cfg["name"])
-        EC2.update_ingress_rules(security_group_id, cfg["ports"])
-        ssh_key_name = EC2.get_valid_key_pair_name()
+        user_data += (
+            f'mkdir -p {os.path.dirname(BOOTSTRAP_SENTINEL)}\n'
+            f'touch {BOOTSTRAP_SENTINEL}\n'
+            f'rxtb_phase bootstrap-done\n'
+        )
 
+        encoded_user_data = EC2.encode_userdata(user_data)
 
         name = instance_cfg["name"] + "-" + get_uuid_part_str()
-        response = client.request_spot_instances(
-            InstanceCount=1,
-            LaunchSpecification={
-                'ImageId': cfg['ami'],
-                'InstanceType': cfg['type'],
-                'KeyName': ssh_key_name,
-                'Placement': {
-                    'AvailabilityZone': cfg['region'],
+        zones = EC2.get_placement_zones(instance_cfg) if use_placement is True else [cfg['region']]
+        start = time.time()
+        for i, zone in enumerate(zones):
+            placed = EC2._request_spot_instances(instance_cfg,
+                                                 name,
+                                                 zone,
+                                                 count,
+                                                 encoded_user_data,
+                                                 use_baked_image=use_baked_image,
+                                                 check_capacity=i < len(zones)-1)
+            if placed is not None:
+                request_ids, ami = placed
+                break
+        else:
+            raise Exception(f"Could not place {cfg['type']} spot instances in any of: {', '.join(zones)}")
+
+        request_time = time.time() - start
+        EC2.invalidate_inventory()
+
+        quorum = count if quorum is None else min(quorum, count)
+        timings :dict = {}
+        hosts :dict = {}
+        ready = EC2._wait_for_spot_instances(request_ids,
+                                             name,
+                                             quorum,
+                                             timeout,
+                                             extra_tags=[{'Key': INSTANCE_CFG_TAG, 'Value': instance_cfg["name"]},
+                                                         {'Key': BASE_AMI_TAG, 'Value': cfg["ami"]}],
+                                             user=instance_username,
+                                             start=start,
+                                             request_time=request_time,
+                                             timings=timings,
+                                             hosts=hosts,
+                                             region_name=aws_helper.strip_to_region(zone))
+
+        # Add the phases marked on the instances by the user-data script
+        key_path = EC2Instance.get_key_path()
+        with ThreadPoolExecutor(max_workers=min(max(len(ready), 1), 16)) as executor:
+            bootstrap_phases = executor.map(
+                lambda x: EC2.collect_bootstrap_phases(hosts[x], instance_username, key_path=key_path),
+                ready)
+            for instance_id, phases in zip(ready, bootstrap_phases):
+                timings[instance_id].update({k: v - start for k, v in phases.items()})
+
+        EC2.save_launch_report(name, instance_cfg, start, timings, ami=ami, zone=zone)
+        EC2.list_instances(profile, refresh=True)
+
+        print("\nLaunch timings (seconds since request):")
+        print_rows(EC2.launch_timing_rows(timings), index=False)
+
+        return ready
+
+    @staticmethod
+    def _request_spot_instances(instance_cfg :dict,
+                                name :str,
+                                zone :str,
+                                count :int,
+                                encoded_user_data :str,
+                                use_baked_image :bool=True,
+                                check_capacity :bool=False) -> Optional[Tuple[List[str], str]]:
+        """Request count spot instances in zone, with the AMI, security group
+        and key pair of the zone's region
+        Args:
+            check_capacity : (optional) give up when the requests are not fulfillable,
+                             for falling back to another zone
+        Returns:
+            (spot request ids, image id) or None if the zone could not be used
+        """
+        import botocore.exceptions
+
+        cfg = instance_cfg["config"]
+        region_name = aws_helper.strip_to_region(zone)
+        client = get_boto_client("ec2", region_name=region_name)
+
+        # AMI ids are per region, use the image with the same name and owner
+        ami = EC2.resolve_image_id(cfg["ami"],
+                                   aws_helper.strip_to_region(cfg['region']),
+                                   region_name)
+        if ami is None:
+            print(f"  skipping {zone}: no copy of {cfg['ami']} in {region_name}")
+            return None
+
+        if use_baked_image is True:
+            baked_ami = EC2.find_baked_image(instance_cfg, region_name=region_name)
+            if baked_ami is not None:
+                print(f"Using baked image {baked_ami} with the current container image")
+                ami = baked_ami
+
+        security_group_id = EC2.get_or_create_security_group(instance_cfg["name"], region_name=region_name)
+        EC2.update_ingress_rules(security_group_id, cfg["ports"], region_name=region_name)
+        ssh_key_name = EC2.get_valid_key_pair_name(region_name=region_name)
+
+        print(f"Requesting {count} {cfg['type']} spot instance(s) in {zone}")
+        try:
+            response = client.request_spot_instances(
+                InstanceCount=count,
+                LaunchSpecification={
+                    'ImageId': ami,
+                    'InstanceType': cfg['type'],
+                    'KeyName': ssh_key_name,
+                    'Placement': {
+                        'AvailabilityZone': zone,
+                    },
+                    # 'Monitoring': {
+                        # 'Enabled': True,
+                    # },
+                    'SecurityGroupIds': [
+                        security_group_id,
+                    ],
+                    'BlockDeviceMappings': [
+                        {'DeviceName': x['devname'],
+                         'Ebs': {
+                            'DeleteOnTermination': True,
+                            'VolumeSize': x['size']
+                          }
+                        } for x in cfg['volumes']
+                    ],
+                    'UserData': encoded_user_data,
                 },
-                # 'Monitoring': {
-                    # 'Enabled': True,
-                # },
-                'SecurityGroupIds': [
-                    security_group_id,
-                ],
-                'BlockDeviceMappings': [
-                    {'DeviceName': x['devname'],
-                     'Ebs': {
-                        'DeleteOnTermination': True,
-                        'VolumeSize': x['size']
-                      }
-                    } for x in cfg['volumes']
+                TagSpecifications=[
+                    {'ResourceType': 'spot-instances-request',
+                     'Tags': generate_tags(name),
+                    },
                 ],
-                'UserData': encoded_user_data,
-            },
-            TagSpecifications=[
-                {'ResourceType': 'spot-instances-request',
-                 'Tags': generate_tags(name),
-                },
-            ],
-            Type='persistent',
-            InstanceInterruptionBehavior='stop',
-        )
-        request_id = response['SpotInstanceRequests'][0]['SpotInstanceRequestId']
+                Type='persistent',
+                InstanceInterruptionBehavior='stop',
+            )
+        except botocore.exceptions.ClientError as e:
+            if check_capacity is False or e.response['Error']['Code'] not in SPOT_CAPACITY_ERRORS:
+                raise e
+            print(f"  skipping {zone}: {e.response['Error']['Message']}")
+            return None
 
-        print("Wait for request to be fulfilled...")
-        waiter = client.get_waiter('spot_instance_request_fulfilled')
-        waiter.wait(
-            SpotInstanceRequestIds=[request_id,],
-            WaiterConfig={
-                'Delay': 5,
-                'MaxAttempts': 100,
-            }
-        )
+        request_ids = [x['SpotInstanceRequestId'] for x in response['SpotInstanceRequests']]
+
+        if check_capacity is True and not EC2._spot_requests_fulfillable(client, request_ids):
+            for request_id in request_ids:
+                client.cancel_spot_instance_requests(SpotInstanceRequestIds=[request_id])
+            print(f"  skipping {zone}: no spot capacity")
+            return None
+
+        return (request_ids, ami)
+
+    @staticmethod
+    def _spot_requests_fulfillable(client, request_ids :List[str], timeout :float=60) -> bool:
+        """Wait for the spot requests to be evaluated
+        Returns:
+            False if every request reports that it can not be fulfilled
+        """
+        import botocore.exceptions
+
+        start = time.time()
+        delay = 1
+        while time.time() - start < timeout:
+            try:
+                response = client.describe_spot_instance_requests(SpotInstanceRequestIds=request_ids)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'InvalidSpotInstanceRequestID.NotFound':
+                    raise e
+                response = {'SpotInstanceRequests': []}
+
+            codes = [x.get('Status', {}).get('Code', '') for x in response['SpotInstanceRequests']]
+            if len(codes) == len(request_ids):
+                if all(code in SPOT_UNFULFILLABLE_CODES for code in codes):
+                    return False
+                if not any(code in SPOT_PENDING_CODES for code in codes):
+                    return True
+
+            time.sleep(delay)
+            delay = min(delay * 2, 8)
+
+        # Still being evaluated, keep waiting for it in the normal way
+        return True
+
+    @staticmethod
+    def _wait_for_spot_instances(request_ids :List[str],
+                                 name :str,
+                                 quorum :int,
+                                 timeout :float,
+                                 extra_tags :List[dict],
+                                 user :str,
+                                 start :float,
+                                 request_time :float=0,
+                                 timings :dict=None,
+                                 hosts :dict=None,
+                                 region_name :str=None,
+                                 min_delay :float=1,
+                                 max_delay :float=15) -> List[str]:
+        """Poll all spot requests together, tag fulfilled instances and wait for quorum ready
+        An instance is ready once ssh answers and the user-data has written
+        BOOTSTRAP_SENTINEL. Polling backs off while nothing changes and
+        speeds up again on progress. Requests still open when it returns are
+        cancelled.
+        Args:
+            extra_tags : tags added to every instance, besides the name tags
+            timings    : (optional) filled with {instance_id: {phase: seconds since start}}
+            hosts      : (optional) filled with {instance_id: public dns}
+            region_name : (optional) region of the spot requests
+        """
+        import botocore.exceptions
+
+        client = get_boto_client("ec2", region_name=region_name)
+        key_path = EC2Instance.get_key_path()
+        timings = {} if timings is None else timings
+
+        # spot request id -> instance id
+        fulfilled :dict = {}
+        # instance id -> public dns of running instances
+        hosts = {} if hosts is None else hosts
+        ready :List[str] = []
+
+        def _elapsed() -> float:
+            return time.time() - start
+
+        print(f"Wait for {quorum} of {len(request_ids)} instance(s) to be ready...")
+        try:
+            delay = min_delay
+            while True:
+                progress = False
+
+                if len(fulfilled) < len(request_ids):
+                    try:
+                        response = client.describe_spot_instance_requests(SpotInstanceRequestIds=request_ids)
+                    except botocore.exceptions.ClientError as e:
+                        # New requests are not always visible right away
+                        if e.response['Error']['Code'] != 'InvalidSpotInstanceRequestID.NotFound':
+                            raise e
+                        response = {'SpotInstanceRequests': []}
+
+                    for request in response['SpotInstanceRequests']:
+                        request_id = request['SpotInstanceRequestId']
+                        instance_id = request.get('InstanceId', None)
+                        if instance_id is None or request_id in fulfilled:
+                            continue
+
+                        fulfilled[request_id] = instance_id
+                        timings[instance_id] = {"request": request_time, "fulfil": _elapsed()}
+                        progress = True
+                        if len(request_ids) == 1:
+                            tags = generate_tags(name)
+                        else:
+                            tags = generate_tags(f"{name}-{len(fulfilled)-1}") + [{'Key': 'rxtb-fleet', 'Value': name}]
+
+                        tag_response = client.create_tags(
+                            Resources=[instance_id,],
+                            Tags=tags + extra_tags,
+                        )
+
+                        if tag_response and tag_response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                            raise Exception(f"Error when adding tags to instance_id: {instance_id}")
+
+                        print(f"  request fulfilled: {request_id} -> {instance_id} ({_elapsed():.0f}s)")
+
+                booting = [x for x in fulfilled.values() if x not in hosts]
+                if EC2._poll_booted(client, booting, hosts, timings, _elapsed):
+                    progress = True
+
+                if EC2._poll_ready(user, hosts, ready, timings, _elapsed, key_path=key_path):
+                    progress = True
+
+                if len(ready) >= quorum:
+                    break
+
+                if _elapsed() > timeout:
+                    print(f"Timed out after {timeout}s with {len(ready)} of {quorum} instance(s) ready")
+                    break
+
+                delay = min_delay if progress else min(delay * 2, max_delay)
+                time.sleep(delay)
+        finally:
+            # Instances of requests fulfilled after this are not tagged, so
+            # nothing would list or stop them
+            EC2._cancel_open_spot_requests(client, [x for x in request_ids if x not in fulfilled])
+
+        return ready
+
+    @staticmethod
+    def _cancel_open_spot_requests(client, request_ids :List[str]):
+        """Cancel spot requests and terminate the instances they launched meanwhile"""
+        if len(request_ids) == 0:
+            return
+
+        client.cancel_spot_instance_requests(SpotInstanceRequestIds=request_ids)
+        print(f"  cancelled {len(request_ids)} open spot request(s)")
+
+        response = client.describe_spot_instance_requests(SpotInstanceRequestIds=request_ids)
+        instance_ids = [x['InstanceId'] for x in response['SpotInstanceRequests'] if x.get('InstanceId', None)]
+        if len(instance_ids) > 0:
+            client.terminate_instances(InstanceIds=instance_ids)
+            print(f"  terminated {len(instance_ids)} untagged instance(s) of cancelled requests")
+
+    @staticmethod
+    def _poll_booted(client, instance_ids :List[str], hosts :dict, timings :dict, elapsed) -> bool:
+        """Add instances that are running to hosts {instance_id: public dns}
+        Returns:
+            True if any instance was added
+        """
+        import botocore.exceptions
+
+        if len(instance_ids) == 0:
+            return False
+
+        try:
+            response = client.describe_instances(InstanceIds=instance_ids)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound':
+                raise e
+            return False
+
+        progress = False
+        for reservation in response['Reservations']:
+            for instance in reservation['Instances']:
+                if instance['State']['Name'] != 'running' or not instance.get('PublicDnsName'):
+                    continue
+                hosts[instance['InstanceId']] = instance['PublicDnsName']
+                timings[instance['InstanceId']]["boot"] = elapsed()
+                progress = True
+                print(f"  instance running: {instance['InstanceId']} ({elapsed():.0f}s)")
+        return progress
+
+    @staticmethod
+    def _poll_ready(user :str, hosts :dict, ready :List[str], timings :dict, elapsed, key_path :str=None) -> bool:
+        """Probe running instances over ssh and add the bootstrapped ones to ready
+        Returns:
+            True if any instance got further
+        """
+        probing = [x for x in hosts if x not in ready]
+        if len(probing) == 0:
+            return False
+
+        def _probe(instance_id :str) -> Optional[int]:
+            return ssh.probe(hosts[instance_id], user, f"test -f {BOOTSTRAP_SENTINEL}", key_path=key_path)
+
+        with ThreadPoolExecutor(max_workers=min(len(probing), 16)) as executor:
+            results = dict(zip(probing, executor.map(_probe, probing)))
+
+        progress = False
+        for instance_id, rc in results.items():
+            if rc is None:
+                continue
+            if "ssh-up" not in timings[instance_id]:
+                timings[instance_id]["ssh-up"] = elapsed()
+                progress = True
+            if rc == 0:
+                timings[instance_id]["docker-pulled"] = elapsed()
+                ready.append(instance_id)
+                progress = True
+                print(f"  instance ready: {instance_id} ({elapsed():.0f}s)")
+        return progress
+
+    @staticmethod
+    def list_parked_instances(instance_cfg :dict) -> List[EC2Instance]:
+        """Parked instances of an instance config in all regions it can be
+        placed in, most recently parked first"""
+        cfg = instance_cfg["config"]
+
+        instances = []
+        for region_name in EC2.get_instance_cfg_regions(instance_cfg):
+            paginator = get_boto_client("ec2", region_name=region_name).get_paginator('describe_instances')
+            pages = paginator.paginate(
+                Filters = [
+                    {'Name': 'instance-state-name', 'Values': ['stopped',]},
+                    {'Name': 'tag-key', 'Values': [PARKED_TAG,]},
+                    {'Name': f'tag:{INSTANCE_CFG_TAG}', 'Values': [instance_cfg["name"],]},
+                    {'Name': f'tag:{BASE_AMI_TAG}', 'Values': [cfg["ami"],]},
+                    {'Name': 'instance-type', 'Values': [cfg["type"],]},
+                    {'Name': 'tag:origin-email', 'Values': [profile.email,]},
+                    {'Name': 'tag:origin-name', 'Values': [profile.name,]},
+                ]
+            )
+            for page in pages:
+                for reservation in page["Reservations"]:
+                    for instance in reservation["Instances"]:
+                        instances.append(EC2Instance(instance))
+
+        return sorted(instances, key=lambda x: int(x.tags.get(PARKED_TAG, 0)), reverse=True)
+
+    @staticmethod
+    def expire_parked_instances(instance_cfg :dict) -> List[EC2Instance]:
+        """Terminate parked instances that have been idle longer than the idle
+        expiry, or do not fit in the pool
+        Returns:
+            the parked instances that are kept, most recently parked first
+        """
+        warm_pool = instance_cfg["config"]["warm_pool"]
+        max_idle = warm_pool["idle_expiry_hours"] * 60 * 60
+
+        kept = []
+        for instance in EC2.list_parked_instances(instance_cfg):
+            idle = time.time() - int(instance.tags.get(PARKED_TAG, 0))
+            if idle > max_idle or len(kept) >= warm_pool["size"]:
+                instance.terminate()
+            else:
+                kept.append(instance)
+        return kept
+
+    @staticmethod
+    def plan_release(instances :List[EC2Instance], terminate :bool=False) -> List[str]:
+        """Decide which instances to park, in one go for all instances being
+        released, so the warm pools are counted once and not overfilled
+        Args:
+            instances : instances to release
+            terminate : (optional) terminate all instances
+        Returns:
+            ids of the instances to park, the others are terminated
+        """
+        if terminate is True:
+            return []
+
+        # instance config name -> (instance config, instances that can be parked)
+        candidates :dict = {}
+        for instance in instances:
+            if not instance.spot_request_id:
+                continue
+            instance_cfg = instance.get_instance_cfg()
+            if (instance_cfg is None
+                    or instance_cfg["config"]["warm_pool"]["size"] <= 0
+                    or instance.tags.get(BASE_AMI_TAG, None) != instance_cfg["config"]["ami"]):
+                continue
+            candidates.setdefault(instance_cfg["name"], (instance_cfg, []))[1].append(instance)
+
+        park = []
+        for instance_cfg, cfg_instances in candidates.values():
+            room = instance_cfg["config"]["warm_pool"]["size"] - len(EC2.expire_parked_instances(instance_cfg))
+            park += [x.instance_id for x in cfg_instances[:max(room, 0)]]
+        return park
+
+    @staticmethod
+    def release_instance(instance :EC2Instance, park :bool=False):
+        """Park or terminate the instance, see plan_release. The inventory is
+        not refreshed, call list_instances(refresh=True) once after releasing."""
+        if park is True:
+            instance.park()
+        else:
+            instance.terminate()
+
+    @staticmethod
+    def resume_parked_instances(instance_cfg :dict, count :int=1, timeout :float=600) -> List[str]:
+        """Start up to count parked instances of the instance config, and pull
+        the latest image of its container on them
+        Returns:
+            list of ids of the resumed instances that are ready
+        """
+        import botocore.exceptions
 
-        response = client.describe_spot_instance_requests(SpotInstanceRequestIds=[request_id,])
-        instance_id = response['SpotInstanceRequests'][0]['InstanceId']
+        parked = EC2.expire_parked_instances(instance_cfg)[:count]
+        if len(parked) == 0:
+            return []
 
-        response = client.create_tags(
-            Resources=[instance_id,],
-            Tags=generate_tags(name),
+        cfg = instance_cfg["config"]
+        region_name = aws_helper.strip_to_region(cfg['region'])
+        user = EC2.determine_ec2_user_from_image_id(cfg["ami"], region_name=region_name)
+        key_path = EC2Instance.get_key_path()
+
+        start = time.time()
+
+        def _elapsed() -> float:
+            return time.time() - start
+
+        timings :dict = {}
+        for instance in parked:
+            print(f"Resuming parked instance name/id: {instance.instance_name}/{instance.instance_id}")
+            client = get_boto_client("ec2", region_name=instance.region)
+            try:
+                client.start_instances(InstanceIds=[instance.instance_id])
+            except botocore.exceptions.ClientError as e:
+                # e.g. no spot capacity, leave it parked
+                print(f"  could not resume {instance.instance_id}: {e.response['Error']['Message']}")
+                continue
+            client.delete_tags(Resources=[instance.instance_id], Tags=[{'Key': PARKED_TAG}])
+            timings[instance.instance_id] = {"request": _elapsed()}
+
+        regions = {x.instance_id: x.region for x in parked}
+
+        hosts :dict = {}
+        ready :List[str] = []
+        delay = 1
+        while len(timings) > 0:
+            progress = False
+            for instance_region in sorted(set(regions[x] for x in timings)):
+                booting = [x for x in timings if x not in hosts and regions[x] == instance_region]
+                if len(booting) > 0:
+                    client = get_boto_client("ec2", region_name=instance_region)
+                    progress = EC2._poll_booted(client, booting, hosts, timings, _elapsed) or progress
+            progress = EC2._poll_ready(user, hosts, ready, timings, _elapsed, key_path=key_path) or progress
+
+            if len(ready) >= len(timings):
+                break
+
+            if _elapsed() > timeout:
+                print(f"Timed out after {timeout}s with {len(ready)} of {len(timings)} instance(s) resumed")
+                break
+
+            delay = 1 if progress else min(delay * 2, 15)
+            time.sleep(delay)
+
+        # The user-data script does not run again on a resumed instance, pull
+        # the container image that was just pushed instead
+        if instance_cfg.get('container', None) and len(ready) > 0:
+            with ThreadPoolExecutor(max_workers=min(len(ready), 16)) as executor:
+                futures = {executor.submit(EC2._pull_container, hosts[x], user, region_name, key_path): x
+                           for x in ready}
+                for future in as_completed(futures):
+                    instance_id = futures[future]
+                    if future.result() is True:
+                        timings[instance_id]["docker-pulled"] = _elapsed()
+                    else:
+                        print(f"  could not pull the container image on {instance_id}, "
+                              f"it runs the image it was parked with", file=sys.stderr)
+
+        if len(timings) > 0:
+            name = f"{instance_cfg['name']}-resume-{get_uuid_part_str()}"
+            EC2.save_launch_report(name, instance_cfg, start, timings, ami=parked[0].image_id)
+            EC2.list_instances(profile, refresh=True)
+
+            print("\nResume timings (seconds since start):")
+            print_rows(EC2.launch_timing_rows(timings), index=False)
+
+        return ready
+
+    @staticmethod
+    def _pull_container(host :str, user :str, region_name :str, key_path :str=None) -> bool:
+        """Log in to ECR and pull the latest container image, DOCKER_IMAGE in
+        ~/.profile, on an instance launched with the container"""
+        cmd = ssh.generate_ssh_pipe_command(
+            host,
+            user,
+            f'. ~/.profile; $(aws ecr get-login --no-include-email --region {region_name}) > /dev/null'
+            f' && docker pull -q "$DOCKER_IMAGE"',
+            key_path=key_path)
+        res = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        return res.returncode == 0
+
+    @staticmethod
+    def _spot_watcher_user_data(instance_cfg :dict, username :str) -> str:
+        """user-data installing a service that polls the instance metadata for
+        a spot interruption notice. On notice the checkpoint dir, if any, is
+        synced to S3 and the events are appended to SPOT_INTERRUPTIONS_LOG.
+        """
+        checkpoint = instance_cfg["config"]["checkpoint"]
+        flush = "sync"
+        if checkpoint is not None and checkpoint["s3"] is not None:
+            s3_url = f"{checkpoint['s3'].rstrip('/')}/$instance_id/{checkpoint['dir']}"
+            flush = f'su - {username} -c "aws s3 sync /workdir/{checkpoint["dir"]} {s3_url}"'
+
+        metadata_url = "http://169.254.169.254/latest"
+        return (
+            f"cat > /usr/local/bin/rxtb-spot-watch <<'WATCH'\n"
+            f"#!/usr/bin/env bash\n"
+            f"mkdir -p {os.path.dirname(SPOT_INTERRUPTIONS_LOG)}\n"
+            f"while true; do\n"
+            f'  token=$(curl -s -m 2 -X PUT {metadata_url}/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 300")\n'
+            f'  notice=$(curl -s -f -m 2 -H "X-aws-ec2-metadata-token: $token" {metadata_url}/meta-data/spot/instance-action)\n'
+            f'  if [ -n "$notice" ]; then\n'
+            f'    echo "$(date +%s) notice $notice" >> {SPOT_INTERRUPTIONS_LOG}\n'
+            f'    instance_id=$(curl -s -m 2 -H "X-aws-ec2-metadata-token: $token" {metadata_url}/meta-data/instance-id)\n'
+            f'    {flush}\n'
+            f'    echo "$(date +%s) flushed $?" >> {SPOT_INTERRUPTIONS_LOG}\n'
+            f"    # The notice stays until the instance is stopped, flush once\n"
+            f"    sleep 600\n"
+            f"  fi\n"
+            f"  sleep 5\n"
+            f"done\n"
+            f"WATCH\n"
+            f"chmod +x /usr/local/bin/rxtb-spot-watch\n"
+            f"cat > /etc/systemd/system/rxtb-spot-watch.service <<'UNIT'\n"
+            f"[Unit]\n"
+            f"Description=rixtribute spot interruption watcher\n"
+            f"After=network-online.target\n"
+            f"[Service]\n"
+            f"ExecStart=/usr/local/bin/rxtb-spot-watch\n"
+            f"Restart=always\n"
+            f"[Install]\n"
+            f"WantedBy=multi-user.target\n"
+            f"UNIT\n"
+            f"systemctl daemon-reload\n"
+            f"systemctl enable --now rxtb-spot-watch\n"
         )
 
-        if response and response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            raise Exception(f"Error when adding tags to instance_id: {instance_id}")
+    @staticmethod
+    def _get_interruption_cache() -> FileCache:
+        return FileCache("spot-interruptions")
 
-        print("Wait for instance to start..")
-        waiter = client.get_waiter('instance_status_ok')
-        waiter.wait(
-            InstanceIds=[instance_id,],
-            WaiterConfig={
-                'Delay': 5,
-                'MaxAttempts': 100}
+    @staticmethod
+    def list_interruptions() -> List[dict]:
+        """Spot interruption events recorded by watch_interruptions, oldest first"""
+        return [event for _, event in EC2._get_interruption_cache().items()]
+
+    @staticmethod
+    def watch_interruptions(instances :List[EC2Instance],
+                            dest :str='.',
+                            interval :float=30,
+                            rounds :int=None):
+        """Poll the interruption watchers on the instances and record new events
+        locally. On a notice for an instance whose checkpoint dir is not synced
+        to S3, the checkpoint dir is downloaded to dest/<instance id>.
+        Args:
+            instances : instances to watch
+            dest      : (optional) local directory for downloaded checkpoints
+            interval  : (optional) seconds between polls
+            rounds    : (optional) number of polls, default until interrupted
+        """
+        cache = EC2._get_interruption_cache()
+        instances = [x for x in instances if x.status == "running" and x.public_dns]
+        if len(instances) == 0:
+            return
+
+        n = 0
+        while rounds is None or n < rounds:
+            n += 1
+            with ThreadPoolExecutor(max_workers=min(len(instances), 16)) as executor:
+                all_events = list(executor.map(lambda x: x.get_interruption_events(), instances))
+
+            for instance, events in zip(instances, all_events):
+                for event in events:
+                    key = cache.make_key(instance.instance_id, event["time"], event["event"])
+                    if cache.has(key):
+                        continue
+
+                    record = dict({"instance_id": instance.instance_id,
+                                   "instance_name": instance.instance_name,
+                                   "zone": instance.zone},
+                                  **event)
+                    print(f"{instance.instance_name}/{instance.instance_id}: {event['event']} {event['detail']}")
+
+                    instance_cfg = instance.get_instance_cfg()
+                    checkpoint = instance_cfg["config"]["checkpoint"] if instance_cfg is not None else None
+                    if event["event"] == "notice" and checkpoint is not None and checkpoint["s3"] is None:
+                        local_dir = os.path.join(dest, instance.instance_id)
+                        os.makedirs(local_dir, exist_ok=True)
+                        print(f"  pulling {checkpoint['dir']} to {local_dir}")
+                        record["pulled"] = bool(instance.copy_files_from_workdir([checkpoint["dir"]],
+                                                                                 recursive=True,
+                                                                                 dest=local_dir))
+
+                    cache.set(key, record)
+
+            if rounds is None or n < rounds:
+                time.sleep(interval)
+
+    @staticmethod
+    def collect_bootstrap_phases(host :str, user :str, port :int=22, key_path :str=None) -> dict:
+        """Read the phase markers written by the user-data script
+        Returns:
+            {phase: epoch seconds on the instance clock}
+        """
+        cmd = ssh.generate_ssh_pipe_command(host, user, f"cat {BOOTSTRAP_PHASES_LOG}", port=port, key_path=key_path)
+        res = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if res.returncode != 0:
+            return {}
+
+        phases = {}
+        for line in res.stdout.decode().splitlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            try:
+                phases[parts[1]] = float(parts[0])
+            except ValueError:
+                continue
+        return phases
+
+    @staticmethod
+    def _get_launch_report_cache() -> FileCache:
+        return FileCache("launch-timings")
+
+    @staticmethod
+    def save_launch_report(name :str, instance_cfg :dict, start :float, timings :dict, ami :str=None, zone :str=None):
+        """Persist the phase timings of a launch, for comparing AMIs,
+        instance types and regions"""
+        cfg = instance_cfg["config"]
+        ami = cfg["ami"] if ami is None else ami
+        zone = cfg["region"] if zone is None else zone
+        report = {
+            "name": name,
+            "started": datetime.datetime.utcfromtimestamp(start).isoformat(timespec="seconds"),
+            "ami": ami,
+            "instance-type": cfg["type"],
+            "zone": zone,
+            "container": instance_cfg.get("container", None),
+            "instances": timings,
+        }
+        EC2._get_launch_report_cache().set(name, report)
+
+    @staticmethod
+    def list_launch_reports() -> List[dict]:
+        """Persisted launch reports, oldest first"""
+        return [report for _, report in EC2._get_launch_report_cache().items()]
+
+    @staticmethod
+    def launch_timing_rows(timings :dict) -> List[dict]:
+        """One row per instance with whole seconds per phase
+        Phases measured locally and on the instance are merged in their usual
+        order, the instance clock is assumed to be in sync with the local one.
+        """
+        phases = (LAUNCH_PHASES[:2] + BOOTSTRAP_PHASES[:2] + LAUNCH_PHASES[2:3]
+                  + BOOTSTRAP_PHASES[2:3] + LAUNCH_PHASES[3:4] + BOOTSTRAP_PHASES[3:]
+                  + LAUNCH_PHASES[4:])
+        return [dict({"instance": instance_id},
+                     **{phase: f"{t[phase]:.0f}" if phase in t else '' for phase in phases})
+                for instance_id, t in timings.items()]
+
+    @classmethod
+    def resolve_image_id(cls, image_id :str, source_region :str, region_name :str) -> Optional[str]:
+        """Id of the image in region_name with the same name and owner as
+        image_id in source_region, memoized on disk since it never changes
+        Returns:
+            image id or None if the image is not available in region_name
+        """
+        if source_region == region_name:
+            return image_id
+
+        cache = FileCache("ami-region-ids")
+        key = cache.make_key(image_id, region_name)
+        if cache.has(key):
+            return cache.get(key)
+
+        source = cls._get_ec2_boto_client(source_region).describe_images(ImageIds=[image_id])
+        if len(source["Images"]) == 0:
+            return None
+
+        response = cls._get_ec2_boto_client(region_name).describe_images(
+            Owners=[source["Images"][0]["OwnerId"]],
+            Filters=[{'Name': 'name', 'Values': [source["Images"][0]["Name"]]}],
         )
 
+        resolved = response["Images"][0]["ImageId"] if len(response["Images"]) > 0 else None
+        if resolved is not None:
+            cache.set(key, resolved)
+        return resolved
+
     @staticmethod
-    def cancel_spot_instance_request(spot_request_id: str):
-        session = get_boto_session()
-        client = session.client("ec2")
+    def get_instance_cfg_regions(instance_cfg :dict) -> List[str]:
+        """Regions an instance config can be launched in by its region and placement"""
+        cfg = instance_cfg["config"]
+        regions = [aws_helper.strip_to_region(cfg['region'])]
+        regions += cfg["placement"]["regions"]
+        regions += [aws_helper.strip_to_region(x) for x in cfg["placement"]["zones"]]
+        return sorted(set(x for x in regions if x))
+
+    @classmethod
+    def get_placement_zones(cls, instance_cfg :dict) -> List[str]:
+        """Zones to try for a launch, in order, by the instance config's placement
+        policy:
+            fixed    : the configured zone only
+            ordered  : the allowed zones in the configured order
+            cheapest : the allowed zones with spot prices for the instance type,
+                       by current price, then the least volatile price
+        The allowed zones are the placement zones and all zones of the
+        placement regions, by default the zones of the configured region.
+        """
+        cfg = instance_cfg["config"]
+        placement = cfg["placement"]
+        if placement["policy"] == "fixed":
+            return [cfg['region']]
+
+        zones = list(placement["zones"])
+        regions = list(placement["regions"])
+        if len(zones) == 0 and len(regions) == 0:
+            regions = [aws_helper.strip_to_region(cfg['region'])]
+
+        for region_name in regions:
+            response = cls._get_ec2_boto_client(region_name).describe_availability_zones(
+                Filters=[{'Name': 'state', 'Values': ['available']}])
+            zones += sorted(x["ZoneName"] for x in response["AvailabilityZones"] if x["ZoneName"] not in zones)
+
+        if placement["policy"] == "ordered":
+            return zones
+
+        prices = cls.list_spot_prices(instance_types=[cfg['type']],
+                                      region_names=sorted(set(aws_helper.strip_to_region(x) for x in zones)),
+                                      aggregate=True)
+        prices_by_zone = {x["zone"]: x for x in prices}
+
+        ranked = sorted([x for x in zones if x in prices_by_zone],
+                        key=lambda x: (prices_by_zone[x]["price"], prices_by_zone[x]["price-p95"]))
+        if len(ranked) == 0:
+            raise Exception(f"No spot prices for {cfg['type']} in any of: {', '.join(zones)}")
+
+        print("Placement by spot price:")
+        print_rows([prices_by_zone[x] for x in ranked])
+        return ranked
+
+    @staticmethod
+    def _get_container_digest(instance_cfg :dict, region_name :str=None) -> Optional[str]:
+        """Digest of the latest image of the instance config's container"""
+        container_name = instance_cfg.get('container', None)
+        if not container_name:
+            return None
+        container_cfg = config.get_container(container_name)
+        return ECR.get_image_digest(container_cfg['tag'], region_name=region_name)
+
+    @staticmethod
+    def _get_bake_tags(instance_cfg :dict, digest :str) -> List[dict]:
+        """Tags identifying what a baked image was made from"""
+        return [{'Key': INSTANCE_CFG_TAG, 'Value': instance_cfg["name"]},
+                {'Key': BASE_AMI_TAG, 'Value': instance_cfg["config"]["ami"]},
+                {'Key': IMAGE_DIGEST_TAG, 'Value': digest}]
+
+    @staticmethod
+    def find_baked_image(instance_cfg :dict, region_name :str=None) -> Optional[str]:
+        """Newest image baked from the instance config's AMI with the current
+        container image already pulled
+        Returns:
+            image id or None
+        """
+        digest = EC2._get_container_digest(instance_cfg, region_name=region_name)
+        if digest is None:
+            return None
+
+        client = get_boto_client("ec2", region_name=region_name)
+        project_name = config.get_project()["name"]
+        filters = [{'Name': 'state', 'Values': ['available']},
+                   {'Name': 'tag:project', 'Values': [project_name]}]
+        filters += [{'Name': f"tag:{tag['Key']}", 'Values': [tag['Value']]}
+                    for tag in EC2._get_bake_tags(instance_cfg, digest)]
+        response = client.describe_images(Owners=['self'], Filters=filters)
+
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+
+        images = sorted(response["Images"], key=lambda x: x["CreationDate"], reverse=True)
+        if len(images) == 0:
+            return None
+        return images[0]["ImageId"]
+
+    @staticmethod
+    def bake_image(instance_cfg :dict, timeout :float=1800) -> str:
+        """Launch an instance from the configured AMI, pull the container and
+        save it as a project tagged AMI. Later launches of the instance config
+        use the image as long as the container image digest is unchanged.
+        Returns:
+            image id
+        """
+        cfg = instance_cfg["config"]
+        region_name = aws_helper.strip_to_region(cfg['region'])
+
+        digest = EC2._get_container_digest(instance_cfg, region_name=region_name)
+        if digest is None:
+            raise Exception(f"Instance {instance_cfg['name']} has no container image to bake, "
+                            f"configure a container and push it first")
+
+        instance_ids = EC2.create_spot_instances(instance_cfg, count=1, use_baked_image=False, use_placement=False)
+        if len(instance_ids) == 0:
+            raise Exception("Instance to bake from did not become ready")
+
+        instance = EC2.get_instance(instance_ids[0], region_name=region_name)
+        try:
+            # Remove the per-launch state written by the user-data script,
+            # it is written again when an instance boots from the image
+            user = instance.get_username()
+            cmd = ssh.generate_ssh_pipe_command(
+                instance.public_dns,
+                user,
+                f"sudo rm -rf {os.path.dirname(BOOTSTRAP_SENTINEL)} /workdir && rm -rf ~/workdir"
+                f" && sed -i '/^export AWS_/d;/^DOCKER_IMAGE=/d' ~/.profile",
+                port=instance.ssh_port,
+                key_path=EC2Instance.get_key_path())
+            res = subprocess.run(cmd, stdin=subprocess.DEVNULL)
+            if res.returncode != 0:
+                raise Exception(f"Error when cleaning up instance {instance.instance_id} before baking")
+
+            client = get_boto_client("ec2", region_name=region_name)
+            base_image_name = EC2.lookup_image_name(cfg["ami"], region_name=region_name)
+            # Keep the base image name, it is used to find the ssh user
+            name = f"rxtb-{instance_cfg['name']}-{digest[7:19]}-{get_uuid_part_str()} {base_image_name}"[:128]
+            tags = generate_tags(name) + EC2._get_bake_tags(instance_cfg, digest)
+
+            print(f"Creating image {name}...")
+            response = client.create_image(
+                InstanceId=instance.instance_id,
+                Name=name,
+                Description=f"rixtribute {instance_cfg['name']} with {digest}",
+                TagSpecifications=[
+                    {'ResourceType': 'image', 'Tags': tags},
+                    {'ResourceType': 'snapshot', 'Tags': tags},
+                ],
+            )
+
+            if response and response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                raise Exception(f"Error when creating image from {instance.instance_id}")
+
+            image_id = response["ImageId"]
+            print(f"Wait for image {image_id} to be available...")
+            waiter = client.get_waiter('image_available')
+            waiter.wait(
+                ImageIds=[image_id],
+                WaiterConfig={
+                    'Delay': 15,
+                    'MaxAttempts': math.ceil(timeout / 15)}
+            )
+        finally:
+            instance.terminate()
+
+        return image_id
+
+    @staticmethod
+    def cancel_spot_instance_request(spot_request_id: str, region_name :str=None):
+        client = get_boto_client("ec2", region_name=region_name)
 
         response = client.cancel_spot_instance_requests(
             SpotInstanceRequestIds=[spot_request_id]
@@ -639,9 +2093,8 @@ class EC2(object):
         )
 
     @staticmethod
-    def create_security_group(instance_name :str) -> str:
-        session = get_boto_session()
-        client = session.client("ec2")
+    def create_security_group(instance_name :str, region_name :str=None) -> str:
+        client = get_boto_client("ec2", region_name=region_name)
 
         # NOTE groupNames are prefixed with: "rxtb-"
         response = client.create_security_group(
@@ -661,9 +2114,8 @@ class EC2(object):
         return group_id
 
     @staticmethod
-    def get_or_create_security_group(instance_name :str) -> str:
-        session = get_boto_session()
-        client = session.client("ec2")
+    def get_or_create_security_group(instance_name :str, region_name :str=None) -> str:
+        client = get_boto_client("ec2", region_name=region_name)
 
         # NOTE groupNames are prefixed with: "rxtb-"
         response = client.describe_security_groups(
@@ -682,22 +2134,23 @@ class EC2(object):
 
         if len(response["SecurityGroups"]) <= 0:
             print("Creating sg")
-            group_id = EC2.create_security_group(instance_name)
+            group_id = EC2.create_security_group(instance_name, region_name=region_name)
         else:
             group_id = response["SecurityGroups"][0]["GroupId"]
 
         return group_id
 
     @staticmethod
-    def update_ingress_rules(security_group_id :str, ports :List[dict]):
+    def update_ingress_rules(security_group_id :str, ports :List[dict], region_name :str=None):
         """Update ingress rules
         Args:
             security_group_id : security group id
             ports             : list of ports in format: {"port": 22, "protocol": "tcp"}
+            region_name       : (optional) region of the security group
         Returns:
             None
         """
-        session = get_boto_session()
+        session = get_boto_session(region_name=region_name)
         security_group = session.resource("ec2").SecurityGroup(security_group_id)
 
         ports = copy.deepcopy(ports)
@@ -730,15 +2183,14 @@ class EC2(object):
                 )
 
     @staticmethod
-    def create_key_pair() -> Tuple[str, str]:
+    def create_key_pair(region_name :str=None) -> Tuple[str, str]:
         """Create an SSH key-pair
         Args:
-            None
+            region_name : (optional) region of the key-pair
         Returns:
             (key name, fingerprint)
         """
-        session = get_boto_session()
-        client = session.client("ec2")
+        client = get_boto_client("ec2", region_name=region_name)
 
         project_name = config.project_name
 
@@ -757,9 +2209,9 @@ class EC2(object):
         return (response["KeyName"], response["KeyMaterial"])
 
     @staticmethod
-    def verify_key_pair_name(key_name :str) -> bool:
-        session = get_boto_session()
-        client = session.client("ec2")
+    def verify_key_pair_name(key_name :str, region_name :str=None) -> bool:
+        import botocore.exceptions
+        client = get_boto_client("ec2", region_name=region_name)
 
         try:
             response = client.describe_key_pairs(
@@ -772,11 +2224,41 @@ class EC2(object):
         return True
 
     @staticmethod
-    def get_valid_key_pair_name() -> str:
+    def import_key_pair(key_name :str, private_key :str, region_name :str=None) -> Optional[str]:
+        """Import the public part of a private key as key_name
+        Returns:
+            key name or None if it could not be imported
+        """
+        import botocore.exceptions
+        client = get_boto_client("ec2", region_name=region_name)
+
+        res = subprocess.run(['ssh-keygen', '-y', '-f', ssh.get_key_path(private_key)],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+        if res.returncode != 0:
+            return None
+
+        try:
+            response = client.import_key_pair(
+                KeyName=key_name,
+                PublicKeyMaterial=res.stdout,
+            )
+        except botocore.exceptions.ClientError as e:
+            return None
+
+        return response["KeyName"]
+
+    @staticmethod
+    def get_valid_key_pair_name(region_name :str=None) -> str:
         # load existing key if any
-        ssh_key_name = config.get_ssh_key().get("key_name", None)
-        if ssh_key_name == None or EC2.verify_key_pair_name(ssh_key_name) == False:
-            key_name, private_key = EC2.create_key_pair()
+        ssh_key = config.get_ssh_key() or {}
+        ssh_key_name = ssh_key.get("key_name", None)
+        if ssh_key_name is not None and EC2.verify_key_pair_name(ssh_key_name, region_name=region_name) == False:
+            # Key pairs are per region, reuse the configured key in this region
+            ssh_key_name = EC2.import_key_pair(ssh_key_name, ssh_key["private_key"], region_name=region_name)
+
+        if ssh_key_name == None:
+            key_name, private_key = EC2.create_key_pair(region_name=region_name)
             config.add_ssh_key(key_name, private_key)
             ssh_key_name = key_name
 
@@ -1,8 +1,7 @@
-from rixtribute.helper import get_boto_session, generate_tags
+from rixtribute.helper import get_boto_session, get_boto_client, generate_tags
 from rixtribute.configuration import config
 from rixtribute import aws_helper
 from typing import List, Optional
-from botocore import errorfactory
 import base64
 
 class ECRRepo(object):
@@ -73,8 +72,7 @@ class ECR(object):
 
     @classmethod
     def _get_ecr_boto_client(cls, region_name :str=None):
-        session = cls._get_session(region_name=region_name)
-        client = session.client("ecr")
+        client = get_boto_client("ecr", region_name=region_name)
         return client
 
     @classmethod
@@ -89,6 +87,23 @@ class ECR(object):
             return ECRRepo(repo)
         return None
 
+    @classmethod
+    def get_image_digest(cls, repository_name :str, image_tag :str="latest", region_name :str=None) -> Optional[str]:
+        """Digest of the image tagged image_tag, None if there is no such image"""
+        ecr = cls._get_ecr_boto_client(region_name=region_name)
+        try:
+            response = ecr.describe_images(repositoryName=repository_name,
+                                           imageIds=[{'imageTag': image_tag}])
+        except (ecr.exceptions.ImageNotFoundException,
+                ecr.exceptions.RepositoryNotFoundException):
+            return None
+
+        assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+
+        for image in response["imageDetails"]:
+            return image["imageDigest"]
+        return None
+
     @classmethod
     def list_repositories(cls, filter_project_name :str=None, region_name :str=None):
         """List repositories"""
@@ -1,10 +1,35 @@
-import boto3
-import urllib.request
 from .configuration import config, profile
-from typing import List
+from typing import Dict, List
+import threading
 import uuid
 
-def get_boto_session(region_name :str=None):
+# Process-wide pool of boto3 sessions and clients.
+# Building a session re-reads the credential files and every new client
+# re-loads the botocore service model, so both are created once per
+# (provider config, region, service) and reused for the rest of the process.
+_boto_pool_lock = threading.RLock()
+_boto_session_pool :Dict[tuple, object] = {}
+_boto_client_pool :Dict[tuple, object] = {}
+
+# Limits of every AWS call made through a pooled client, so a hanging region
+# or endpoint fails that call instead of blocking its caller indefinitely
+BOTO_CONNECT_TIMEOUT = 5
+BOTO_READ_TIMEOUT = 30
+BOTO_MAX_ATTEMPTS = 3
+
+def _get_provider_key() -> tuple:
+    """Key identifying the credentials configured in the provider section"""
+    provider = config.get_provider()
+    aws_config = provider["config"]
+    return (provider["name"],
+            aws_config.get("profile_name", None),
+            aws_config.get("access_key", None),
+            aws_config.get("secret_key", None))
+
+def _create_boto_session(region_name :str=None):
+    # boto3 is slow to import, only pay for it when AWS is used
+    import boto3
+
     provider = config.get_provider()
     aws_config = provider["config"]
 
@@ -23,6 +48,70 @@ def get_boto_session(region_name :str=None):
     else:
         return boto3.Session(region_name=region_name)
 
+def get_boto_session(region_name :str=None):
+    """Get a pooled boto3 session for region_name
+    Args:
+        region_name : (optional) e.g. eu-west-1, None uses the profile default
+    Returns:
+        boto3.Session shared by the whole process
+    """
+    key = (_get_provider_key(), region_name)
+    with _boto_pool_lock:
+        session = _boto_session_pool.get(key, None)
+        if session is None:
+            session = _create_boto_session(region_name=region_name)
+            _boto_session_pool[key] = session
+        return session
+
+def get_boto_client(service_name :str, region_name :str=None):
+    """Get a pooled boto3 client, clients are thread-safe and can be shared
+    Args:
+        service_name : e.g. ec2, ecr, pricing
+        region_name  : (optional) e.g. eu-west-1, None uses the profile default
+    Returns:
+        botocore client
+    """
+    key = (_get_provider_key(), region_name, service_name)
+    with _boto_pool_lock:
+        client = _boto_client_pool.get(key, None)
+        if client is None:
+            # boto3 sessions are not thread-safe, so clients are created under the lock
+            from botocore.config import Config
+
+            session = get_boto_session(region_name=region_name)
+            client = session.client(service_name, config=Config(
+                connect_timeout=BOTO_CONNECT_TIMEOUT,
+                read_timeout=BOTO_READ_TIMEOUT,
+                retries={'max_attempts': BOTO_MAX_ATTEMPTS, 'mode': 'standard'},
+            ))
+            _boto_client_pool[key] = client
+        return client
+
+def invalidate_boto_sessions(region_name :str=None, service_name :str=None):
+    """Drop pooled sessions/clients, e.g. after credentials have changed
+    Args:
+        region_name  : (optional) only drop entries for this region
+        service_name : (optional) only drop clients for this service
+    Returns:
+        None
+    """
+    with _boto_pool_lock:
+        for key in list(_boto_client_pool.keys()):
+            _, client_region, client_service = key
+            if region_name is not None and client_region != region_name:
+                continue
+            if service_name is not None and client_service != service_name:
+                continue
+            del _boto_client_pool[key]
+
+        # Sessions are only dropped when not narrowed down to a single service
+        if service_name is None:
+            for key in list(_boto_session_pool.keys()):
+                _, session_region = key
+                if region_name is not None and session_region != region_name:
+                    continue
+                del _boto_session_pool[key]
+
 def generate_tags(name :str):
     #TODO: Check if aws or Google
     project_name = config.get_project()["name"]
@@ -55,6 +144,7 @@ def print_process():
         sys.stdout.flush()
 
 def get_external_ip() -> str:
+    import urllib.request
     resp = urllib.request.urlopen('http://checkip.amazonaws.com/')
     if resp.status != 200:
         return ''
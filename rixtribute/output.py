@@ -0,0 +1,93 @@
+import sys
+import json
+import numbers
+from typing import List, Optional
+
+# Output formats for listings
+OUTPUT_FORMATS = ["table", "jsonl", "tsv"]
+
+def _to_str(value) -> str:
+    if value is None:
+        return ''
+    return str(value)
+
+def format_table(rows :List[dict], index :bool=True) -> str:
+    """Render list of dicts as a plain columnar table
+    Args:
+        rows  : list of dicts, e.g. from EC2Instance.get_printable_dict()
+        index : prefix rows with their index, used for choosing a row
+    Returns:
+        str e.g.
+                name      provider
+            --  --------  ----------
+             0  gpu-iptc  aws
+    """
+    if len(rows) <= 0:
+        return ''
+
+    # Column order is the order keys are first seen in
+    headers :List[str] = []
+    for row in rows:
+        for k in row.keys():
+            if k not in headers:
+                headers.append(k)
+
+    columns = [[_to_str(row.get(k, None)) for row in rows] for k in headers]
+    numeric = [all(isinstance(row.get(k, None), numbers.Number) for row in rows) for k in headers]
+
+    if index is True:
+        headers = [''] + headers
+        columns = [[str(i) for i in range(len(rows))]] + columns
+        numeric = [True] + numeric
+
+    widths = [max([len(h)] + [len(x) for x in col]) for h, col in zip(headers, columns)]
+
+    def _align(value :str, width :int, right :bool) -> str:
+        return value.rjust(width) if right else value.ljust(width)
+
+    lines = ['  '.join(_align(h, w, r) for h, w, r in zip(headers, widths, numeric)).rstrip(),
+             '  '.join('-' * w for w in widths)]
+    for i in range(len(rows)):
+        lines.append('  '.join(_align(col[i], w, r)
+                               for col, w, r in zip(columns, widths, numeric)).rstrip())
+
+    return '\n'.join(lines)
+
+def format_jsonl(rows :List[dict]) -> str:
+    """One json object per row, values that aren't json types are stringified"""
+    return '\n'.join(json.dumps(row, default=str) for row in rows)
+
+def format_tsv(rows :List[dict]) -> str:
+    """Tab separated with a header line, tabs and newlines in values are escaped"""
+    if len(rows) <= 0:
+        return ''
+
+    headers :List[str] = []
+    for row in rows:
+        for k in row.keys():
+            if k not in headers:
+                headers.append(k)
+
+    def _escape(value) -> str:
+        return _to_str(value).replace('\t', '\\t').replace('\n', '\\n')
+
+    lines = ['\t'.join(headers)]
+    for row in rows:
+        lines.append('\t'.join(_escape(row.get(k, None)) for k in headers))
+    return '\n'.join(lines)
+
+def print_rows(rows :List[dict], output_format :str="table", index :bool=True, file=None):
+    """Print list of dicts in one of OUTPUT_FORMATS"""
+    file = sys.stdout if file is None else file
+
+    if output_format == "table":
+        text = format_table(rows, index=index)
+    elif output_format == "jsonl":
+        text = format_jsonl(rows)
+    elif output_format == "tsv":
+        text = format_tsv(rows)
+    else:
+        raise Exception(f"Unknown output format: {output_format}, expected one of {OUTPUT_FORMATS}")
+
+    if text:
+        print(text, file=file)
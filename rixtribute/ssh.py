@@ -1,8 +1,148 @@
 import os
+import sys
+import queue
 import shlex
 import subprocess
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 import tempfile
+import hashlib
+import threading
+import atexit
+
+# SSH connection multiplexing, the first ssh/scp to a host starts a master
+# connection that later ssh/scp calls reuse instead of doing a new TCP and
+# key exchange handshake. The master exits when idle for CONTROL_PERSIST.
+CONTROL_PERSIST = os.environ.get("RIXTRIBUTE_SSH_PERSIST", "10m")
+
+def get_control_dir() -> str:
+    """Directory for the ssh control sockets, only accessible by the user
+    Kept in the tmp dir since unix socket paths are limited to ~100 chars
+    """
+    control_dir = os.path.join(tempfile.gettempdir(), f"rxtb-ssh-{os.getuid()}")
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    return control_dir
+
+def generate_control_options(persist :str=None) -> List[str]:
+    """ssh options for sharing one connection per user@host:port
+    Args:
+        persist : (optional) idle time before the master exits e.g. 10m, default CONTROL_PERSIST
+    """
+    persist = CONTROL_PERSIST if persist is None else persist
+    # %C is a hash of local host, remote host, port and user
+    control_path = os.path.join(get_control_dir(), "%C")
+    return ['-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={control_path}',
+            '-o', f'ControlPersist={persist}']
+
+def _control_command(operation :str, host :str, user :str, port :int=22) -> List[str]:
+    control_path = os.path.join(get_control_dir(), "%C")
+    return ['ssh', '-O', operation,
+            '-o', f'ControlPath={control_path}',
+            '-p', str(port),
+            f'{user}@{host}']
+
+def check_control_master(host :str, user :str, port :int=22) -> bool:
+    """True if there is a live master connection to user@host:port"""
+    res = subprocess.run(_control_command("check", host, user, port),
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL)
+    return res.returncode == 0
+
+def close_control_master(host :str, user :str, port :int=22) -> bool:
+    """Close the master connection to user@host:port, if any"""
+    if not check_control_master(host, user, port):
+        return False
+    res = subprocess.run(_control_command("exit", host, user, port),
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL)
+    return res.returncode == 0
+
+# Private keys are written once per process to a 0600 file in the control dir
+# and reused by every ssh/scp call, the files are removed when rxtb exits
+_key_paths :dict = {}
+_key_paths_lock = threading.Lock()
+# Hashes of the keys loaded into ssh-agent by this process
+_agent_keys :set = set()
+_agent_lock = threading.Lock()
+# Serializes output lines of commands running concurrently on several hosts
+_print_lock = threading.Lock()
+
+# Names of the output streams of CommandStream
+STDOUT = "stdout"
+STDERR = "stderr"
+
+def get_key_path(key_str :str) -> str:
+    """Path of an identity file holding key_str, created on first use
+    Args:
+        key_str : private key e.g. from config.get_ssh_key()["private_key"]
+    Returns:
+        str path to the key file
+    """
+    key_hash = _key_hash(key_str)
+    with _key_paths_lock:
+        key_path = _key_paths.get(key_hash, None)
+        if key_path is not None and os.path.isfile(key_path):
+            return key_path
+
+        key_path = os.path.join(get_control_dir(), f"key-{key_hash}-{os.getpid()}")
+        if os.path.exists(key_path):
+            os.remove(key_path)
+        # Create with 0600 directly, so the key is never readable by others
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(key_str)
+            if not key_str.endswith("\n"):
+                f.write("\n")
+
+        _key_paths[key_hash] = key_path
+        return key_path
+
+def _key_hash(key_str :str) -> str:
+    return hashlib.sha256(key_str.encode("utf8")).hexdigest()[:16]
+
+def add_key_to_agent(key_str :str, lifetime :str=None) -> bool:
+    """Load key_str into the running ssh-agent, if there is one, once per
+    process. The key file is removed again when the agent holds the key, so
+    ssh/scp then authenticate through the agent without an identity file.
+    Args:
+        key_str  : private key
+        lifetime : (optional) ssh-add -t lifetime e.g. 1h, default CONTROL_PERSIST
+    Returns:
+        bool True if the agent holds the key
+    """
+    if os.environ.get("SSH_AUTH_SOCK", None) is None:
+        return False
+
+    key_hash = _key_hash(key_str)
+    with _agent_lock:
+        if key_hash in _agent_keys:
+            return True
+
+        lifetime = CONTROL_PERSIST if lifetime is None else lifetime
+        key_path = get_key_path(key_str)
+        res = subprocess.run(['ssh-add', '-q', '-t', lifetime, key_path],
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL)
+        if res.returncode != 0:
+            return False
+
+        with _key_paths_lock:
+            _key_paths.pop(key_hash, None)
+            os.remove(key_path)
+        _agent_keys.add(key_hash)
+        return True
+
+def remove_key_files():
+    """Remove the key files written by this process"""
+    with _key_paths_lock:
+        for key_path in _key_paths.values():
+            try:
+                os.remove(key_path)
+            except OSError:
+                pass
+        _key_paths.clear()
+
+atexit.register(remove_key_files)
 
 def generate_scp_command(source_files :List[str],
                          destination :str,
@@ -10,7 +150,8 @@ def generate_scp_command(source_files :List[str],
                          port :int=22,
                          key_path :str=None,
                          skip_host_check :bool=False,
-                         no_verbose :bool=True):
+                         no_verbose :bool=True,
+                         multiplex :bool=True):
 
     # TODO support for more custom args
 
@@ -32,6 +173,9 @@ def generate_scp_command(source_files :List[str],
     if no_verbose is True:
         cmd = cmd + ['-q']
 
+    if multiplex is True:
+        cmd = cmd + generate_control_options()
+
     # Add source
     cmd = cmd + source_files
     # add dest
@@ -45,7 +189,8 @@ def generate_ssh_command(host :str,
                          key_path :str=None,
                          command :str=None,
                          skip_host_check :bool=False,
-                         no_verbose :bool=True):
+                         no_verbose :bool=True,
+                         multiplex :bool=True):
     # If key is specified
     if key_path:
         cmd = ['ssh', '-ti', key_path]
@@ -61,6 +206,9 @@ def generate_ssh_command(host :str,
     if no_verbose is True:
         cmd = cmd + ['-q']
 
+    if multiplex is True:
+        cmd = cmd + generate_control_options()
+
     # TODO support for more custom args
     cmd = cmd + [f'{user}@{host}']
 
@@ -69,6 +217,63 @@ def generate_ssh_command(host :str,
 
     return cmd
 
+def generate_ssh_transport(port :int=22,
+                           key_path :str=None,
+                           skip_host_check :bool=True,
+                           multiplex :bool=True) -> List[str]:
+    """ssh command without a tty and destination, for piping data through
+    ssh or as the remote shell of rsync -e
+    """
+    cmd = ['ssh', '-q', '-o', 'BatchMode=yes']
+
+    if key_path:
+        cmd = cmd + ['-i', key_path]
+
+    if skip_host_check is True:
+        cmd = cmd + ['-o', 'StrictHostKeyChecking=no']
+
+    if port != 22:
+        cmd = cmd + ['-p', str(port)]
+
+    if multiplex is True:
+        cmd = cmd + generate_control_options()
+
+    return cmd
+
+def generate_ssh_pipe_command(host :str,
+                              user :str,
+                              command :str,
+                              port :int=22,
+                              key_path :str=None) -> List[str]:
+    """argv running command remotely with stdin/stdout connected to the local process"""
+    return generate_ssh_transport(port=port, key_path=key_path) + [f'{user}@{host}', command]
+
+def probe(host :str,
+          user :str,
+          command :str="true",
+          port :int=22,
+          key_path :str=None,
+          connect_timeout :int=5) -> Optional[int]:
+    """Run a quick non-interactive command on the host
+    Returns:
+        exit code of command or None if ssh could not connect
+    """
+    cmd = (generate_ssh_transport(port=port, key_path=key_path)
+           + ['-o', f'ConnectTimeout={connect_timeout}', f'{user}@{host}', command])
+    try:
+        res = subprocess.run(cmd,
+                             stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL,
+                             timeout=connect_timeout * 3)
+    except subprocess.TimeoutExpired:
+        return None
+
+    # ssh exits with 255 on connection and authentication errors
+    if res.returncode == 255:
+        return None
+    return res.returncode
+
 
 def attach_tmux_session_and_run_command(session_name :str, command :str) -> str:
     # -s = session name, -n = window name
@@ -82,8 +287,10 @@ def attach_tmux_session_and_run_command(session_name :str, command :str) -> str:
         f'fi'
     )
 
+    # Quoted once for the remote shell, tmux types command as is into the
+    # session's shell, which is the one that interprets it
     tmux_run_command = (
-        f'tmux send-keys -t "{session_name}":main \"{command}\" Enter \; '
+        f'tmux send-keys -t "{session_name}":main {shlex.quote(command)} Enter \\; '
     )
 
     tmux_attach_cmd = f"tmux attach-session -t {session_name}"
@@ -102,43 +309,151 @@ def ssh_command_tmux(host :str,
     remote_cmd = attach_tmux_session_and_run_command("automated-session", command)
 
     if key_str != None:
-        f = tempfile.NamedTemporaryFile(suffix='_temp', prefix='rxtb_', delete=True)
-        f.write(key_str.encode("utf8"))
-        f.flush()
-        key_path = f.name
+        key_path = get_key_path(key_str)
 
+    # argv without a local shell, so remote_cmd reaches the remote shell unchanged
     cmd = generate_ssh_command(host=host,
                                user=user,
                                port=port,
                                key_path=key_path,
                                skip_host_check=True,
-                               command=remote_cmd)
-    subprocess.call(" ".join(cmd), shell=True)
-
+                               command=None)
+    subprocess.call(cmd + [remote_cmd])
+
+
+class CommandStream(object):
+    """Output of a running command as (stream, line) tuples in the order the
+    lines arrive, stream is STDOUT or STDERR. At most max_lines are buffered,
+    when the consumer falls behind the readers block, which in turn stops the
+    remote side once the pipe and TCP buffers are full. Lines are appended to
+    tee_path as they are consumed.
+
+        stream = ssh.stream_command(host, user, "ls -la")
+        for name, line in stream:
+            print(line)
+        stream.returncode
+    """
+
+    def __init__(self, cmd :List[str], tee_path :str=None, max_lines :int=1000):
+        self.returncode :Optional[int] = None
+        self._tee_path = tee_path
+        self._lines :queue.Queue = queue.Queue(maxsize=max_lines)
+        self._stopped = threading.Event()
+        self._proc = subprocess.Popen(cmd,
+                                      stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE,
+                                      universal_newlines=True,
+                                      errors="replace",
+                                      bufsize=1)
+        for name, pipe in [(STDOUT, self._proc.stdout), (STDERR, self._proc.stderr)]:
+            threading.Thread(target=self._read, args=(name, pipe), daemon=True).start()
+
+    def _read(self, name :str, pipe):
+        for line in pipe:
+            if not self._stopped.is_set():
+                self._lines.put((name, line.rstrip("\n")))
+        pipe.close()
+        # None marks the end of the stream
+        self._lines.put((name, None))
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        if self.returncode is not None:
+            return
+
+        tee = open(self._tee_path, "a") if self._tee_path else None
+        open_streams = 2
+        try:
+            while open_streams > 0:
+                name, line = self._lines.get()
+                if line is None:
+                    open_streams -= 1
+                    continue
+                if tee is not None:
+                    tee.write(f"{line}\n")
+                yield name, line
+        finally:
+            if tee is not None:
+                tee.close()
+            # Consumer stopped early, kill the command and unblock the readers
+            if open_streams > 0:
+                self._stopped.set()
+                self._proc.kill()
+                while open_streams > 0:
+                    if self._lines.get()[1] is None:
+                        open_streams -= 1
+            self.returncode = self._proc.wait()
+
+    def wait(self) -> int:
+        """Consume the remaining output
+        Returns:
+            exit code of the command
+        """
+        for _ in self:
+            pass
+        return self.returncode
+
+def stream_command(host :str,
+                   user :str,
+                   command :str,
+                   port :int=22,
+                   key_path :str=None,
+                   tee_path :str=None,
+                   max_lines :int=1000) -> CommandStream:
+    """Run command on the host, its output is read from the returned stream
+    while it runs instead of being buffered until it exits. The exit code is
+    255 if ssh could not connect.
+    """
+    cmd = generate_ssh_pipe_command(host=host, user=user, command=command, port=port, key_path=key_path)
+    return CommandStream(cmd, tee_path=tee_path, max_lines=max_lines)
+
+def _print_line(name :str, line :str):
+    with _print_lock:
+        print(line, file=sys.stderr if name == STDERR else sys.stdout, flush=True)
 
 def ssh_command(host :str,
                 user :str,
-                command :Optional[str],
+                command :str,
                 port :int=22,
                 key :str=None,
-                print_output :bool=False):
-    cmd = generate_ssh_command(host=host,
-                               user=user,
-                               port=port,
-                               key_path=key,
-                               skip_host_check=True,
-                               command=command)
-
-    cmd_str = ' '.join(cmd)
-
-    rc, output = subprocess.getstatusoutput(cmd_str)
-    if rc != 0:
-        print(output)
-        return False
-
-    if print_output:
-        print(f"\n{output}")
-    # subprocess.check_output(cmd)
+                print_output :bool=False,
+                tee_path :str=None) -> int:
+    """Run command on the host, the output is printed as it arrives with
+    print_output, else only if the command fails
+    Returns:
+        exit code of command, 255 if ssh could not connect
+    """
+    stream = stream_command(host=host, user=user, command=command, port=port, key_path=key, tee_path=tee_path)
+
+    lines = []
+    for name, line in stream:
+        if print_output:
+            _print_line(name, line)
+        else:
+            lines.append((name, line))
+
+    if stream.returncode != 0:
+        for name, line in lines:
+            _print_line(name, line)
+
+    return stream.returncode
+
+def ssh_command_prefixed(host :str,
+                         user :str,
+                         command :str,
+                         port :int=22,
+                         key_path :str=None,
+                         prefix :str="",
+                         tee_path :str=None) -> int:
+    """Run command on the host and print the output lines as they arrive,
+    each prefixed with prefix so output of concurrent hosts can be told apart
+    Returns:
+        exit code of command, 255 if ssh could not connect
+    """
+    stream = stream_command(host=host, user=user, command=command, port=port, key_path=key_path, tee_path=tee_path)
+    for name, line in stream:
+        _print_line(name, f"{prefix}{line}")
+    return stream.returncode
 
 def scp(source :List[str],
         dest :str,
@@ -148,10 +463,7 @@ def scp(source :List[str],
         key_str :str=None) -> bool:
 
     if key_str != None:
-        f = tempfile.NamedTemporaryFile(suffix='_temp', prefix='rxtb_', delete=True)
-        f.write(key_str.encode("utf8"))
-        f.flush()
-        key_path = f.name
+        key_path = get_key_path(key_str)
 
     # Generate scp command
     cmd = generate_scp_command(source_files=source,
@@ -174,10 +486,7 @@ def scp(source :List[str],
 def ssh(host :str, user :str, port :int=22, key_path :str=None, key_str :str=None):
     print(f"SSHing into: {host}")
     if key_str != None:
-        f = tempfile.NamedTemporaryFile(suffix='_temp', prefix='rxtb_', delete=True)
-        f.write(key_str.encode("utf8"))
-        f.flush()
-        key_path = f.name
+        key_path = get_key_path(key_str)
 
     command = generate_ssh_command(host=host, user=user, command=None, port=port, key_path=key_path)
     ssh = subprocess.Popen(' '.join(command), shell=True, env=os.environ)
@@ -0,0 +1,220 @@
+import os
+import shlex
+import shutil
+import fnmatch
+import hashlib
+import tempfile
+import subprocess
+from typing import List, Optional, Tuple
+
+from rixtribute import ssh
+from rixtribute.cache import FileCache
+
+def _matches(rel_path :str, globs :List[str]) -> bool:
+    for pattern in globs:
+        if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(os.path.basename(rel_path), pattern):
+            return True
+    return False
+
+def _is_excluded_dir(rel_dir :str, include :List[str], exclude :List[str]) -> bool:
+    """True if nothing below rel_dir is synced, so it doesn't need to be walked
+    A dir is excluded by a glob matching it, e.g. node_modules, or all of its
+    content, e.g. .git/*, unless an include glob could match below it.
+    """
+    dir_globs = [x[:-2] for x in exclude if x.endswith("/*")]
+    if not (_matches(rel_dir, exclude) or _matches(rel_dir, dir_globs)):
+        return False
+
+    for pattern in include:
+        # Globs without a dir, e.g. *.DockerFile, match file names anywhere
+        if '/' not in pattern or _is_glob_prefix(pattern, rel_dir):
+            return False
+    return True
+
+def _is_glob_prefix(pattern :str, rel_dir :str) -> bool:
+    """True if the leading dirs of pattern match rel_dir"""
+    depth = rel_dir.count('/') + 1
+    parts = pattern.split('/')
+    return len(parts) > depth and fnmatch.fnmatch(rel_dir, '/'.join(parts[:depth]))
+
+def collect_files(root :str, include :List[str], exclude :List[str]) -> List[str]:
+    """Files below root to sync, include globs take precedence over exclude globs
+    Args:
+        root    : project root
+        include : globs relative to root, always synced
+        exclude : globs relative to root (or file names), not synced, excluded
+                  dirs are not walked
+    Returns:
+        sorted list of paths relative to root
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        rel_dir = '' if rel_dir == '.' else rel_dir
+
+        # Prune in place, so os.walk doesn't descend into excluded dirs
+        dirnames[:] = [x for x in dirnames if not _is_excluded_dir(os.path.join(rel_dir, x), include, exclude)]
+
+        for filename in filenames:
+            rel_path = os.path.join(rel_dir, filename)
+            if _matches(rel_path, exclude) and not _matches(rel_path, include):
+                continue
+            if os.path.islink(os.path.join(root, rel_path)):
+                continue
+            files.append(rel_path)
+
+    return sorted(files)
+
+def file_sha256(path :str, chunk_size :int=1024*1024) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def diff_manifest(root :str, files :List[str], manifest :dict) -> Tuple[List[str], List[str], dict]:
+    """Compare files against the manifest of the last sync
+    Files with unchanged size and mtime are trusted, otherwise their content
+    hash decides if they changed.
+    Returns:
+        (changed files, deleted files, new manifest)
+    """
+    changed = []
+    new_manifest = {}
+    for rel_path in files:
+        stat = os.stat(os.path.join(root, rel_path))
+        entry = manifest.get(rel_path, None)
+
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            new_manifest[rel_path] = entry
+            continue
+
+        sha256 = file_sha256(os.path.join(root, rel_path))
+        new_manifest[rel_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+        if entry is None or entry["sha256"] != sha256:
+            changed.append(rel_path)
+
+    deleted = sorted(set(manifest.keys()) - set(new_manifest.keys()))
+    return changed, deleted, new_manifest
+
+
+class ProjectSync(object):
+    """Sync the project root to a remote directory, only sending changed files
+
+    A manifest of the synced files (size, mtime, sha256) is kept per instance
+    and destination in the cache dir. Changed files are sent with rsync when
+    available (delta transfer, compressed) and otherwise as a gzipped tar
+    stream over ssh. Both reuse the multiplexed ssh connection.
+    """
+
+    def __init__(self,
+                 instance_id :str,
+                 host :str,
+                 user :str,
+                 dest :str,
+                 root :str,
+                 include :List[str],
+                 exclude :List[str],
+                 port :int=22,
+                 key_path :str=None):
+        self.host = host
+        self.user = user
+        self.dest = dest
+        self.root = root
+        self.include = include
+        self.exclude = exclude
+        self.port = port
+        self.key_path = key_path
+
+        self._manifest_cache = FileCache(f"sync-manifest-{instance_id}")
+        self._manifest_key = FileCache.make_key(dest)
+
+    def sync(self, full :bool=False, delete :bool=True, verbose :bool=False) -> bool:
+        """Send files changed since the last sync
+        Args:
+            full    : ignore the manifest and send all files
+            delete  : remove remote files that were synced before but are gone locally
+            verbose : print the files sent
+        Returns:
+            bool True on success
+        """
+        manifest = {} if full else self._manifest_cache.get(self._manifest_key, {})
+
+        files = collect_files(self.root, self.include, self.exclude)
+        changed, deleted, new_manifest = diff_manifest(self.root, files, manifest)
+
+        print(f"{len(changed)} changed, {len(deleted)} deleted of {len(files)} files")
+        if verbose:
+            print(*[f"  {x}" for x in changed], sep='\n')
+
+        if len(changed) > 0:
+            if shutil.which("rsync") is not None:
+                success = self._send_rsync(changed)
+            else:
+                success = self._send_tar(changed)
+            if not success:
+                return False
+
+        if delete is True and len(deleted) > 0:
+            if not self._delete_remote(deleted):
+                return False
+
+        self._manifest_cache.set(self._manifest_key, new_manifest)
+        return True
+
+    def _ssh_command(self, command :str) -> List[str]:
+        return ssh.generate_ssh_pipe_command(host=self.host,
+                                             user=self.user,
+                                             command=command,
+                                             port=self.port,
+                                             key_path=self.key_path)
+
+    def _send_rsync(self, files :List[str]) -> bool:
+        with tempfile.NamedTemporaryFile('w', prefix='rxtb_', suffix='_files') as f:
+            f.write('\n'.join(files) + '\n')
+            f.flush()
+
+            transport = ssh.generate_ssh_transport(port=self.port, key_path=self.key_path)
+            cmd = ['rsync', '-az',
+                   '--files-from', f.name,
+                   '--rsync-path', f'mkdir -p {shlex.quote(self.dest)} && rsync',
+                   '-e', ' '.join(shlex.quote(x) for x in transport),
+                   self.root.rstrip('/') + '/',
+                   f'{self.user}@{self.host}:{self.dest}/']
+
+            res = subprocess.run(cmd, stderr=subprocess.PIPE, universal_newlines=True)
+            if res.returncode != 0:
+                print(res.stderr)
+                return False
+        return True
+
+    def _send_tar(self, files :List[str]) -> bool:
+        remote_cmd = f'mkdir -p {shlex.quote(self.dest)} && tar -xzf - -C {shlex.quote(self.dest)}'
+
+        tar = subprocess.Popen(['tar', '-czf', '-', '-C', self.root, '-T', '-'],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+        remote = subprocess.Popen(self._ssh_command(remote_cmd),
+                                  stdin=tar.stdout,
+                                  stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+        # Let tar receive SIGPIPE if ssh exits early
+        tar.stdout.close()
+        tar.stdin.write('\n'.join(files).encode('utf8') + b'\n')
+        tar.stdin.close()
+
+        _, remote_err = remote.communicate()
+        tar.wait()
+        if tar.returncode != 0 or remote.returncode != 0:
+            print(remote_err)
+            return False
+        return True
+
+    def _delete_remote(self, files :List[str]) -> bool:
+        paths = ' '.join(shlex.quote(x) for x in files)
+        remote_cmd = f'cd {shlex.quote(self.dest)} && rm -f -- {paths}'
+        res = subprocess.run(self._ssh_command(remote_cmd), stderr=subprocess.PIPE, universal_newlines=True)
+        if res.returncode != 0:
+            print(res.stderr)
+            return False
+        return True
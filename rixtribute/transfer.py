@@ -0,0 +1,639 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import shlex
+import shutil
+import stat
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from rixtribute import ssh
+from rixtribute.sync import file_sha256
+
+# Files larger than this are split into ranges sent over separate streams
+DEFAULT_CHUNK_SIZE = 256 * 1024 * 1024
+DEFAULT_STREAMS = 4
+
+# Read/write size when copying a range between the file and the ssh pipe
+_BUFFER_SIZE = 1024 * 1024
+
+# Transfer modes, "tar" streams one compressed tar over a single ssh channel,
+# which avoids a round-trip per file, "ranges" uses the parallel streams
+TRANSFER_MODES = ["auto", "tar", "ranges"]
+# In auto mode recursive copies of at least this many files use tar
+TAR_MIN_FILES = 256
+
+# Downloads of files at least this big are resumable, they are fetched in
+# chunks of at most RESUME_CHUNK_SIZE that are checksummed on both ends
+RESUMABLE_MIN_SIZE = 64 * 1024 * 1024
+RESUME_CHUNK_SIZE = 64 * 1024 * 1024
+
+class PartialDownload(object):
+    """Verified chunks of a resumable download
+
+    Kept in a sidecar file next to the download, so an interrupted download
+    continues with the missing chunks as long as the remote file is unchanged.
+    """
+
+    SUFFIX = ".rxtb-partial"
+
+    def __init__(self, local_path :str, remote_path :str, size :int, mtime :str, chunk_size :int):
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.size = size
+        self.mtime = mtime
+        self.chunk_size = chunk_size
+        # offset -> sha256 of the chunk
+        self.chunks :dict = {}
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self) -> str:
+        return self.local_path + self.SUFFIX
+
+    @classmethod
+    def load_or_create(cls, local_path :str, remote_path :str, size :int, mtime :str, chunk_size :int):
+        """Load the partial download of local_path, or start a new one
+        Returns:
+            (PartialDownload, bool True if resumed)
+        """
+        partial = cls(local_path, remote_path, size, mtime, chunk_size)
+        try:
+            with open(partial.file_path, 'r') as f:
+                state = json.load(f)
+            if (state["remote_path"] == remote_path and state["size"] == size
+                    and state["mtime"] == mtime and state["chunk_size"] == chunk_size
+                    and os.path.getsize(local_path) == size):
+                partial.chunks = {int(k): v for k, v in state["chunks"].items()}
+                return partial, True
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        # Start over
+        with open(local_path, 'wb') as f:
+            f.truncate(size)
+        partial._save()
+        return partial, False
+
+    def is_done(self, offset :int) -> bool:
+        return offset in self.chunks
+
+    def mark_done(self, offset :int, sha256 :str):
+        with self._lock:
+            self.chunks[offset] = sha256
+            self._save()
+
+    def check_chunks(self) -> List[int]:
+        """Re-hash the downloaded chunks of the local file and forget the ones
+        that no longer match their stored sha256
+        Returns:
+            offsets of the forgotten chunks
+        """
+        bad = []
+        with open(self.local_path, 'rb') as f:
+            for offset, sha256 in sorted(self.chunks.items()):
+                f.seek(offset)
+                h = hashlib.sha256()
+                remaining = min(self.chunk_size, self.size - offset)
+                while remaining > 0:
+                    data = f.read(min(_BUFFER_SIZE, remaining))
+                    if not data:
+                        break
+                    h.update(data)
+                    remaining -= len(data)
+                if h.hexdigest() != sha256:
+                    bad.append(offset)
+
+        with self._lock:
+            for offset in bad:
+                del self.chunks[offset]
+            self._save()
+        return bad
+
+    def _save(self):
+        state = {"remote_path": self.remote_path,
+                 "size": self.size,
+                 "mtime": self.mtime,
+                 "chunk_size": self.chunk_size,
+                 "chunks": self.chunks}
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.file_path)
+
+    def remove(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+class TransferItem(object):
+    """A byte range of a file to transfer"""
+
+    def __init__(self,
+                 source :str,
+                 dest :str,
+                 offset :int,
+                 length :int,
+                 size :int,
+                 partial :Optional[PartialDownload]=None):
+        self.source = source
+        self.dest = dest
+        self.offset = offset
+        self.length = length
+        # Total size of the file
+        self.size = size
+        # Set for chunks of resumable downloads
+        self.partial = partial
+
+    def __repr__(self):
+        return f"{self.source}[{self.offset}:{self.offset+self.length}] -> {self.dest}"
+
+def _is_glob(path :str) -> bool:
+    return any(c in path for c in "*?[")
+
+def _remote_path_arg(path :str) -> str:
+    """Quote a remote path, unless it's a glob that should be expanded remotely"""
+    if _is_glob(path):
+        return path
+    return shlex.quote(path)
+
+def _file_mode(path :str) -> int:
+    """Permission bits of a local file"""
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def split_ranges(size :int, chunk_size :int) -> List[Tuple[int, int]]:
+    """Split size bytes into (offset, length) ranges of at most chunk_size"""
+    if size <= 0:
+        return [(0, 0)]
+    return [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+
+
+class ParallelTransfer(object):
+    """Copy files to/from a host over N concurrent ssh streams
+
+    Every file is a work item, files larger than chunk_size are split into
+    ranges that are written in place at their offset on the receiving side,
+    so big files are spread over several streams as well. All streams share
+    the multiplexed ssh connection.
+
+    Downloads of big files are resumable, see PartialDownload, and verified
+    per chunk and end-to-end with sha256.
+    """
+
+    def __init__(self,
+                 host :str,
+                 user :str,
+                 port :int=22,
+                 key_path :str=None,
+                 streams :int=DEFAULT_STREAMS,
+                 chunk_size :int=DEFAULT_CHUNK_SIZE,
+                 mode :str="auto"):
+        if mode not in TRANSFER_MODES:
+            raise Exception(f"Unknown transfer mode: {mode}, expected one of {TRANSFER_MODES}")
+
+        self.host = host
+        self.user = user
+        self.port = port
+        self.key_path = key_path
+        self.streams = max(1, streams)
+        self.chunk_size = chunk_size
+        self.mode = mode
+        self._compression :Optional[Tuple[str, str]] = None
+        self._remote_home :Optional[str] = None
+
+    def _ssh_command(self, command :str) -> List[str]:
+        return ssh.generate_ssh_pipe_command(host=self.host,
+                                             user=self.user,
+                                             command=command,
+                                             port=self.port,
+                                             key_path=self.key_path)
+
+    def _run_remote(self, command :str) -> Tuple[int, str, str]:
+        res = subprocess.run(self._ssh_command(command),
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        return res.returncode, res.stdout, res.stderr
+
+    def _expand_remote_home(self, path :str) -> str:
+        """Replace a leading ~ with the remote home dir, the remote shell doesn't
+        expand ~ in the quoted paths the transfer commands use"""
+        if path != "~" and not path.startswith("~/"):
+            return path
+
+        if self._remote_home is None:
+            rc, out, err = self._run_remote('printf %s "$HOME"')
+            if rc != 0 or not out:
+                raise Exception(f"could not resolve home dir on {self.host}: {err.strip()}")
+            self._remote_home = out.rstrip('/')
+        return self._remote_home + path[1:]
+
+    ############
+    #  Upload  #
+    ############
+
+    def _list_local_files(self, paths :List[str], recursive :bool) -> List[Tuple[str, str, int]]:
+        """(absolute path, path relative to its parent dir, size) of local files"""
+        files = []
+        for path in paths:
+            path = os.path.abspath(path)
+            base = os.path.dirname(path)
+
+            if os.path.isdir(path):
+                if recursive is not True:
+                    print(f"{path}: not a regular file, use recursive")
+                    continue
+                for dirpath, _, filenames in os.walk(path):
+                    for filename in filenames:
+                        abs_path = os.path.join(dirpath, filename)
+                        files.append((abs_path, os.path.relpath(abs_path, base), os.path.getsize(abs_path)))
+            elif os.path.isfile(path):
+                files.append((path, os.path.relpath(path, base), os.path.getsize(path)))
+            else:
+                print(f"{path}: No such file or directory")
+
+        return files
+
+    def _list_local_dirs(self, paths :List[str], recursive :bool) -> List[Tuple[str, str]]:
+        """(absolute path, path relative to its parent dir) of local dirs, including
+        empty ones, below the dirs in paths"""
+        dirs = []
+        if recursive is not True:
+            return dirs
+        for path in paths:
+            path = os.path.abspath(path)
+            base = os.path.dirname(path)
+            if os.path.isdir(path):
+                for dirpath, _, _ in os.walk(path):
+                    dirs.append((dirpath, os.path.relpath(dirpath, base)))
+        return dirs
+
+    def _prepare_remote_files(self, files :List[Tuple[str, int, int]]) -> bool:
+        """Create remote dirs and files of the right size and mode before writing ranges
+        Args:
+            files : (remote path, size, permission bits) of the files
+        """
+        batch_size = 200
+        for i in range(0, len(files), batch_size):
+            batch = files[i:i+batch_size]
+            dirs = sorted(set(os.path.dirname(x) for x, _, _ in batch))
+            commands = [f"mkdir -p {' '.join(shlex.quote(d) for d in dirs)}"]
+            commands += [f"truncate -s {size} {shlex.quote(x)} && chmod {mode:o} {shlex.quote(x)}"
+                         for x, size, mode in batch]
+
+            rc, _, err = self._run_remote(" && ".join(commands))
+            if rc != 0:
+                print(err)
+                return False
+        return True
+
+    def _upload_item(self, item :TransferItem) -> int:
+        remote_cmd = (
+            f"dd of={shlex.quote(item.dest)} bs={_BUFFER_SIZE} conv=notrunc "
+            f"oflag=seek_bytes seek={item.offset} status=none"
+        )
+        proc = subprocess.Popen(self._ssh_command(remote_cmd),
+                                stdin=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        try:
+            with open(item.source, 'rb') as f:
+                f.seek(item.offset)
+                remaining = item.length
+                while remaining > 0:
+                    data = f.read(min(_BUFFER_SIZE, remaining))
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+                    remaining -= len(data)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        err = proc.stderr.read()
+        proc.wait()
+        if proc.returncode != 0:
+            raise Exception(f"upload of {item} failed: {err.decode('utf8', 'replace').strip()}")
+        return item.length
+
+    def _is_remote_dir(self, path :str) -> bool:
+        rc, _, _ = self._run_remote(f"test -d {shlex.quote(path)}")
+        return rc == 0
+
+    def upload(self, paths :List[str], remote_dir :str, recursive :bool=False) -> bool:
+        """Copy local files/dirs into remote_dir, like scp [-r] paths host:remote_dir
+        Args:
+            paths       : local files or dirs
+            remote_dir  : remote destination directory, may start with ~/
+            recursive   : copy directories
+        Returns:
+            bool True on success
+        """
+        remote_dir = self._expand_remote_home(remote_dir)
+        files = self._list_local_files(paths, recursive)
+        if len(files) <= 0:
+            return False
+
+        # Like scp, a single source is copied to remote_dir instead of into it
+        rename = len(paths) == 1 and not self._is_remote_dir(remote_dir)
+
+        if self._use_tar(len(files), recursive) and not (rename and os.path.isfile(paths[0])):
+            return self._upload_tar(files, remote_dir,
+                                    dirs=self._list_local_dirs(paths, recursive),
+                                    strip_components=rename)
+
+        if rename:
+            source = os.path.abspath(paths[0])
+            remote_files = [(os.path.normpath(os.path.join(remote_dir, os.path.relpath(abs_path, source))), size,
+                             _file_mode(abs_path))
+                            for abs_path, _, size in files]
+        else:
+            remote_files = [(os.path.join(remote_dir, rel_path), size, _file_mode(abs_path))
+                            for abs_path, rel_path, size in files]
+
+        if not self._prepare_remote_files(remote_files):
+            return False
+
+        items = []
+        for (abs_path, _, size), (remote_path, _, _) in zip(files, remote_files):
+            for offset, length in split_ranges(size, self.chunk_size):
+                if length > 0:
+                    items.append(TransferItem(abs_path, remote_path, offset, length, size))
+
+        return self._run_items(items, self._upload_item)
+
+    ##############
+    #  Download  #
+    ##############
+
+    def _list_remote_files(self, paths :List[str], recursive :bool) -> Optional[List[Tuple[str, str, int, str, int]]]:
+        """(remote path, path relative to its parent dir, size, mtime, permission bits) of remote files"""
+        files = []
+        for path in paths:
+            base = os.path.dirname(path.rstrip('/'))
+            maxdepth = '' if recursive is True else '-maxdepth 0 '
+            rc, out, err = self._run_remote(f"find {_remote_path_arg(path)} {maxdepth}-type f -printf '%s %T@ %m %p\\n'")
+            if rc != 0:
+                print(err)
+                return None
+
+            for line in out.splitlines():
+                size, mtime, mode, remote_path = line.split(' ', 3)
+                files.append((remote_path, os.path.relpath(remote_path, base), int(size), mtime, int(mode, 8)))
+
+        return files
+
+    def _download_item(self, item :TransferItem) -> int:
+        remote_cmd = (
+            f"dd if={shlex.quote(item.source)} bs={_BUFFER_SIZE} "
+            f"iflag=skip_bytes,count_bytes skip={item.offset} count={item.length} status=none"
+        )
+        if item.partial is not None:
+            # Checksum the chunk remotely while it is being sent, tee passes
+            # the data on to stdout (fd 3) and the sha256 goes to stderr
+            remote_cmd = f"{{ {remote_cmd} | tee /dev/fd/3 | sha256sum >&2; }} 3>&1"
+
+        proc = subprocess.Popen(self._ssh_command(remote_cmd),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+        received = 0
+        h = hashlib.sha256()
+        with open(item.dest, 'r+b') as f:
+            f.seek(item.offset)
+            for data in iter(lambda: proc.stdout.read(_BUFFER_SIZE), b''):
+                f.write(data)
+                h.update(data)
+                received += len(data)
+
+        _, err = proc.communicate()
+        err = err.decode('utf8', 'replace').strip()
+        if proc.returncode != 0 or received != item.length:
+            raise Exception(f"download of {item} failed: {err}")
+
+        if item.partial is not None:
+            # sha256sum prints "<sha256>  -" as the last line
+            remote_sha256 = err.splitlines()[-1].split(' ')[0] if err else ""
+            if remote_sha256 != h.hexdigest():
+                raise Exception(f"download of {item} failed: checksum mismatch")
+            item.partial.mark_done(item.offset, remote_sha256)
+
+        return received
+
+    def download(self, paths :List[str], local_dir :str, recursive :bool=False) -> bool:
+        """Copy remote files/dirs into local_dir, like scp [-r] host:paths local_dir
+        Args:
+            paths       : remote files or dirs, may start with ~/, globs are expanded remotely
+            local_dir   : local destination directory
+            recursive   : copy directories
+        Returns:
+            bool True on success
+        """
+        paths = [self._expand_remote_home(path) for path in paths]
+        files = self._list_remote_files(paths, recursive)
+        if not files:
+            return False
+
+        # Like scp, a single source is copied to local_dir instead of into it
+        rename = len(paths) == 1 and not _is_glob(paths[0]) and not os.path.isdir(local_dir)
+
+        if self._use_tar(len(files), recursive) and not (rename and files[0][0] == paths[0]):
+            return self._download_tar(paths, files, local_dir, strip_components=rename)
+
+        items = []
+        partials = []
+        local_modes = []
+        for remote_path, rel_path, size, mtime, mode in files:
+            if rename:
+                local_path = os.path.normpath(os.path.join(local_dir, os.path.relpath(remote_path, paths[0])))
+            else:
+                local_path = os.path.join(local_dir, rel_path)
+            os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+            local_modes.append((local_path, mode))
+
+            if size < RESUMABLE_MIN_SIZE:
+                with open(local_path, 'wb') as f:
+                    f.truncate(size)
+                for offset, length in split_ranges(size, self.chunk_size):
+                    if length > 0:
+                        items.append(TransferItem(remote_path, local_path, offset, length, size))
+                continue
+
+            chunk_size = min(self.chunk_size, RESUME_CHUNK_SIZE)
+            partial, resumed = PartialDownload.load_or_create(local_path, remote_path, size, mtime, chunk_size)
+            partials.append(partial)
+            if resumed:
+                print(f"Resuming {local_path}, {len(partial.chunks)} of "
+                      f"{len(split_ranges(size, chunk_size))} chunks already downloaded")
+
+            for offset, length in split_ranges(size, chunk_size):
+                if not partial.is_done(offset):
+                    items.append(TransferItem(remote_path, local_path, offset, length, size, partial=partial))
+
+        if not self._run_items(items, self._download_item):
+            # Verified chunks are kept, so running the download again resumes it
+            return False
+
+        if not all([self._verify_download(partial) for partial in partials]):
+            return False
+
+        # Like scp, keep the permission bits e.g. of executables
+        for local_path, mode in local_modes:
+            os.chmod(local_path, mode)
+        return True
+
+    def _verify_download(self, partial :PartialDownload) -> bool:
+        """Compare the sha256 of the whole file on both ends, and finish the
+        partial download if they match"""
+        remote = subprocess.Popen(self._ssh_command(f"sha256sum {shlex.quote(partial.remote_path)}"),
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+        local_sha256 = file_sha256(partial.local_path)
+        out, err = remote.communicate()
+
+        # Keep the verified chunks, running the download again verifies again
+        if remote.returncode != 0:
+            print(err.strip())
+            return False
+
+        if out.split(' ')[0].strip() == local_sha256:
+            partial.remove()
+            return True
+
+        print(f"{partial.local_path}: checksum mismatch with {partial.remote_path}")
+        bad = partial.check_chunks()
+        if len(bad) > 0:
+            print(f"{len(bad)} chunk(s) changed locally since they were downloaded, "
+                  f"run the download again to fetch them")
+        else:
+            # All chunks are as downloaded, so the remote file changed meanwhile
+            partial.remove()
+        return False
+
+    #########
+    #  Tar  #
+    #########
+
+    def _use_tar(self, n_files :int, recursive :bool) -> bool:
+        if self.mode == "auto":
+            return recursive is True and n_files >= TAR_MIN_FILES
+        return self.mode == "tar"
+
+    def _get_compression(self) -> Tuple[str, str]:
+        """(compress, decompress) commands, zstd if both sides have it, else gzip"""
+        if self._compression is None:
+            rc, _, _ = self._run_remote("command -v zstd")
+            if rc == 0 and shutil.which("zstd") is not None:
+                self._compression = ("zstd -q -c -T0", "zstd -q -d -c")
+            else:
+                self._compression = ("gzip -c", "gzip -d -c")
+        return self._compression
+
+    def _upload_tar(self,
+                    files :List[Tuple[str, str, int]],
+                    remote_dir :str,
+                    dirs :List[Tuple[str, str]]=None,
+                    strip_components :bool=False) -> bool:
+        """Stream files and dirs as one compressed tar per source dir and unpack
+        it remotely, dirs are added so empty ones are created as well"""
+        compress, decompress = self._get_compression()
+        strip = " --strip-components=1" if strip_components else ""
+
+        # Group by the dir rel_path is relative to, dirs first
+        groups :dict = {}
+        for abs_path, rel_path in (dirs or []) + [x[:2] for x in files]:
+            base = abs_path[:len(abs_path)-len(rel_path)].rstrip('/') or '/'
+            groups.setdefault(base, []).append(rel_path)
+
+        start = time.time()
+        for base, names in groups.items():
+            with tempfile.NamedTemporaryFile('w', prefix='rxtb_', suffix='_files') as f:
+                f.write('\n'.join(names) + '\n')
+                f.flush()
+
+                # The dirs are listed, so don't add their content again
+                local_cmd = f"tar -cf - --no-recursion -C {shlex.quote(base)} -T {shlex.quote(f.name)} | {compress}"
+                remote_cmd = (
+                    f"mkdir -p {shlex.quote(remote_dir)} && "
+                    f"{decompress} | tar -xf - -C {shlex.quote(remote_dir)}{strip}"
+                )
+                if not self._run_pipe(local_cmd, self._ssh_command(remote_cmd), upload=True):
+                    return False
+
+        self._report(sum(x[2] for x in files), len(files), time.time() - start, streams=1)
+        return True
+
+    def _download_tar(self,
+                      paths :List[str],
+                      files :List[Tuple[str, str, int, str]],
+                      local_dir :str,
+                      strip_components :bool=False) -> bool:
+        """Stream remote paths as a compressed tar and unpack it into local_dir"""
+        compress, decompress = self._get_compression()
+        strip = " --strip-components=1" if strip_components else ""
+
+        os.makedirs(local_dir, exist_ok=True)
+
+        start = time.time()
+        for path in paths:
+            path = path.rstrip('/')
+            base = os.path.dirname(path) or '/'
+            remote_cmd = f"cd {shlex.quote(base)} && tar -cf - {_remote_path_arg(os.path.basename(path))} | {compress}"
+            local_cmd = f"{decompress} | tar -xf - -C {shlex.quote(local_dir)}{strip}"
+            if not self._run_pipe(local_cmd, self._ssh_command(remote_cmd), upload=False):
+                return False
+
+        self._report(sum(x[2] for x in files), len(files), time.time() - start, streams=1)
+        return True
+
+    def _run_pipe(self, local_cmd :str, ssh_cmd :List[str], upload :bool) -> bool:
+        """Connect a local shell pipeline and ssh, local | ssh for uploads, ssh | local for downloads"""
+        if upload:
+            local = subprocess.Popen(local_cmd, shell=True, stdout=subprocess.PIPE)
+            remote = subprocess.Popen(ssh_cmd, stdin=local.stdout, stderr=subprocess.PIPE)
+            local.stdout.close()
+        else:
+            remote = subprocess.Popen(ssh_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            local = subprocess.Popen(local_cmd, shell=True, stdin=remote.stdout)
+            remote.stdout.close()
+
+        err = remote.stderr.read()
+        remote.wait()
+        local.wait()
+        if remote.returncode != 0 or local.returncode != 0:
+            print(err.decode('utf8', 'replace').strip())
+            return False
+        return True
+
+    ############
+    #  Common  #
+    ############
+
+    def _report(self, transferred :int, n_files :int, elapsed :float, streams :int):
+        elapsed = max(elapsed, 1e-6)
+        print(f"Transferred {transferred/1e6:.1f} MB in {n_files} files, {elapsed:.1f}s "
+              f"({transferred/1e6/elapsed:.1f} MB/s over {streams} streams)")
+
+    def _run_items(self, items :List[TransferItem], transfer_fn) -> bool:
+        """Run transfer_fn for all items on the stream pool and report throughput"""
+        # Biggest first, so a large file doesn't end up last on a single stream
+        items = sorted(items, key=lambda x: x.length, reverse=True)
+
+        start = time.time()
+        transferred = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.streams) as executor:
+            futures = {executor.submit(transfer_fn, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    transferred += future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    print(e)
+
+        self._report(transferred, len(set(x.source for x in items)), time.time() - start, self.streams)
+
+        return len(failed) == 0
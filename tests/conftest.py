@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# rixtribute.configuration reads rxtb-profile.yaml on import and prompts for
+# one when it's missing, point it at a throwaway profile before tests import it
+_profile_dir = tempfile.mkdtemp(prefix="rxtb-test-profile-")
+with open(os.path.join(_profile_dir, "rxtb-profile.yaml"), "w") as f:
+    f.write("name: test\nemail: test@example.com\n")
+os.environ["RIXTRIBUTE_PROFILE"] = _profile_dir
@@ -0,0 +1,52 @@
+import multiprocessing
+
+import pytest
+
+from rixtribute.cache import FileCache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("RIXTRIBUTE_CACHE_DIR", str(tmp_path))
+
+
+def test_set_and_get():
+    cache = FileCache("test", ttl=60)
+    cache.set("k", {"a": 1})
+    assert cache.get("k") == {"a": 1}
+    assert FileCache("test").get("k") == {"a": 1}
+    assert cache.get("k", ttl=-1) is None
+
+
+def test_writers_keep_each_others_keys():
+    a = FileCache("test")
+    b = FileCache("test")
+    a.get("k0")
+    b.get("k0")
+
+    a.set("k1", 1)
+    b.set("k2", 2)
+    assert FileCache("test").get("k1") == 1
+    assert FileCache("test").get("k2") == 2
+
+    a.delete("k2")
+    assert FileCache("test").get("k1") == 1
+    assert FileCache("test").get("k2") is None
+
+
+def _set_keys(cache_dir, worker):
+    import os
+    os.environ["RIXTRIBUTE_CACHE_DIR"] = cache_dir
+    cache = FileCache("test")
+    for i in range(20):
+        cache.set(f"{worker}-{i}", i)
+
+
+def test_concurrent_processes(tmp_path):
+    processes = [multiprocessing.Process(target=_set_keys, args=(str(tmp_path), worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert len(FileCache("test").items()) == 4 * 20
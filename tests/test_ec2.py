@@ -0,0 +1,42 @@
+import datetime
+
+import pytest
+
+from rixtribute.ec2 import EC2
+
+
+def _point(price, minute, zone="eu-west-1a", instance_type="m5.large"):
+    return {
+        "zone": zone,
+        "instance-type": instance_type,
+        "price": price,
+        "timestamp": datetime.datetime(2020, 1, 1, 12, minute),
+    }
+
+
+def test_aggregate_spot_prices():
+    prices = [_point(p, i) for i, p in enumerate([0.5, 0.1, 0.2, 0.3])] + [_point(0.4, 0, zone="eu-west-1b")]
+    aggregated = {(x["zone"], x["instance-type"]): x for x in EC2.aggregate_spot_prices(iter(prices))}
+
+    a = aggregated[("eu-west-1a", "m5.large")]
+    assert a["price"] == 0.3
+    assert a["price-min"] == 0.1
+    assert a["price-mean"] == pytest.approx(0.275)
+    assert a["price-p95"] == 0.5
+    assert a["samples"] == 4
+
+    b = aggregated[("eu-west-1b", "m5.large")]
+    assert (b["price"], b["price-min"], b["price-p95"], b["samples"]) == (0.4, 0.4, 0.4, 1)
+
+
+def test_aggregate_spot_prices_p95_nearest_rank():
+    # 20 samples, the 19th lowest is the 95th percentile
+    prices = [_point(float(i), i) for i in range(1, 21)]
+    [aggregated] = EC2.aggregate_spot_prices(prices)
+    assert aggregated["price-p95"] == 19.0
+    assert aggregated["price"] == 20.0
+    assert aggregated["price-mean"] == pytest.approx(10.5)
+
+
+def test_aggregate_spot_prices_empty():
+    assert EC2.aggregate_spot_prices([]) == []
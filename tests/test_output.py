@@ -0,0 +1,45 @@
+import json
+
+from rixtribute.output import format_jsonl, format_table, format_tsv
+
+
+ROWS = [
+    {"name": "gpu-iptc", "cpus": 8},
+    {"name": "web", "cpus": 16, "state": "running"},
+]
+
+
+def test_format_table():
+    lines = format_table(ROWS).split("\n")
+    assert lines == [
+        "   name      cpus  state",
+        "-  --------  ----  -------",
+        "0  gpu-iptc     8",
+        "1  web         16  running",
+    ]
+
+
+def test_format_table_without_index():
+    lines = format_table(ROWS, index=False).split("\n")
+    assert lines[0] == "name      cpus  state"
+    assert lines[2] == "gpu-iptc     8"
+
+
+def test_format_empty():
+    assert format_table([]) == ""
+    assert format_tsv([]) == ""
+    assert format_jsonl([]) == ""
+
+
+def test_format_tsv_escapes():
+    rows = [{"name": "a\tb", "note": "x\ny"}, {"name": None}]
+    assert format_tsv(rows).split("\n") == [
+        "name\tnote",
+        "a\\tb\tx\\ny",
+        "\t",
+    ]
+
+
+def test_format_jsonl():
+    lines = format_jsonl(ROWS).split("\n")
+    assert [json.loads(line) for line in lines] == ROWS
@@ -0,0 +1,28 @@
+import click
+import pytest
+
+from rixtribute.commands.run import _parse_params, _substitute
+
+
+def test_substitute_known_keys():
+    values = {"lr": "0.1", "name": "a"}
+    assert _substitute("train.py --lr {lr} --out {name}/{missing}", values) == "train.py --lr 0.1 --out a/{missing}"
+
+
+def test_substitute_leaves_shell_alone():
+    values = {"HOME": "x", "lr": "0.1"}
+    command = "echo ${HOME} {lr} && awk '{print $1}'"
+    assert _substitute(command, values) == "echo ${HOME} 0.1 && awk '{print $1}'"
+
+
+def test_parse_params():
+    assert _parse_params(("lr=0.1,0.01", "seed=1", "expr=a=b")) == {
+        "lr": ["0.1", "0.01"],
+        "seed": ["1"],
+        "expr": ["a=b"],
+    }
+
+
+def test_parse_params_without_value():
+    with pytest.raises(click.BadParameter):
+        _parse_params(("lr",))
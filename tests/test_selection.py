@@ -0,0 +1,73 @@
+import click
+import pytest
+
+from rixtribute.commands.selection import InstanceSelector, map_instances, run_on_instances
+
+
+class FakeInstance(object):
+    def __init__(self, instance_id, instance_name, tags=None):
+        self.instance_id = instance_id
+        self.instance_name = instance_name
+        self.tags = tags or {}
+
+
+INSTANCES = [
+    FakeInstance("i-0", "train-a", {"team": "ml"}),
+    FakeInstance("i-1", "train-b"),
+    FakeInstance("i-2", "web", {"team": "web"}),
+    FakeInstance("i-3", None),
+]
+
+
+def _ids(instances):
+    return [x.instance_id for x in instances]
+
+
+@pytest.mark.parametrize("kwargs,expected", [
+    ({"names": ("web",)}, ["i-2"]),
+    ({"globs": ("train-*",)}, ["i-0", "i-1"]),
+    ({"tags": ("team=ml",)}, ["i-0"]),
+    ({"ids": ("i-3",)}, ["i-3"]),
+    ({"indexes": (1,)}, ["i-1"]),
+    ({"select_all": True}, ["i-0", "i-1", "i-2", "i-3"]),
+    ({"names": ("web",), "indexes": (0,)}, ["i-0", "i-2"]),
+    ({"globs": ("*",)}, ["i-0", "i-1", "i-2", "i-3"]),
+    ({"names": ("missing",)}, []),
+])
+def test_select(kwargs, expected):
+    assert _ids(InstanceSelector(**kwargs).select(INSTANCES)) == expected
+
+
+def test_tag_without_value():
+    with pytest.raises(click.BadParameter):
+        InstanceSelector(tags=("team",))
+
+
+def test_is_empty():
+    assert InstanceSelector().is_empty()
+    assert not InstanceSelector(ids=("i-0",)).is_empty()
+
+
+def test_choose_single():
+    assert _ids(InstanceSelector(names=("web",)).choose(INSTANCES, "ssh", single=True)) == ["i-2"]
+    with pytest.raises(SystemExit):
+        InstanceSelector(globs=("train-*",)).choose(INSTANCES, "ssh", single=True)
+    with pytest.raises(SystemExit):
+        InstanceSelector(names=("missing",)).choose(INSTANCES, "ssh")
+
+
+def test_map_instances_keeps_order_and_errors():
+    def fn(i, instance):
+        if instance.instance_id == "i-1":
+            raise ValueError("boom")
+        return i
+
+    results = map_instances(INSTANCES, fn)
+    assert [r for r, _ in results] == [0, None, 2, 3]
+    assert isinstance(results[1][1], ValueError)
+
+
+def test_run_on_instances(capsys):
+    assert run_on_instances(INSTANCES, lambda x: True) is True
+    assert run_on_instances(INSTANCES, lambda x: x.instance_id != "i-2") is False
+    assert "web/i-2: failed" in capsys.readouterr().err
@@ -0,0 +1,22 @@
+import os
+import shlex
+import subprocess
+
+from rixtribute import ssh
+
+
+def test_tmux_command_is_typed_unchanged(tmp_path):
+    # Fake tmux recording the keys sent to the session
+    keys_path = tmp_path / "keys"
+    tmux = tmp_path / "tmux"
+    tmux.write_text(f'#!/bin/sh\n[ "$1" = send-keys ] && printf %s "$4" > {keys_path}\nexit 0\n')
+    tmux.chmod(0o755)
+
+    env_value = shlex.quote("RXTB_MSG=it's a b $HOME")
+    command = f'docker run --rm -e {env_value} $DOCKER_IMAGE bash /cmd.sh'
+    remote_cmd = ssh.attach_tmux_session_and_run_command("automated-session", command)
+
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+    subprocess.run(["sh", "-c", remote_cmd], env=env, check=True)
+
+    assert keys_path.read_text() == command
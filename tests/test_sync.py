@@ -0,0 +1,62 @@
+import os
+
+from rixtribute import sync
+from rixtribute.sync import collect_files, diff_manifest
+
+
+def _touch(root, rel_path, content="x"):
+    path = os.path.join(str(root), rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_collect_files(tmp_path):
+    for rel_path in ["main.py", "pkg/mod.py", "pkg/__init__.py", "pkg/mod.pyc",
+                     ".git/HEAD", ".git/objects/ab/cd", "node_modules/a/index.js",
+                     "build/keep.DockerFile", "build/out.o"]:
+        _touch(tmp_path, rel_path)
+
+    files = collect_files(str(tmp_path),
+                          include=["build/*.DockerFile"],
+                          exclude=[".git/*", "node_modules", "__*__.py", "*.pyc", "build/*"])
+
+    assert files == ["build/keep.DockerFile", "main.py", "pkg/mod.py"]
+
+
+def test_collect_files_prunes_excluded_dirs(tmp_path, monkeypatch):
+    for rel_path in ["main.py", ".git/objects/ab/cd", "node_modules/a/b/index.js"]:
+        _touch(tmp_path, rel_path)
+
+    walked = []
+    walk = os.walk
+
+    def _walk(root):
+        for dirpath, dirnames, filenames in walk(root):
+            walked.append(os.path.relpath(dirpath, str(tmp_path)))
+            yield dirpath, dirnames, filenames
+
+    monkeypatch.setattr(sync.os, "walk", _walk)
+
+    assert collect_files(str(tmp_path), include=[], exclude=[".git/*", "node_modules"]) == ["main.py"]
+    assert walked == ["."]
+
+
+def test_diff_manifest(tmp_path):
+    for rel_path in ["a.py", "b.py", "c.py"]:
+        _touch(tmp_path, rel_path)
+
+    changed, deleted, manifest = diff_manifest(str(tmp_path), ["a.py", "b.py", "c.py"], {})
+    assert changed == ["a.py", "b.py", "c.py"]
+    assert deleted == []
+
+    # Touched with the same content is not a change
+    _touch(tmp_path, "a.py", "x")
+    os.utime(os.path.join(str(tmp_path), "a.py"), (1, 1))
+    _touch(tmp_path, "b.py", "changed")
+    os.remove(os.path.join(str(tmp_path), "c.py"))
+
+    changed, deleted, new_manifest = diff_manifest(str(tmp_path), ["a.py", "b.py"], manifest)
+    assert changed == ["b.py"]
+    assert deleted == ["c.py"]
+    assert new_manifest["a.py"]["sha256"] == manifest["a.py"]["sha256"]
@@ -0,0 +1,147 @@
+import os
+import json
+import stat
+
+from rixtribute import transfer as transfer_module
+from rixtribute.transfer import ParallelTransfer, PartialDownload
+
+HOME = "/home/ec2-user"
+
+
+class RecordingTransfer(ParallelTransfer):
+    """ParallelTransfer recording the remote commands instead of running them"""
+
+    def __init__(self, **kwargs):
+        super().__init__(host="host", user="ec2-user", **kwargs)
+        self.commands = []
+
+    def _run_remote(self, command):
+        self.commands.append(command)
+        if command == 'printf %s "$HOME"':
+            return 0, HOME, ""
+        if command.startswith("test -d"):
+            return 0, "", ""
+        if command.startswith("find"):
+            return 0, f"3 1.0 644 {HOME}/workdir/f.txt\n", ""
+        return 0, "", ""
+
+    def _run_items(self, items, transfer_fn):
+        self.items = items
+        return True
+
+
+def test_expand_remote_home():
+    transfer = RecordingTransfer()
+    assert transfer._expand_remote_home("~") == HOME
+    assert transfer._expand_remote_home("~/workdir/") == f"{HOME}/workdir/"
+    assert transfer._expand_remote_home("/workdir/~/x") == "/workdir/~/x"
+    assert transfer._expand_remote_home("~other/x") == "~other/x"
+    # The home dir is resolved once
+    transfer._expand_remote_home("~/other")
+    assert transfer.commands.count('printf %s "$HOME"') == 1
+
+
+def test_upload_to_home_dir(tmp_path):
+    source = tmp_path / "f.txt"
+    source.write_text("abc")
+
+    transfer = RecordingTransfer(mode="ranges")
+    assert transfer.upload([str(source)], "~/workdir/") is True
+
+    assert f"test -d {HOME}/workdir/" in transfer.commands
+    assert not any("'~" in command for command in transfer.commands)
+    assert [item.dest for item in transfer.items] == [f"{HOME}/workdir/f.txt"]
+
+
+def test_download_from_home_dir(tmp_path):
+    transfer = RecordingTransfer(mode="ranges")
+    assert transfer.download(["~/workdir/f.txt"], str(tmp_path)) is True
+
+    assert any(command.startswith(f"find {HOME}/workdir/f.txt ") for command in transfer.commands)
+    assert [item.source for item in transfer.items] == [f"{HOME}/workdir/f.txt"]
+    assert [item.dest for item in transfer.items] == [os.path.join(str(tmp_path), "f.txt")]
+
+
+class LocalTransfer(ParallelTransfer):
+    """ParallelTransfer running the remote commands in a local shell"""
+
+    def __init__(self, fail_verify=False, **kwargs):
+        super().__init__(host="host", user="ec2-user", **kwargs)
+        self.fail_verify = fail_verify
+
+    def _ssh_command(self, command):
+        if self.fail_verify and command.startswith("sha256sum"):
+            return ["sh", "-c", "echo 'connection closed' >&2; exit 255"]
+        return ["sh", "-c", command]
+
+
+def _write_remote_file(tmp_path, size):
+    remote = tmp_path / "remote.bin"
+    remote.write_bytes(os.urandom(size))
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+    return remote, local_dir
+
+
+def test_resumable_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer_module, "RESUMABLE_MIN_SIZE", 1024)
+    remote, local_dir = _write_remote_file(tmp_path, 10 * 1024 + 7)
+
+    assert LocalTransfer(chunk_size=4096, mode="ranges").download([str(remote)], str(local_dir)) is True
+
+    local = local_dir / "remote.bin"
+    assert local.read_bytes() == remote.read_bytes()
+    assert not os.path.exists(str(local) + PartialDownload.SUFFIX)
+
+
+def test_failed_verification_keeps_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer_module, "RESUMABLE_MIN_SIZE", 1024)
+    remote, local_dir = _write_remote_file(tmp_path, 10 * 1024)
+    local = local_dir / "remote.bin"
+    partial_path = str(local) + PartialDownload.SUFFIX
+
+    assert LocalTransfer(fail_verify=True, chunk_size=4096, mode="ranges").download([str(remote)], str(local_dir)) is False
+    assert os.path.exists(partial_path)
+
+    # A changed chunk is fetched again, the others are kept
+    data = bytearray(local.read_bytes())
+    data[5000] ^= 0xff
+    local.write_bytes(bytes(data))
+
+    assert LocalTransfer(chunk_size=4096, mode="ranges").download([str(remote)], str(local_dir)) is False
+    with open(partial_path) as f:
+        assert sorted(json.load(f)["chunks"]) == ["0", "8192"]
+
+    assert LocalTransfer(chunk_size=4096, mode="ranges").download([str(remote)], str(local_dir)) is True
+    assert local.read_bytes() == remote.read_bytes()
+
+
+def test_permissions_are_kept(tmp_path):
+    source = tmp_path / "run.sh"
+    source.write_text("#!/bin/sh\necho hi\n")
+    source.chmod(0o755)
+    remote_dir = tmp_path / "remote"
+    remote_dir.mkdir()
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+
+    assert LocalTransfer(mode="ranges").upload([str(source)], str(remote_dir)) is True
+    assert stat.S_IMODE(os.stat(remote_dir / "run.sh").st_mode) == 0o755
+
+    (remote_dir / "run.sh").chmod(0o750)
+    assert LocalTransfer(mode="ranges").download([str(remote_dir / "run.sh")], str(local_dir)) is True
+    assert stat.S_IMODE(os.stat(local_dir / "run.sh").st_mode) == 0o750
+
+
+def test_tar_upload_creates_empty_dirs(tmp_path):
+    source = tmp_path / "project"
+    (source / "empty" / "nested").mkdir(parents=True)
+    (source / "src").mkdir()
+    (source / "src" / "main.py").write_text("print('hi')\n")
+    remote_dir = tmp_path / "remote"
+    remote_dir.mkdir()
+
+    assert LocalTransfer(mode="tar").upload([str(source)], str(remote_dir), recursive=True) is True
+
+    assert (remote_dir / "project" / "empty" / "nested").is_dir()
+    assert (remote_dir / "project" / "src" / "main.py").read_text() == "print('hi')\n"